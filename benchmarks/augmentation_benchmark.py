@@ -0,0 +1,149 @@
+"""
+Synonym augmentation benchmark for data/augmentation.py
+
+Augments IMDB reviews (or texts from a file, one per line) with nlpaug's
+``SynonymAug(aug_src='wordnet')`` and with ``IndexedSynonymAug`` over a
+``SynonymIndex`` built from the same texts, and reports documents/s for
+both. To check the two draw from the same augmentation distribution, every
+text is augmented under several seeds and the substitutions are compared:
+the number of replaced tokens per document, which words get replaced and
+what they are replaced with. Each comparison is reported as a total
+variation distance, next to the distance between two nlpaug runs with
+different seeds as the noise floor.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import difflib
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data"))
+
+import numpy as np
+import nltk
+
+from augmentation import IndexedSynonymAug, SynonymIndex, example_seed
+
+def load_texts(args):
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()][:args.samples]
+    from datasets import load_dataset
+    dataset = load_dataset("imdb", split="test").shuffle(seed=42).select(range(args.samples))
+    return dataset["text"]
+
+def run_nlpaug(augmenter, texts, seeds):
+    outputs = []
+    for text, seed in zip(texts, seeds):
+        random.seed(seed)
+        np.random.seed(seed % 2**32)
+        augmented = augmenter.augment(text)
+        outputs.append(augmented[0] if augmented else text)
+    return outputs
+
+def run_index(augmenter, texts, seeds, batch_size):
+    outputs = []
+    for start in range(0, len(texts), batch_size):
+        outputs.extend(augmenter.augment_batch(texts[start:start + batch_size], seeds[start:start + batch_size]))
+    return outputs
+
+def substitution_stats(tokenize, texts, outputs):
+    """Replaced-token counts, replaced words and (word, substitute) pairs, from a token diff of each output"""
+    replaced_counts, words, pairs = Counter(), Counter(), Counter()
+    for text, output in zip(texts, outputs):
+        original = tokenize(text)
+        matcher = difflib.SequenceMatcher(a=original, b=tokenize(output), autojunk=False)
+        replaced = 0
+        for opcode, a_start, a_end, b_start, b_end in matcher.get_opcodes():
+            if opcode != "replace":
+                continue
+            replaced += a_end - a_start
+            words.update(original[a_start:a_end])
+            if a_end - a_start == 1:
+                pairs[(original[a_start], " ".join(matcher.b[b_start:b_end]).lower())] += 1
+        replaced_counts[replaced] += 1
+    return {"replaced_per_doc": replaced_counts, "replaced_words": words, "substitutions": pairs}
+
+def total_variation(p, q):
+    p_total, q_total = sum(p.values()) or 1, sum(q.values()) or 1
+    return 0.5 * sum(abs(p[key] / p_total - q[key] / q_total) for key in set(p) | set(q))
+
+def timed(fn, *args):
+    start_time = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start_time
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare nlpaug and indexed synonym augmentation")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--texts", help="File with one text per line instead of IMDB test reviews")
+    parser.add_argument("--trials", type=int, default=3, help="Seeds per text for the distribution comparison")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--index-dir", help="Where to build the synonym index (default: a temporary directory)")
+    parser.add_argument("--output", help="Optional path for a JSON report")
+    args = parser.parse_args()
+
+    import nlpaug.augmenter.word as naw
+    from nlpaug.util.text.tokenizer import Tokenizer
+
+    nltk.download("wordnet", quiet=True)
+    nltk.download("averaged_perceptron_tagger", quiet=True)
+    texts = load_texts(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index, build_seconds = timed(SynonymIndex.build, texts, args.index_dir or tmp)
+        indexed = IndexedSynonymAug(index)
+        nlpaug = naw.SynonymAug(aug_src="wordnet")
+
+        trial_texts = [text for _ in range(args.trials) for text in texts]
+        seeds = [example_seed(text, trial) for trial in range(args.trials) for text in texts]
+        floor_seeds = [example_seed(text, args.trials + trial) for trial in range(args.trials) for text in texts]
+
+        nlpaug_outputs, nlpaug_seconds = timed(run_nlpaug, nlpaug, trial_texts, seeds)
+        floor_outputs, _ = timed(run_nlpaug, nlpaug, trial_texts, floor_seeds)
+        index_outputs, index_seconds = timed(run_index, indexed, trial_texts, seeds, args.batch_size)
+
+    nlpaug_stats = substitution_stats(Tokenizer.tokenizer, trial_texts, nlpaug_outputs)
+    floor_stats = substitution_stats(Tokenizer.tokenizer, trial_texts, floor_outputs)
+    index_stats = substitution_stats(Tokenizer.tokenizer, trial_texts, index_outputs)
+
+    distribution = {
+        name: {
+            "index_vs_nlpaug": total_variation(index_stats[name], nlpaug_stats[name]),
+            "nlpaug_vs_nlpaug": total_variation(floor_stats[name], nlpaug_stats[name]),
+        }
+        for name in nlpaug_stats
+    }
+    report = {
+        "documents": len(trial_texts),
+        "index": dict(index.meta, build_seconds=build_seconds),
+        "nlpaug_docs_per_second": len(trial_texts) / nlpaug_seconds,
+        "index_docs_per_second": len(trial_texts) / index_seconds,
+        "speedup": nlpaug_seconds / index_seconds,
+        "mean_replaced_per_doc": {
+            "nlpaug": sum(k * v for k, v in nlpaug_stats["replaced_per_doc"].items()) / len(trial_texts),
+            "index": sum(k * v for k, v in index_stats["replaced_per_doc"].items()) / len(trial_texts),
+        },
+        "total_variation": distribution,
+    }
+
+    print(f"Index: {index.meta['rows']} rows, {index.meta['substitutes']} substitutes, built in {build_seconds:.1f}s")
+    print(f"{'engine':<10} {'docs/s':>10} {'replaced/doc':>13}")
+    print(f"{'nlpaug':<10} {report['nlpaug_docs_per_second']:>10.1f} {report['mean_replaced_per_doc']['nlpaug']:>13.2f}")
+    print(f"{'index':<10} {report['index_docs_per_second']:>10.1f} {report['mean_replaced_per_doc']['index']:>13.2f}")
+    print(f"Speedup: {report['speedup']:.1f}x")
+    print(f"{'total variation distance':<26} {'index vs nlpaug':>16} {'nlpaug vs nlpaug':>17}")
+    for name, distances in distribution.items():
+        print(f"{name:<26} {distances['index_vs_nlpaug']:>16.4f} {distances['nlpaug_vs_nlpaug']:>17.4f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
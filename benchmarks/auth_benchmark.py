@@ -0,0 +1,136 @@
+"""
+Per-request authentication overhead benchmark for security/api_security.py
+
+Replays requests from a pool of clients that each reuse one API key and one
+JWT, and times the auth path as it was before (plaintext key dict, full JWT
+decode and signature check per request, scope lookup in a list) against the
+current one (hashed key index, verified-token cache, frozenset scopes).
+Overhead is reported per request and as the CPU share it costs at a target
+request rate.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "security"))
+
+import jwt
+from fastapi.security import HTTPAuthorizationCredentials
+
+import api_security
+from api_security import APISecurityManager, require_scope
+
+def legacy_verify_api_key(api_key, keys):
+    if api_key not in keys:
+        raise ValueError("Invalid API key")
+    return keys[api_key]
+
+def legacy_verify_jwt_token(token):
+    payload = jwt.decode(token, api_security.JWT_SECRET_KEY, algorithms=[api_security.JWT_ALGORITHM])
+    exp = payload.get("exp")
+    if exp is None or datetime.fromtimestamp(exp) < datetime.utcnow():
+        raise ValueError("Token has expired")
+    return payload
+
+def legacy_require_scope(required_scope, payload):
+    if required_scope not in payload.get("scopes", []):
+        raise ValueError("Insufficient permissions")
+    return payload
+
+def build_clients(num_clients, num_scopes):
+    scopes = [f"scope-{i}" for i in range(num_scopes)]
+    clients = []
+    plaintext_keys = {}
+    for i in range(num_clients):
+        client_id = f"client-{i}"
+        api_key = APISecurityManager.generate_api_key(client_id, scopes, rate_limit=10**9)
+        token = APISecurityManager.create_jwt_token(client_id, scopes)
+        plaintext_keys[api_key] = {"client_id": client_id, "scopes": scopes}
+        clients.append({
+            "api_key": api_key,
+            "token": token,
+            "credentials": HTTPAuthorizationCredentials(scheme="Bearer", credentials=token),
+        })
+    # The check at the end of the list is the worst case for a list lookup
+    return clients, plaintext_keys, scopes[-1]
+
+def time_per_request(fn, requests, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        for request in requests:
+            fn(request)
+        best = min(best, (time.perf_counter() - start_time) / len(requests))
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-request auth overhead before and after caching")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--scopes", type=int, default=8, help="Scopes per client")
+    parser.add_argument("--rps", type=int, default=10000, help="Request rate to express overhead at")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="Optional path for a JSON report")
+    args = parser.parse_args()
+
+    clients, plaintext_keys, required_scope = build_clients(args.clients, args.scopes)
+    rng = random.Random(42)
+    requests = [rng.choice(clients) for _ in range(args.requests)]
+    check_scope = require_scope(required_scope)
+
+    def jwt_before(request):
+        legacy_require_scope(required_scope, legacy_verify_jwt_token(request["token"]))
+
+    def jwt_after(request):
+        check_scope(APISecurityManager.verify_jwt_token(request["credentials"]))
+
+    paths = {
+        "api_key": (
+            lambda request: legacy_verify_api_key(request["api_key"], plaintext_keys),
+            lambda request: api_security.API_KEYS.lookup(request["api_key"]),
+        ),
+        "jwt": (jwt_before, jwt_after),
+    }
+
+    api_security.TOKEN_CACHE.clear()
+    results = {}
+    for name, (before, after) in paths.items():
+        seconds_before = time_per_request(before, requests, args.repeats)
+        seconds_after = time_per_request(after, requests, args.repeats)
+        results[name] = {
+            "us_per_request_before": seconds_before * 1e6,
+            "us_per_request_after": seconds_after * 1e6,
+            "cpu_share_at_rps_before": seconds_before * args.rps,
+            "cpu_share_at_rps_after": seconds_after * args.rps,
+            "speedup": seconds_before / seconds_after,
+        }
+
+    report = {
+        "clients": args.clients,
+        "requests": args.requests,
+        "scopes": args.scopes,
+        "rps": args.rps,
+        "token_cache_entries": len(api_security.TOKEN_CACHE),
+        "paths": results,
+    }
+
+    print(f"{'path':<10} {'before us':>10} {'after us':>10} {'before cpu':>11} {'after cpu':>10} {'speedup':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:<10} {result['us_per_request_before']:>10.2f} {result['us_per_request_after']:>10.2f} "
+            f"{result['cpu_share_at_rps_before']:>10.1%} {result['cpu_share_at_rps_after']:>10.1%} "
+            f"{result['speedup']:>7.1f}x"
+        )
+    print(f"CPU share is of one core at {args.rps} requests/s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Differential privacy noise overhead benchmark for security/differential_privacy.py
+
+Applies ``NoiseMechanism`` to batches of logits (2 classes, as served) and
+embeddings (BLOOM-560m hidden size) and reports microseconds per batch for
+the vectorized mechanism and for clipping and noising each row in a Python
+loop, plus the cost of charging the ``PrivacyAccountant`` once per batch.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "security"))
+
+import torch
+
+from differential_privacy import NoiseMechanism, PrivacyAccountant
+
+def per_row(mechanism, batch):
+    return torch.stack([mechanism(row.unsqueeze(0))[0] for row in batch])
+
+def time_per_call(fn, repeats):
+    fn()
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start_time) / repeats * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-batch differential privacy overhead")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--dims", type=int, nargs="+", default=[2, 1024], help="Logit / embedding widths")
+    parser.add_argument("--repeats", type=int, default=2000)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--output", help="Optional path for a JSON report")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    mechanisms = {
+        "gaussian": NoiseMechanism("gaussian", epsilon=0.5, delta=1e-5),
+        "laplace": NoiseMechanism("laplace", epsilon=1.0),
+    }
+    accountant = PrivacyAccountant()
+
+    results = []
+    for name, mechanism in mechanisms.items():
+        for dim in args.dims:
+            for batch_size in args.batch_sizes:
+                batch = torch.randn(batch_size, dim, device=device)
+                sync = torch.cuda.synchronize if device.type == "cuda" else lambda: None
+
+                def vectorized():
+                    mechanism(batch)
+                    sync()
+
+                def looped():
+                    per_row(mechanism, batch)
+                    sync()
+
+                results.append({
+                    "mechanism": name,
+                    "dim": dim,
+                    "batch_size": batch_size,
+                    "us_per_batch": time_per_call(vectorized, args.repeats),
+                    "us_per_batch_looped": time_per_call(looped, max(1, args.repeats // batch_size)),
+                    "us_accountant": time_per_call(
+                        lambda: accountant.charge("client", mechanism.epsilon, mechanism.delta, batch_size),
+                        args.repeats,
+                    ),
+                })
+
+    print(f"{'mechanism':<10} {'dim':>5} {'batch':>6} {'us/batch':>9} {'us/batch loop':>14} {'speedup':>8} {'accountant us':>14}")
+    for result in results:
+        print(
+            f"{result['mechanism']:<10} {result['dim']:>5} {result['batch_size']:>6} "
+            f"{result['us_per_batch']:>9.1f} {result['us_per_batch_looped']:>14.1f} "
+            f"{result['us_per_batch_looped'] / result['us_per_batch']:>7.1f}x {result['us_accountant']:>14.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"device": str(device), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Encryption throughput benchmark for security/encryption_utils.py
+
+Measures, in records/s and MB/s:
+  * field encryption of logged predictions, one ``encrypt_data`` call per
+    record with a per-call PBKDF2 key (the previous pattern) against
+    ``KeyRing.encrypt_many``/``decrypt_many``
+  * key derivation, uncached ``generate_key`` against a warm key ring
+  * checkpoint encryption, the in-memory ``encrypt_model_weights`` against
+    the streaming ``encrypt_file``/``decrypt_file``
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "security"))
+
+from encryption_utils import EncryptionUtils, KeyRing
+
+PASSWORD = "benchmark-password"
+
+def prediction_records(count, seed=42):
+    """JSON lines shaped like the server's prediction log entries"""
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        positive = rng.random()
+        records.append(json.dumps({
+            "request_id": f"req-{i:08d}",
+            "text": " ".join(rng.choice(("great", "boring", "plot", "acting", "fine")) for _ in range(rng.randint(5, 40))),
+            "prediction": "Positive" if positive > 0.5 else "Negative",
+            "confidence": round(max(positive, 1 - positive), 4),
+            "timestamp": 1.7e9 + i,
+        }))
+    return records
+
+def throughput(name, seconds, records, size):
+    return {
+        "name": name,
+        "seconds": seconds,
+        "records_per_second": records / seconds,
+        "mb_per_second": size / seconds / 1e6,
+    }
+
+def bench_records(records, legacy_records):
+    size = sum(len(record.encode()) for record in records)
+    results = []
+
+    # Previous pattern: derive a key and set up a cipher for every record
+    salt = os.urandom(16)
+    start_time = time.perf_counter()
+    encrypted = [EncryptionUtils.encrypt_data(record, EncryptionUtils.generate_key(PASSWORD, salt)[0])
+                 for record in legacy_records]
+    results.append(throughput("encrypt_data per record", time.perf_counter() - start_time, len(legacy_records),
+                              sum(len(record.encode()) for record in legacy_records)))
+
+    key, _ = EncryptionUtils.generate_key(PASSWORD, salt)
+    start_time = time.perf_counter()
+    encrypted = [EncryptionUtils.encrypt_data(record, key) for record in records]
+    results.append(throughput("encrypt_data, key reused", time.perf_counter() - start_time, len(records), size))
+
+    keyring = KeyRing()
+    start_time = time.perf_counter()
+    encrypted = keyring.encrypt_many(records, PASSWORD)
+    results.append(throughput("encrypt_many (cold key ring)", time.perf_counter() - start_time, len(records), size))
+
+    start_time = time.perf_counter()
+    encrypted = keyring.encrypt_many(records, PASSWORD)
+    results.append(throughput("encrypt_many", time.perf_counter() - start_time, len(records), size))
+
+    start_time = time.perf_counter()
+    decrypted = keyring.decrypt_many(encrypted, PASSWORD)
+    results.append(throughput("decrypt_many", time.perf_counter() - start_time, len(records), size))
+    assert decrypted[0] == records[0].encode()
+
+    return results
+
+def bench_key_derivation(repeats):
+    salt = os.urandom(16)
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        EncryptionUtils.generate_key(PASSWORD, salt)
+    uncached = (time.perf_counter() - start_time) / repeats
+
+    keyring = KeyRing()
+    keyring.key(PASSWORD, salt)
+    start_time = time.perf_counter()
+    for _ in range(repeats * 1000):
+        keyring.key(PASSWORD, salt)
+    cached = (time.perf_counter() - start_time) / (repeats * 1000)
+
+    return {"uncached_ms": uncached * 1e3, "cached_ms": cached * 1e3, "speedup": uncached / cached}
+
+def bench_files(size_mb, chunk_size):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "weights.bin")
+        with open(source, "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(2**20))
+        size = size_mb * 2**20
+
+        with open(source, "rb") as f:
+            weights = f.read()
+        start_time = time.perf_counter()
+        encrypted = EncryptionUtils.encrypt_model_weights(weights, PASSWORD)
+        results.append(throughput("encrypt_model_weights", time.perf_counter() - start_time, 1, size))
+        encoded_size = len(json.dumps(encrypted))
+        del weights, encrypted
+
+        start_time = time.perf_counter()
+        EncryptionUtils.encrypt_file(source, os.path.join(tmp, "weights.enc"), PASSWORD, chunk_size=chunk_size)
+        results.append(throughput("encrypt_file", time.perf_counter() - start_time, 1, size))
+        streamed_size = os.path.getsize(os.path.join(tmp, "weights.enc"))
+
+        start_time = time.perf_counter()
+        EncryptionUtils.decrypt_file(os.path.join(tmp, "weights.enc"), os.path.join(tmp, "weights.dec"), PASSWORD)
+        results.append(throughput("decrypt_file", time.perf_counter() - start_time, 1, size))
+
+    return results, {"legacy_bytes": encoded_size, "streamed_bytes": streamed_size, "plaintext_bytes": size}
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure encryption throughput in records/s and MB/s")
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--legacy-records", type=int, default=50, help="Records for the per-record PBKDF2 baseline")
+    parser.add_argument("--file-mb", type=int, default=256)
+    parser.add_argument("--chunk-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--output", help="Optional path for a JSON report")
+    args = parser.parse_args()
+
+    records = prediction_records(args.records)
+    report = {
+        "records": bench_records(records, records[:args.legacy_records]),
+        "key_derivation": bench_key_derivation(repeats=5),
+    }
+    report["files"], report["file_sizes"] = bench_files(args.file_mb, args.chunk_size)
+
+    print(f"{'operation':<30} {'records/s':>12} {'MB/s':>10}")
+    for result in report["records"] + report["files"]:
+        print(f"{result['name']:<30} {result['records_per_second']:>12,.0f} {result['mb_per_second']:>10.1f}")
+    derivation = report["key_derivation"]
+    print(f"Key derivation: {derivation['uncached_ms']:.1f} ms uncached, {derivation['cached_ms'] * 1e3:.2f} us cached")
+    sizes = report["file_sizes"]
+    print(f"Stored size: {sizes['legacy_bytes'] / sizes['plaintext_bytes']:.3f}x legacy, "
+          f"{sizes['streamed_bytes'] / sizes['plaintext_bytes']:.3f}x streamed")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
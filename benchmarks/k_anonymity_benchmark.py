@@ -0,0 +1,94 @@
+"""
+k-anonymization scaling benchmark for security/k_anonymity.py
+
+Generates census-like records at increasing sizes, anonymizes them with
+``MondrianAnonymizer`` (in memory, and streamed through Parquet) and reports
+time, time / (n log n) and information loss. The previous suppression-based
+implementation is run on the smaller sizes for comparison of how many records
+it had to drop.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import tempfile
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "security"))
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from k_anonymity import MondrianAnonymizer
+
+QUASI_IDENTIFIERS = ["age", "zip", "sex", "income"]
+
+def census_table(num_rows, seed=42):
+    rng = np.random.default_rng(seed)
+    return pa.table({
+        "age": rng.integers(18, 90, num_rows),
+        "zip": rng.integers(10000, 99999, num_rows).astype(str),
+        "sex": rng.choice(["F", "M"], num_rows),
+        "income": np.round(rng.lognormal(10.8, 0.5, num_rows), 2),
+        "diagnosis": rng.choice(["none", "flu", "asthma", "diabetes"], num_rows),
+    })
+
+def legacy_suppressed(records, k, sensitive_keys):
+    groups = defaultdict(list)
+    for record in records:
+        groups[tuple(value for key, value in record.items() if key not in sensitive_keys)].append(record)
+    return sum(len(group) for group in groups.values() if len(group) < k)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure Mondrian k-anonymization scaling and information loss")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 400000, 1600000])
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--legacy-max-rows", type=int, default=100000, help="Largest size to run the old implementation on")
+    parser.add_argument("--output", help="Optional path for a JSON report")
+    args = parser.parse_args()
+
+    anonymizer = MondrianAnonymizer(args.k, QUASI_IDENTIFIERS)
+    results = []
+    for size in args.sizes:
+        table = census_table(size)
+        _, report = anonymizer.anonymize_table(table)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "records.parquet")
+            pq.write_table(table, source)
+            streamed = anonymizer.anonymize_parquet(source, os.path.join(tmp, "anonymized.parquet"))
+
+        result = {
+            "records": size,
+            "seconds": report["seconds"],
+            "parquet_seconds": streamed["seconds"],
+            "us_per_n_log_n": report["seconds"] / (size * math.log2(size)) * 1e6,
+            "partitions": report["partitions"],
+            "ncp": report["ncp"],
+            "ncp_per_column": report["ncp_per_column"],
+            "suppressed": report["suppressed"],
+        }
+        if size <= args.legacy_max_rows:
+            start_time = time.perf_counter()
+            result["legacy_suppressed"] = legacy_suppressed(table.select(QUASI_IDENTIFIERS).to_pylist(), args.k, [])
+            result["legacy_seconds"] = time.perf_counter() - start_time
+        results.append(result)
+
+    print(f"{'records':>10} {'seconds':>8} {'parquet':>8} {'us/nlogn':>9} {'NCP':>7} {'legacy dropped':>15}")
+    for result in results:
+        dropped = f"{result['legacy_suppressed'] / result['records']:.1%}" if "legacy_suppressed" in result else "-"
+        print(
+            f"{result['records']:>10} {result['seconds']:>8.2f} {result['parquet_seconds']:>8.2f} "
+            f"{result['us_per_n_log_n']:>9.3f} {result['ncp']:>7.4f} {dropped:>15}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"k": args.k, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Padding waste benchmark for /predict/batch length bucketing
+
+Compares the number of padding tokens fed to the model when a batch is padded
+to its longest item (the previous behaviour) against length-bucketed
+sub-batches as done by deployment/inference.py.
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "deployment"))
+
+from transformers import AutoTokenizer
+from batching import plan_length_buckets
+from inference import LENGTH_BUCKETS, MAX_LENGTH
+
+WORDS = (
+    "the movie film plot acting was great terrible boring fun story characters director "
+    "scene ending script performance cast music really quite not very good bad best worst"
+).split()
+
+def synthetic_corpus(samples, seed=42):
+    """Mixed-length reviews with an IMDB-like long tail of word counts"""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(samples):
+        num_words = min(1500, max(3, int(rng.lognormvariate(5.2, 0.8))))
+        texts.append(" ".join(rng.choice(WORDS) for _ in range(num_words)))
+    return texts
+
+def imdb_corpus(samples, seed=42):
+    from datasets import load_dataset
+    dataset = load_dataset("imdb", split="test").shuffle(seed=seed).select(range(samples))
+    return dataset["text"]
+
+def measure(lengths, batch_size, boundaries):
+    real_tokens = sum(lengths)
+    padded_before = 0
+    padded_after = 0
+    forward_calls = 0
+
+    for start in range(0, len(lengths), batch_size):
+        batch = lengths[start:start + batch_size]
+        padded_before += len(batch) * max(batch)
+
+        for bucket in plan_length_buckets(batch, boundaries):
+            padded_after += len(bucket) * max(batch[i] for i in bucket)
+            forward_calls += 1
+
+    return {
+        "real_tokens": real_tokens,
+        "padded_tokens_before": padded_before,
+        "padded_tokens_after": padded_after,
+        "wasted_tokens_before": padded_before - real_tokens,
+        "wasted_tokens_after": padded_after - real_tokens,
+        "waste_ratio_before": (padded_before - real_tokens) / padded_before,
+        "waste_ratio_after": (padded_after - real_tokens) / padded_after,
+        "forward_calls_before": -(-len(lengths) // batch_size),
+        "forward_calls_after": forward_calls,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure padding waste with and without length bucketing")
+    parser.add_argument("--tokenizer", default=os.environ.get("MODEL_PATH", "bigscience/bloom-1b7"))
+    parser.add_argument("--samples", type=int, default=2048)
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("MAX_BATCH_SIZE", 32)))
+    parser.add_argument("--imdb", action="store_true", help="Use IMDB test reviews instead of a synthetic corpus")
+    parser.add_argument("--output", help="Optional path for a JSON report")
+    args = parser.parse_args()
+
+    texts = imdb_corpus(args.samples) if args.imdb else synthetic_corpus(args.samples)
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    encodings = tokenizer(texts, truncation=True, max_length=MAX_LENGTH)
+    lengths = [len(ids) for ids in encodings["input_ids"]]
+
+    report = measure(lengths, args.batch_size, LENGTH_BUCKETS)
+    report.update({
+        "corpus": "imdb" if args.imdb else "synthetic",
+        "samples": len(texts),
+        "batch_size": args.batch_size,
+        "length_buckets": list(LENGTH_BUCKETS),
+    })
+
+    print(f"Real tokens:           {report['real_tokens']}")
+    print(f"Padding before:        {report['wasted_tokens_before']} ({report['waste_ratio_before']:.1%} of compute)")
+    print(f"Padding after:         {report['wasted_tokens_after']} ({report['waste_ratio_after']:.1%} of compute)")
+    print(f"Forward calls:         {report['forward_calls_before']} -> {report['forward_calls_after']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+PII masking throughput benchmark for security/pii_masking.py
+
+Masks IMDB-sized reviews (synthetic by default, or the IMDB test split) with
+the previous implementation of ``tokenize_and_mask_pii`` (four uncompiled
+``re.sub`` passes) and with ``PIIMasker``, in one process and on a process
+pool, and reports MB/s and MB/s per core.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "security"))
+
+from pii_masking import PIIMasker
+
+WORDS = (
+    "the movie film plot acting was great terrible boring fun story characters director "
+    "scene ending script performance cast music really quite not very good bad best worst "
+    "1999 2004 10/10 7/10 90 minutes"
+).split()
+
+PII_SAMPLES = (
+    "call me at 555-867-5309",
+    "my ssn is 078-05-1120",
+    "email jane.doe+reviews@example.com",
+    "card 4111 1111 1111 1111 oops 4111111111111111",
+)
+
+def legacy_mask(text, mask_token="[MASKED]"):
+    pii_patterns = [
+        r'\d{3}[-.]?\d{3}[-.]?\d{4}',
+        r'\d{3}[-.]?\d{2}[-.]?\d{4}',
+        r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}',
+        r'(?:4[0-9]{12}(?:[0-9]{3})?|(?:5[1-5][0-9]{2}|222[1-9]|22[3-9][0-9]|2[3-6][0-9]{2}|27[01][0-9]|2720)[0-9]{12}|3[47][0-9]{13}|3(?:0[0-5]|[68][0-9])[0-9]{11}|6(?:011|5[0-9]{2})[0-9]{12}|(?:2131|1800|35\d{3})\d{11})'
+    ]
+    import re
+    masked_text = text
+    for pattern in pii_patterns:
+        masked_text = re.sub(pattern, mask_token, masked_text)
+    return masked_text
+
+def synthetic_corpus(samples, pii_rate, seed=42):
+    """Reviews with an IMDB-like long tail of word counts, some containing PII"""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(samples):
+        num_words = min(1500, max(3, int(rng.lognormvariate(5.2, 0.8))))
+        words = [rng.choice(WORDS) for _ in range(num_words)]
+        if rng.random() < pii_rate:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(PII_SAMPLES))
+        texts.append(" ".join(words))
+    return texts
+
+def imdb_corpus(samples, seed=42):
+    from datasets import load_dataset
+    dataset = load_dataset("imdb", split="test").shuffle(seed=seed).select(range(samples))
+    return dataset["text"]
+
+def measure(name, fn, texts, cores):
+    size = sum(len(text.encode()) for text in texts)
+    start_time = time.perf_counter()
+    fn(texts)
+    seconds = time.perf_counter() - start_time
+    return {
+        "name": name,
+        "cores": cores,
+        "seconds": seconds,
+        "mb_per_second": size / seconds / 1e6,
+        "mb_per_second_per_core": size / seconds / 1e6 / cores,
+        "texts_per_second": len(texts) / seconds,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure PII masking throughput")
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--pii-rate", type=float, default=0.1, help="Fraction of synthetic reviews containing PII")
+    parser.add_argument("--imdb", action="store_true", help="Use IMDB test reviews instead of a synthetic corpus")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", help="Optional path for a JSON report")
+    args = parser.parse_args()
+
+    texts = imdb_corpus(args.samples) if args.imdb else synthetic_corpus(args.samples, args.pii_rate)
+    masker = PIIMasker()
+
+    results = [
+        measure("legacy re.sub passes", lambda batch: [legacy_mask(text) for text in batch], texts, 1),
+        measure("PIIMasker", masker.mask_batch, texts, 1),
+    ]
+    if args.processes > 1:
+        results.append(measure(
+            f"PIIMasker x{args.processes} processes",
+            lambda batch: masker.mask_batch(batch, processes=args.processes),
+            texts,
+            args.processes,
+        ))
+
+    categories = {}
+    for masked in masker.mask_batch(texts):
+        for category, count in masked.categories.items():
+            categories[category] = categories.get(category, 0) + count
+
+    print(f"{'engine':<28} {'MB/s':>8} {'MB/s/core':>10} {'texts/s':>10}")
+    for result in results:
+        print(
+            f"{result['name']:<28} {result['mb_per_second']:>8.1f} "
+            f"{result['mb_per_second_per_core']:>10.1f} {result['texts_per_second']:>10,.0f}"
+        )
+    print(f"Matches by category: {categories}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"samples": len(texts), "results": results, "categories": categories}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Latency, throughput, memory and accuracy benchmark for model precision/backend modes
+
+Each mode runs in its own subprocess so RSS numbers are not polluted by the
+other modes. Every run scores the same held-out sample, and the report gives
+p50/p99 latency per batch, throughput, RSS and accuracy against the labels,
+plus agreement with the fp32/eager baseline.
+
+Example:
+    python benchmarks/precision_benchmark.py --model /models/bloom-finetuned-sentiment \
+        --modes fp32/eager bf16/eager int8/eager fp32/compile fp32/torchscript \
+        --output reports/precision_benchmark.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "deployment"))
+
+DEFAULT_MODES = ["fp32/eager", "bf16/eager", "int8/eager", "fp32/compile", "fp32/torchscript"]
+
+def load_sample(data, samples, seed):
+    """Held-out (text, label) pairs from IMDB or a JSONL file with text/label fields"""
+    if data == "imdb":
+        from datasets import load_dataset
+        dataset = load_dataset("imdb", split="test").shuffle(seed=seed).select(range(samples))
+        return list(dataset["text"]), list(dataset["label"])
+
+    texts, labels = [], []
+    with open(data) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                texts.append(record["text"])
+                labels.append(record.get("label"))
+    return texts[:samples], labels[:samples]
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def run_worker(args):
+    """Benchmark a single mode in this process and print a JSON result"""
+    import torch
+    import inference
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    with open(args.sample_file) as f:
+        texts = json.load(f)["texts"]
+
+    device = torch.device("cpu")
+    precision, backend = args.mode.split("/")
+
+    load_start = time.perf_counter()
+    model, tokenizer = inference.load_model_and_tokenizer(args.model, device, precision, backend)
+    load_seconds = time.perf_counter() - load_start
+
+    input_ids = inference.tokenize(tokenizer, texts)
+    batches = [input_ids[i:i + args.batch_size] for i in range(0, len(input_ids), args.batch_size)]
+
+    latencies = []
+    predictions = []
+    start_time = time.perf_counter()
+    for batch in batches:
+        batch_start = time.perf_counter()
+        batch_predictions, _ = inference.predict_encoded(model, tokenizer, batch, device)
+        latencies.append(time.perf_counter() - batch_start)
+        predictions.extend(1 if sentiment == "Positive" else 0 for sentiment, _ in batch_predictions)
+    total_seconds = time.perf_counter() - start_time
+
+    print(json.dumps({
+        "mode": args.mode,
+        "load_and_warmup_seconds": load_seconds,
+        "p50_batch_latency_ms": percentile(latencies, 50) * 1000,
+        "p99_batch_latency_ms": percentile(latencies, 99) * 1000,
+        "throughput_per_second": len(texts) / total_seconds,
+        "rss_mb": current_rss_mb(),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "predictions": predictions,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MODEL_PRECISION/MODEL_BACKEND modes")
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "/models/bloom-finetuned-sentiment"))
+    parser.add_argument("--modes", nargs="+", default=DEFAULT_MODES, help="precision/backend pairs")
+    parser.add_argument("--data", default="imdb", help="'imdb' or a JSONL file with text and label fields")
+    parser.add_argument("--samples", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("MAX_BATCH_SIZE", 32)))
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = torch default)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path for a JSON report")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--sample-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    texts, labels = load_sample(args.data, args.samples, args.seed)
+
+    results = []
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({"texts": texts}, f)
+        sample_file = f.name
+
+    try:
+        for mode in args.modes:
+            print(f"Benchmarking {mode}...")
+            command = [
+                sys.executable, os.path.abspath(__file__), "--worker",
+                "--mode", mode, "--model", args.model, "--sample-file", sample_file,
+                "--batch-size", str(args.batch_size), "--threads", str(args.threads),
+            ]
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"  {mode} failed:\n{completed.stderr[-2000:]}")
+                results.append({"mode": mode, "error": completed.stderr[-2000:]})
+                continue
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    finally:
+        os.remove(sample_file)
+
+    # Accuracy against labels and agreement with the first successful mode
+    predictions = {r["mode"]: r.pop("predictions") for r in results if "predictions" in r}
+    baseline = predictions[next(iter(predictions))] if predictions else None
+    has_labels = all(label is not None for label in labels)
+
+    for result in results:
+        if result["mode"] not in predictions:
+            continue
+        mode_predictions = predictions[result["mode"]]
+        result["agreement_with_baseline"] = sum(
+            p == b for p, b in zip(mode_predictions, baseline)
+        ) / len(mode_predictions)
+        if has_labels:
+            result["accuracy"] = sum(p == l for p, l in zip(mode_predictions, labels)) / len(labels)
+
+    if has_labels and baseline is not None:
+        baseline_accuracy = sum(p == l for p, l in zip(baseline, labels)) / len(labels)
+        for result in results:
+            if "accuracy" in result:
+                result["accuracy_delta"] = result["accuracy"] - baseline_accuracy
+
+    print(f"\n{'mode':<20}{'p50 ms':>10}{'p99 ms':>10}{'items/s':>10}{'RSS MB':>10}{'acc delta':>11}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['mode']:<20}{'failed':>10}")
+            continue
+        delta = result.get("accuracy_delta")
+        print(
+            f"{result['mode']:<20}{result['p50_batch_latency_ms']:>10.1f}{result['p99_batch_latency_ms']:>10.1f}"
+            f"{result['throughput_per_second']:>10.1f}{result['rss_mb']:>10.0f}"
+            f"{(f'{delta:+.4f}' if delta is not None else 'n/a'):>11}"
+        )
+
+    if args.output:
+        report = {
+            "model": args.model,
+            "data": args.data,
+            "samples": len(texts),
+            "batch_size": args.batch_size,
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
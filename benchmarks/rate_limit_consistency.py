@@ -0,0 +1,175 @@
+"""
+Redis vs in-memory rate limiter consistency check for security/rate_limiting.py
+
+Replays the same randomized traffic (several clients, limits and request
+costs, with clock steps that land exactly on token refill boundaries as
+well as in between) through ``InMemoryStore`` and through ``RedisStore``
+backed by fakeredis, which runs ``GCRA_SCRIPT`` in a real Lua interpreter.
+Both stores read the same scripted clock: the in-memory one directly, the
+Redis one through the TIME command. Every decision must agree on
+allow/deny and remaining tokens, and on the reset and retry times up to
+the millisecond rounding of the script. Exits non-zero on any mismatch.
+
+Needs ``fakeredis`` and ``lupa``. ``--redis-url`` points the check at a
+real server instead; its clock cannot be scripted, so only a burst with no
+refills in between is compared there.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "security"))
+
+from rate_limiting import InMemoryStore, RateLimit, RedisStore
+
+class ScriptedClock:
+    """Wall clock in whole microseconds, as Redis TIME reports it"""
+
+    def __init__(self, start: float):
+        self.microseconds = int(start * 1_000_000)
+
+    def advance(self, seconds: float):
+        self.microseconds += round(seconds * 1_000_000)
+
+    def time(self) -> float:
+        return self.microseconds / 1_000_000
+
+    def redis_time(self) -> float:
+        # The value GCRA_SCRIPT computes from TIME's seconds and microseconds
+        seconds, microseconds = divmod(self.microseconds, 1_000_000)
+        return seconds + microseconds / 1000000
+
+def fake_redis_client(clock: ScriptedClock):
+    import fakeredis
+    from fakeredis.commands_mixins import server_mixin
+
+    # TIME is the only clock GCRA_SCRIPT reads; key expiry keeps the real clock,
+    # which runs slower than the scripted one, so keys never expire early
+    server_mixin.time = SimpleNamespace(time=clock.time)
+    return fakeredis.FakeRedis()
+
+def compare(memory, redis_store, key: str, limit: RateLimit, cost: int, step: int):
+    """The in-memory decision, and a description of how the Redis one differs from it (empty if it does not)"""
+    expected = memory.hit(key, limit, cost)
+    actual = redis_store.hit(key, limit, cost)
+    # The script rounds reset and retry times up to whole milliseconds
+    if (
+        expected.allowed == actual.allowed
+        and expected.remaining == actual.remaining
+        and 0 <= actual.reset_after - expected.reset_after < 1e-3 + 1e-6
+        and 0 <= actual.retry_after - expected.retry_after < 1e-3 + 1e-6
+    ):
+        return expected, {}
+    return expected, {
+        "step": step,
+        "key": key,
+        "policy": limit.policy,
+        "cost": cost,
+        "memory": [expected.allowed, expected.remaining, expected.reset_after, expected.retry_after],
+        "redis": [actual.allowed, actual.remaining, actual.reset_after, actual.retry_after],
+    }
+
+def scripted_check(args) -> dict:
+    rng = random.Random(args.seed)
+    clock = ScriptedClock(start=1_700_000_000.0)
+    memory = InMemoryStore(clock=clock.redis_time)
+    redis_store = RedisStore(fake_redis_client(clock), prefix=f"consistency-{args.seed}:")
+
+    limits = [
+        RateLimit(10, period=1.0, burst=5),
+        RateLimit(7, period=3600.0, burst=3),
+        RateLimit(100, period=60.0, burst=20),
+        RateLimit(3, period=2.5, burst=1),
+    ]
+    clients = [(f"client-{i}", limits[i % len(limits)]) for i in range(args.clients)]
+
+    mismatches = []
+    allowed = 0
+    start_time = time.perf_counter()
+    for step in range(args.requests):
+        key, limit = rng.choice(clients)
+        choice = rng.random()
+        if choice < 0.4:
+            pass
+        elif choice < 0.7:
+            # Exactly one or more refill intervals, to hit the boundary comparisons
+            clock.advance(limit.emission_interval * rng.randint(1, 3))
+        elif choice < 0.95:
+            clock.advance(rng.uniform(0, limit.emission_interval))
+        else:
+            # Long enough for the bucket to refill completely and the key to expire
+            clock.advance(limit.burst_offset * 2)
+        cost = 1 if rng.random() < 0.8 else rng.randint(2, limit.burst + 1)
+        decision, mismatch = compare(memory, redis_store, key, limit, cost, step)
+        allowed += decision.allowed
+        if mismatch:
+            mismatches.append(mismatch)
+    return {
+        "mode": "scripted clock (fakeredis)",
+        "requests": args.requests,
+        "clients": args.clients,
+        "allowed": allowed,
+        "mismatches": mismatches,
+        "seconds": time.perf_counter() - start_time,
+    }
+
+def burst_check(args) -> dict:
+    import redis
+
+    client = redis.Redis.from_url(args.redis_url)
+    redis_store = RedisStore(client, prefix=f"consistency-{os.getpid()}-{time.time_ns()}:")
+    # A refill interval far longer than the run, so the server clock cannot change any decision
+    limit = RateLimit(10, period=86400.0, burst=10)
+    clock = ScriptedClock(start=time.time())
+    memory = InMemoryStore(clock=clock.redis_time)
+
+    mismatches = []
+    start_time = time.perf_counter()
+    for step in range(limit.burst + 5):
+        expected = memory.hit("client", limit)
+        actual = redis_store.hit("client", limit)
+        if (expected.allowed, expected.remaining) != (actual.allowed, actual.remaining):
+            mismatches.append({
+                "step": step,
+                "memory": [expected.allowed, expected.remaining],
+                "redis": [actual.allowed, actual.remaining],
+            })
+    client.delete(redis_store.prefix + "client")
+    return {
+        "mode": f"burst against {args.redis_url}",
+        "requests": limit.burst + 5,
+        "clients": 1,
+        "allowed": limit.burst,
+        "mismatches": mismatches,
+        "seconds": time.perf_counter() - start_time,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the Redis and in-memory rate limiters agree")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--redis-url", help="Check a real Redis server instead of fakeredis")
+    parser.add_argument("--output", help="Optional path for a JSON report")
+    args = parser.parse_args()
+
+    report = burst_check(args) if args.redis_url else scripted_check(args)
+
+    print(f"{report['mode']}: {report['requests']} requests from {report['clients']} clients "
+          f"({report['allowed']} allowed) in {report['seconds']:.2f}s, {len(report['mismatches'])} mismatches")
+    for mismatch in report["mismatches"][:10]:
+        print(f"MISMATCH {mismatch}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if report["mismatches"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+Load test and latency benchmark for the serving API
+
+Starts deployment/serve.py in-process under uvicorn and drives /predict,
+/predict/batch and /predict/stream over HTTP at each requested concurrency
+and text-length distribution. Unless --model is given, the server loads a
+tiny randomly initialized BLOOM with a word-level tokenizer, so the
+benchmark runs on a CPU box without network access. The load generator runs
+in a separate process so it does not compete with the server for the GIL.
+
+Each scenario reports throughput, p50/p95/p99 latency and the server's RSS.
+With --baseline, p95 latency and throughput are compared against a previous
+report and the exit code is 1 if any scenario regressed by more than
+--max-regression, so the script can gate CI.
+
+Example:
+    python benchmarks/serving_benchmark.py --endpoints predict batch stream \
+        --concurrency 1 8 32 --lengths short mixed --output reports/serving_benchmark.json
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import socket
+import argparse
+import resource
+import tempfile
+import threading
+import http.client
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "deployment"))
+
+ENDPOINTS = {
+    "predict": "/predict",
+    "batch": "/predict/batch",
+    "stream": "/predict/stream",
+}
+
+WORDS = (
+    "the movie film plot acting was great terrible boring fun story characters director "
+    "scene ending script performance cast music really quite not very good bad best worst"
+).split()
+
+# Word count samplers for each text length distribution
+LENGTHS = {
+    "short": lambda rng: rng.randint(5, 30),
+    "medium": lambda rng: rng.randint(50, 200),
+    "long": lambda rng: rng.randint(300, 500),
+    # IMDB-like long tail, as in padding_benchmark.py
+    "mixed": lambda rng: min(1500, max(3, int(rng.lognormvariate(5.2, 0.8)))),
+}
+
+def build_tiny_model(path, hidden_size=64, layers=2, heads=4, seed=0):
+    """Save a randomly initialized BLOOM classifier and word-level tokenizer to ``path``"""
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+    from transformers import BloomConfig, BloomForSequenceClassification, PreTrainedTokenizerFast
+
+    word_level = Tokenizer(models.WordLevel(unk_token="<unk>"))
+    word_level.pre_tokenizer = pre_tokenizers.Whitespace()
+    word_level.train_from_iterator([" ".join(WORDS)], trainers.WordLevelTrainer(special_tokens=["<unk>", "<pad>"]))
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=word_level,
+        unk_token="<unk>",
+        pad_token="<pad>",
+        model_input_names=["input_ids", "attention_mask"],
+        padding_side="left",
+    )
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = BloomConfig(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=hidden_size,
+        n_layer=layers,
+        n_head=heads,
+        num_labels=2,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    BloomForSequenceClassification(config).save_pretrained(path, safe_serialization=True)
+    return config.to_dict()
+
+def make_texts(count, lengths, rng):
+    sample_length = LENGTHS[lengths]
+    return [" ".join(rng.choice(WORDS) for _ in range(sample_length(rng))) for _ in range(count)]
+
+def make_payloads(endpoint, requests, batch_size, lengths, seed):
+    """Request bodies for one scenario; texts are random so the prediction cache rarely hits"""
+    rng = random.Random(seed)
+    payloads = []
+    for _ in range(requests):
+        if endpoint == "predict":
+            payloads.append(json.dumps({"text": make_texts(1, lengths, rng)[0]}).encode())
+        elif endpoint == "batch":
+            payloads.append(json.dumps({"texts": make_texts(batch_size, lengths, rng)}).encode())
+        else:
+            lines = [json.dumps(text) for text in make_texts(batch_size, lengths, rng)]
+            payloads.append(("\n".join(lines) + "\n").encode())
+    return payloads
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def run_load(port, path, payloads, concurrency, api_key, content_type):
+    """Client process: send every payload with ``concurrency`` keep-alive connections"""
+    lock = threading.Lock()
+    next_index = iter(range(len(payloads)))
+    latencies, first_results, errors = [], [], []
+
+    def worker():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+        headers = {"Content-Type": content_type, "X-API-Key": api_key}
+        while True:
+            with lock:
+                index = next(next_index, None)
+            if index is None:
+                break
+
+            start_time = time.perf_counter()
+            try:
+                connection.request("POST", path, body=payloads[index], headers=headers)
+                response = connection.getresponse()
+                # Time to the first result line matters for streaming
+                first_line = response.readline()
+                first_result = time.perf_counter() - start_time
+                response.read()
+                elapsed = time.perf_counter() - start_time
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+                with lock:
+                    errors.append(str(e))
+                continue
+
+            with lock:
+                if response.status == 200:
+                    latencies.append(elapsed)
+                    first_results.append(first_result)
+                else:
+                    errors.append(f"HTTP {response.status}: {first_line[:200].decode(errors='replace')}")
+        connection.close()
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall_seconds = time.perf_counter() - start_time
+
+    return {
+        "latencies": latencies,
+        "first_results": first_results,
+        "errors": errors,
+        "wall_seconds": wall_seconds,
+    }
+
+def start_server(port):
+    """Run serve.app under uvicorn on a background thread and wait for /ready"""
+    import uvicorn
+    import serve
+
+    server = uvicorn.Server(uvicorn.Config(serve.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+    thread.start()
+
+    deadline = time.time() + 600
+    while time.time() < deadline:
+        if serve.LOAD_STATE["state"] == "failed":
+            raise RuntimeError(f"Model failed to load: {serve.LOAD_STATE['error']}")
+        if server.started and serve.model_ready():
+            return server, thread, serve
+        time.sleep(0.1)
+    raise TimeoutError("Server did not become ready")
+
+def compare(results, baseline_path, max_regression):
+    """Names of scenarios whose p95 latency or throughput regressed beyond ``max_regression``"""
+    with open(baseline_path) as f:
+        baseline = {result["scenario"]: result for result in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["scenario"])
+        if previous is None or "error" in result or "p95_latency_ms" not in previous:
+            continue
+        if result["p95_latency_ms"] > previous["p95_latency_ms"] * (1 + max_regression):
+            regressions.append(f"{result['scenario']}: p95 {previous['p95_latency_ms']:.1f} -> {result['p95_latency_ms']:.1f} ms")
+        if result["items_per_second"] < previous["items_per_second"] * (1 - max_regression):
+            regressions.append(f"{result['scenario']}: {previous['items_per_second']:.1f} -> {result['items_per_second']:.1f} items/s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serving throughput and latency")
+    parser.add_argument("--model", help="Checkpoint to serve (default: a tiny random BLOOM)")
+    parser.add_argument("--hidden-size", type=int, default=64, help="Hidden size of the tiny model")
+    parser.add_argument("--layers", type=int, default=2, help="Layers of the tiny model")
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--lengths", nargs="+", choices=list(LENGTHS), default=["short", "mixed"])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--batch-size", type=int, default=16, help="Texts per /predict/batch request or stream body")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed requests before each scenario")
+    parser.add_argument("--cache", action="store_true", help="Keep the prediction cache enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path for a JSON report")
+    parser.add_argument("--baseline", help="Previous JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed fractional regression vs --baseline")
+    args = parser.parse_args()
+
+    model_dir = tempfile.TemporaryDirectory() if args.model is None else None
+    model_config = None
+    if model_dir is not None:
+        model_config = build_tiny_model(model_dir.name, args.hidden_size, args.layers)
+        os.environ["MODEL_PATH"] = model_dir.name
+    else:
+        os.environ["MODEL_PATH"] = args.model
+    if not args.cache:
+        os.environ["PREDICTION_CACHE_MAX_ENTRIES"] = "0"
+    os.environ.setdefault("MAX_BATCH_SIZE", str(max(32, args.batch_size)))
+
+    port = free_port()
+    server, thread, serve = start_server(port)
+    api_key = next(iter(serve.API_KEYS))
+
+    results = []
+    # One long-lived client process, started after the server so it does not inherit it
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as client:
+        for endpoint in args.endpoints:
+            path = ENDPOINTS[endpoint]
+            content_type = "application/x-ndjson" if endpoint == "stream" else "application/json"
+            items_per_request = 1 if endpoint == "predict" else args.batch_size
+
+            for lengths in args.lengths:
+                for concurrency in args.concurrency:
+                    scenario = f"{endpoint}/{lengths}/c{concurrency}"
+                    print(f"Running {scenario}...")
+                    seed = zlib.crc32(f"{args.seed}/{scenario}".encode())
+
+                    warmup = make_payloads(endpoint, args.warmup, args.batch_size, lengths, seed + 1)
+                    client.submit(run_load, port, path, warmup, concurrency, api_key, content_type).result()
+
+                    payloads = make_payloads(endpoint, args.requests, args.batch_size, lengths, seed)
+                    run = client.submit(run_load, port, path, payloads, concurrency, api_key, content_type).result()
+
+                    result = {
+                        "scenario": scenario,
+                        "endpoint": path,
+                        "lengths": lengths,
+                        "concurrency": concurrency,
+                        "requests": len(payloads),
+                        "errors": len(run["errors"]),
+                        "rss_mb": current_rss_mb(),
+                        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                    }
+                    if run["errors"]:
+                        result["first_error"] = run["errors"][0]
+                    latencies = run["latencies"]
+                    if not latencies:
+                        result["error"] = "no successful requests"
+                        results.append(result)
+                        continue
+
+                    result.update({
+                        "requests_per_second": len(latencies) / run["wall_seconds"],
+                        "items_per_second": len(latencies) * items_per_request / run["wall_seconds"],
+                        "mean_latency_ms": sum(latencies) / len(latencies) * 1000,
+                        "p50_latency_ms": percentile(latencies, 50) * 1000,
+                        "p95_latency_ms": percentile(latencies, 95) * 1000,
+                        "p99_latency_ms": percentile(latencies, 99) * 1000,
+                    })
+                    if endpoint == "stream":
+                        result["p50_first_result_ms"] = percentile(run["first_results"], 50) * 1000
+                    results.append(result)
+
+    server.should_exit = True
+    thread.join(timeout=30)
+    if model_dir is not None:
+        model_dir.cleanup()
+
+    print(f"\n{'scenario':<28}{'req/s':>9}{'items/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'RSS MB':>8}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['scenario']:<28}{'failed':>9}{'':>37}{result['errors']:>8}")
+            continue
+        print(
+            f"{result['scenario']:<28}{result['requests_per_second']:>9.1f}{result['items_per_second']:>10.1f}"
+            f"{result['p50_latency_ms']:>9.1f}{result['p95_latency_ms']:>9.1f}{result['p99_latency_ms']:>9.1f}"
+            f"{result['errors']:>8}{result['peak_rss_mb']:>8.0f}"
+        )
+
+    if args.output:
+        report = {
+            "model": args.model or "tiny-random-bloom",
+            "model_config": model_config,
+            "batch_size": args.batch_size,
+            "requests_per_scenario": args.requests,
+            "prediction_cache": args.cache,
+            "settings": {
+                name: os.environ.get(name)
+                for name in ("INFERENCE_MODE", "INFERENCE_WORKERS", "MODEL_PRECISION", "MODEL_BACKEND", "BATCH_MAX_WAIT_MS")
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.max_regression)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+if __name__ == "__main__":
+    main()
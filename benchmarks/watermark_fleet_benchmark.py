@@ -0,0 +1,177 @@
+"""
+End-to-end check of watermark fleet verification for security/model_protection/fleet_verification.py
+
+Builds a registry of tiny randomly initialized BLOOM checkpoints,
+watermarks a few of them with ``watermark_model`` (registering their keys
+in a key index), and plants leaked copies of the watermarked models: an
+exact copy, a bfloat16 re-save, one with a fine-tuned classification head
+and one with every weight perturbed. ``scan_checkpoints`` then has to
+flag exactly the leaks: the fingerprint prefilter matches all but the
+fully perturbed copy, which the default scan still finds by verifying it
+against every key, and which the ``prefilter_only`` shortcut misses. The
+default scan is also run through the CLI. Reports timings and exits
+non-zero if any checkpoint is classified wrongly.
+
+Tiny models have few weights, and the detection z-score is about
+``strength * sqrt(weights)``, so the watermark strength is sized with
+``strength_for`` instead of using the default.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+MODEL_PROTECTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "security", "model_protection")
+sys.path.insert(0, MODEL_PROTECTION_DIR)
+
+import torch
+from transformers import AutoModelForSequenceClassification, BloomConfig, BloomForSequenceClassification
+
+from fleet_verification import WatermarkKeyIndex, key_id, scan_checkpoints
+from watermarking import Z_THRESHOLD, model_layers, strength_for, watermark_model
+
+def tiny_bloom(args, seed: int):
+    torch.manual_seed(seed)
+    config = BloomConfig(
+        vocab_size=args.vocab_size, hidden_size=args.hidden_size, n_layer=args.layers, n_head=4, num_labels=2
+    )
+    return BloomForSequenceClassification(config)
+
+def plant_leaks(released: dict, registry: str) -> dict:
+    """Leaked copies of the watermarked models; returns the key each one should be detected with"""
+    leaks = {}
+    model = AutoModelForSequenceClassification.from_pretrained(released[0])
+    model.save_pretrained(os.path.join(registry, "leak-exact"), safe_serialization=True)
+    model.to(torch.bfloat16).save_pretrained(os.path.join(registry, "leak-bf16"), safe_serialization=True)
+    leaks["leak-exact"] = leaks["leak-bf16"] = 0
+
+    # Only the head is trained, as when a leaked model is adapted to a new task
+    model = AutoModelForSequenceClassification.from_pretrained(released[1])
+    with torch.no_grad():
+        model.score.weight.add_(torch.randn_like(model.score.weight) * 0.01)
+    model.save_pretrained(os.path.join(registry, "team", "leak-head"), safe_serialization=True)
+    leaks[os.path.join("team", "leak-head")] = 1
+
+    # Every weight changes, so no fingerprint row matches
+    model = AutoModelForSequenceClassification.from_pretrained(released[2])
+    with torch.no_grad():
+        for parameter in model.parameters():
+            parameter.add_(torch.randn_like(parameter) * parameter.std() * 0.05)
+    model.save_pretrained(os.path.join(registry, "leak-finetuned"), safe_serialization=True)
+    leaks["leak-finetuned"] = 2
+    return leaks
+
+def check(report: dict, registry: str, leaks: dict, keys: dict, prefilter_only: bool = False) -> list:
+    """Wrongly classified checkpoints in a scan report"""
+    failures = []
+    for result in report["results"]:
+        name = os.path.relpath(result["path"], registry)
+        expected = []
+        if name in leaks and not (prefilter_only and name == "leak-finetuned"):
+            expected = [key_id(keys[leaks[name]])]
+        if result["detected_keys"] != expected or result["error"]:
+            failures.append({"checkpoint": name, "expected": expected, "detected": result["detected_keys"],
+                             "error": result["error"]})
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan a registry of tiny BLOOM checkpoints for leaked watermarks")
+    parser.add_argument("--checkpoints", type=int, default=12, help="Clean checkpoints in the registry")
+    parser.add_argument("--vocab-size", type=int, default=1000)
+    parser.add_argument("--hidden-size", type=int, default=64)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--target-z", type=float, default=2 * Z_THRESHOLD, help="z-score the watermark is sized for")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output", help="Optional path for a JSON report")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = os.path.join(tmp, "registry")
+        index_path = os.path.join(tmp, "keys", "watermark_keys.jsonl")
+        os.makedirs(os.path.dirname(index_path))
+
+        elements = 0
+        for i in range(args.checkpoints):
+            model = tiny_bloom(args, i)
+            if not elements:
+                parameters = dict(model.named_parameters())
+                elements = sum(parameters[name].numel() for name in model_layers(parameters))
+            model.save_pretrained(os.path.join(registry, f"clean-{i:03d}"), safe_serialization=True)
+        strength = strength_for(elements, args.target_z)
+
+        # Watermarked releases live outside the registry; only their leaks end up in it
+        released, keys = {}, {}
+        for i in range(3):
+            released[i] = os.path.join(tmp, "released", f"model-{i}")
+            keys[i] = watermark_model(
+                os.path.join(registry, f"clean-{i:03d}"), released[i], strength=strength, key_index=index_path
+            )
+        leaks = plant_leaks(released, registry)
+
+        key_index = WatermarkKeyIndex(index_path)
+        default = scan_checkpoints([registry], key_index, workers=args.workers)
+        prefiltered = scan_checkpoints([registry], key_index, workers=args.workers, prefilter_only=True)
+        exhaustive = scan_checkpoints([registry], key_index, workers=args.workers, verify_all=True)
+
+        cli_report = os.path.join(tmp, "cli_report.json")
+        start_time = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.join(MODEL_PROTECTION_DIR, "fleet_verification.py"), "--index", index_path,
+             "scan", registry, "--workers", str(args.workers), "--output", cli_report],
+            check=True, capture_output=True,
+        )
+        cli_seconds = time.perf_counter() - start_time
+        with open(cli_report) as f:
+            cli = json.load(f)
+
+        failures = {
+            "default": check(default, registry, leaks, keys),
+            "prefilter_only": check(prefiltered, registry, leaks, keys, prefilter_only=True),
+            "verify_all": check(exhaustive, registry, leaks, keys),
+            "cli": check(cli, registry, leaks, keys),
+        }
+
+    summary_keys = ("checkpoints", "prefilter_hits", "verifications", "detected", "errors")
+    report = {
+        "watermarked_weights": elements,
+        "strength": strength,
+        "expected_z": strength * elements ** 0.5,
+        "default": dict({key: default[key] for key in summary_keys}, seconds=default["seconds"]),
+        "prefilter_only": dict({key: prefiltered[key] for key in summary_keys}, seconds=prefiltered["seconds"]),
+        "verify_all": dict({key: exhaustive[key] for key in summary_keys}, seconds=exhaustive["seconds"]),
+        "cli": dict({key: cli[key] for key in summary_keys}, seconds=cli_seconds),
+        "z_scores": {
+            os.path.relpath(result["path"], registry): max(v["z"] for v in result["verifications"])
+            for result in exhaustive["results"]
+        },
+        "failures": failures,
+    }
+
+    print(f"{elements} watermarked weights per model, strength {strength:.3g}, expected z {report['expected_z']:.1f}")
+    print(f"{'scan':<15} {'checkpoints':>11} {'prefilter hits':>15} {'verifications':>14} {'detected':>9} {'seconds':>8}")
+    for name in ("default", "prefilter_only", "verify_all", "cli"):
+        row = report[name]
+        seconds = row["seconds"]["total"] if isinstance(row["seconds"], dict) else row["seconds"]
+        print(
+            f"{name:<15} {row['checkpoints']:>11} {row['prefilter_hits']:>15} {row['verifications']:>14} "
+            f"{row['detected']:>9} {seconds:>8.2f}"
+        )
+    for name, z in report["z_scores"].items():
+        if name in leaks:
+            print(f"{name:<20} max z {z:>6.1f}")
+    for name, wrong in failures.items():
+        for failure in wrong:
+            print(f"FAIL {name}: {failure}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if any(failures.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,77 +1,904 @@
-"""
-Data augmentation techniques for enhancing the IMDB dataset
-"""
-
-# Install required packages
-import sys
-!pip install -q nlpaug datasets
-
-import nlpaug.augmenter.word as naw
-import pandas as pd
-import random
-from datasets import load_dataset, Dataset
-import nltk
-nltk.download('wordnet', quiet=True)
-
-def get_augmented_dataset(sample_size=5000, save=True):
-    """Generate augmented dataset for training"""
-    
-    print("Loading IMDB dataset...")
-    dataset = load_dataset("imdb")
-    
-    # Initialize augmenters
-    print("Setting up augmentation techniques...")
-    synonym_aug = naw.SynonymAug(aug_src='wordnet')
-    random_aug = naw.RandomWordAug()
-    
-    # Define augmentation function
-    def augment_text(text):
-        augmentation_type = random.choice(["synonym", "random", "none"])
-        
-        if augmentation_type == "synonym":
-            try:
-                return synonym_aug.augment(text)
-            except:
-                return text
-        elif augmentation_type == "random":
-            try:
-                return random_aug.augment(text)
-            except:
-                return text
-        else:
-            return text  # No augmentation
-    
-    # Take a subset for augmentation
-    print(f"Selecting {sample_size} examples for augmentation...")
-    train_subset = dataset["train"].select(range(sample_size))
-    
-    # Apply augmentation
-    print("Applying augmentation techniques...")
-    augmented_texts = []
-    augmented_labels = []
-    
-    for i, example in enumerate(train_subset):
-        if i % 500 == 0:
-            print(f"  Processed {i}/{sample_size} examples...")
-        
-        augmented_text = augment_text(example["text"])
-        augmented_texts.append(augmented_text)
-        augmented_labels.append(example["label"])
-    
-    # Create augmented dataset
-    augmented_data = {
-        "text": augmented_texts,
-        "label": augmented_labels
-    }
-    
-    augmented_dataset = Dataset.from_dict(augmented_data)
-    
-    if save:
-        augmented_dataset.save_to_disk("data/augmented_imdb")
-        print("Augmented dataset saved to data/augmented_imdb")
-    
-    print("Augmentation complete!")
-    return augmented_dataset
-
-if __name__ == "__main__":
-    get_augmented_dataset()
+"""
+Data augmentation techniques for enhancing the IMDB dataset
+
+Examples are augmented in batches on a pool of worker processes, each of
+which streams its shards to Parquet as it goes, so memory stays constant
+however many examples are augmented. Every example draws its augmentation
+from a seed derived from the run seed and its text, so the output is the
+same whatever the number of workers, shard size or batch size.
+"""
+
+import os
+import glob
+import json
+import time
+import random
+import string
+import hashlib
+import argparse
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datasets import load_dataset, Dataset
+import nltk
+
+AUGMENTATION_TYPES = ("synonym", "random", "none")
+OUTPUT_DIR = "data/augmented_imdb"
+SYNONYM_INDEX_DIR = "data/synonym_index"
+SYNONYM_INDEX_FORMAT = 2
+SYNONYM_INDEX_FILES = (
+    "words.npy", "skip.npy", "indptr.npy", "indices.npy", "substitutes.npy", "substitute_offsets.npy"
+)
+# Longer tokens (URLs, runs of punctuation) are never indexed; they have no WordNet synonyms
+MAX_WORD_LENGTH = 32
+CACHE_DIR = "data/augmentation_cache"
+REPORT_FILE = "augmentation_report.json"
+MANIFEST_FILE = "manifest.json"
+# Part of every cache key; bump when augmentation logic changes what a key produces
+AUGMENTATION_VERSION = 1
+DEFAULT_SEED = 42
+BATCH_SIZE = 256
+SHARD_SIZE = 10000
+
+AUGMENTED_SCHEMA = pa.schema([
+    ("text", pa.string()),
+    ("label", pa.int64()),
+    ("augmentation", pa.string()),
+])
+
+# Per-process state: the source split and augmenters, set up once per worker
+_WORKER = {"dataset": None, "augmenters": None, "cache": None}
+
+class SynonymIndex:
+    """WordNet synonyms for a corpus vocabulary, stored as memory-mapped CSR arrays
+
+    Built once from a corpus: every text is tokenized and POS-tagged the way
+    nlpaug's ``SynonymAug`` does it, each word keeps its most frequent tag,
+    and the WordNet lemmas for that tag (duplicates included, as nlpaug
+    samples from them) become the word's row. ``indptr``/``indices`` map
+    rows into a table of substitute strings, already cleaned up the way
+    nlpaug cleans them. Rows are kept only for words that have synonyms or
+    are never replaced (punctuation and determiners); any other token can be
+    picked for replacement but has no synonyms.
+
+    Words are a sorted fixed-width array looked up by binary search, and the
+    substitutes one UTF-8 buffer with offsets, so every part of the index is
+    a memory-mapped ``.npy`` file that worker processes share.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != SYNONYM_INDEX_FORMAT:
+            raise ValueError(f"Synonym index at {path} has an old format; rebuild it with SynonymIndex.build")
+        self.path = path
+
+        # Everything stays memory-mapped, so worker processes share one copy
+        # through the page cache; lookups only copy the rows they touch
+        self.words = self._load("words.npy")
+        self.skip = self._load("skip.npy")
+        self.indptr = self._load("indptr.npy")
+        self.indices = self._load("indices.npy")
+        self.substitute_bytes = self._load("substitutes.npy")
+        self.substitute_offsets = self._load("substitute_offsets.npy")
+
+        # Words missing from the index look up the sentinel last row: replaceable, no synonyms
+        self.oov = len(self.words)
+        self._query_dtype = f"U{self.words.dtype.itemsize // 4 + 1}"
+
+    def __len__(self) -> int:
+        return self.oov
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, name), mmap_mode="r")
+
+    def digest(self) -> str:
+        """Hash of the index files, so cached augmentations are tied to the index that produced them"""
+        digest = hashlib.blake2b(digest_size=16)
+        for name in SYNONYM_INDEX_FILES:
+            with open(os.path.join(self.path, name), "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def rows(self, tokens: Sequence[str]) -> np.ndarray:
+        """Row of each token, by binary search over the sorted words"""
+        if not self.oov or not tokens:
+            return np.full(len(tokens), self.oov, dtype=np.int64)
+        # Search each distinct token once; a batch repeats most of its tokens
+        distinct = {}
+        inverse = np.array([distinct.setdefault(token, len(distinct)) for token in tokens], dtype=np.int64)
+        # One character wider than any word, so longer tokens can't match a truncated prefix
+        queries = np.array(list(distinct), dtype=self._query_dtype)
+        positions = np.minimum(np.searchsorted(self.words, queries), self.oov - 1)
+        return np.where(self.words[positions] == queries, positions, self.oov)[inverse]
+
+    def synonym_counts(self, rows: np.ndarray) -> np.ndarray:
+        return self.indptr[rows + 1] - self.indptr[rows]
+
+    def substitute(self, i: int) -> str:
+        return bytes(self.substitute_bytes[self.substitute_offsets[i]:self.substitute_offsets[i + 1]]).decode("utf-8")
+
+    @staticmethod
+    def is_current(path: str) -> bool:
+        """Whether ``path`` holds an index in the current format"""
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as f:
+            return json.load(f).get("format") == SYNONYM_INDEX_FORMAT
+
+    @classmethod
+    def build(cls, texts: Iterable[str], path: str, pos_sample_size: Optional[int] = None) -> "SynonymIndex":
+        """Index the synonyms of every word in ``texts`` and write the index to ``path``
+
+        Only the first ``pos_sample_size`` texts are POS-tagged (all of them
+        by default); words first seen after that are looked up under every
+        part of speech.
+        """
+        from nltk.corpus import wordnet
+        from nlpaug.util.text.part_of_speech import PartOfSpeech
+        from nlpaug.util.text.tokenizer import Tokenizer
+
+        start_time = time.perf_counter()
+        tags = {}
+        num_texts = 0
+        for num_texts, text in enumerate(texts, 1):
+            tokens = Tokenizer.tokenizer(text)
+            if pos_sample_size is None or num_texts <= pos_sample_size:
+                for token, tag in nltk.pos_tag(tokens) if tokens else []:
+                    tags.setdefault(token, Counter())[tag] += 1
+            else:
+                for token in tokens:
+                    tags.setdefault(token, Counter())
+
+        words, skip, rows = [], [], []
+        substitute_ids = {}
+        for word in sorted(set(tags) | set(string.punctuation)):
+            if len(word) > MAX_WORD_LENGTH:
+                continue
+            tag = tags[word].most_common(1)[0][0] if tags.get(word) else None
+            if word in string.punctuation or tag == "DT":
+                words.append(word)
+                skip.append(True)
+                rows.append([])
+                continue
+
+            lemmas = []
+            for pos in PartOfSpeech.constituent2pos(tag) or [None]:
+                for synset in wordnet.synsets(word, pos=pos):
+                    lemmas.extend(lemma.name() for lemma in synset.lemmas())
+            candidates = [
+                lemma.replace("_", " ").replace("-", " ").lower() for lemma in lemmas if lemma.lower() != word.lower()
+            ]
+            if candidates:
+                words.append(word)
+                skip.append(False)
+                rows.append([substitute_ids.setdefault(candidate, len(substitute_ids)) for candidate in candidates])
+
+        # Sorted fixed-width words for binary search, and a sentinel row (replaceable,
+        # no synonyms) at the end of skip and indptr for words not in the index
+        encoded = [candidate.encode("utf-8") for candidate in substitute_ids]
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "words.npy"), np.array(words, dtype=f"U{MAX_WORD_LENGTH}"))
+        np.save(os.path.join(path, "skip.npy"), np.array(skip + [False], dtype=bool))
+        lengths = [len(row) for row in rows]
+        np.save(os.path.join(path, "indptr.npy"), np.cumsum([0] + lengths + [0], dtype=np.int64))
+        np.save(os.path.join(path, "indices.npy"), np.fromiter(
+            (i for row in rows for i in row), dtype=np.int32, count=sum(lengths)
+        ))
+        np.save(os.path.join(path, "substitutes.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        np.save(os.path.join(path, "substitute_offsets.npy"), np.cumsum([0] + [len(e) for e in encoded], dtype=np.int64))
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({
+                "format": SYNONYM_INDEX_FORMAT,
+                "texts": num_texts,
+                "vocabulary": len(tags),
+                "rows": len(words),
+                "substitutes": len(substitute_ids),
+                "pos_sample_size": pos_sample_size,
+                "wordnet": wordnet.get_version(),
+                "build_seconds": time.perf_counter() - start_time,
+            }, f, indent=2)
+        return cls(path)
+
+def _uniforms(seeds: np.ndarray, counters: np.ndarray) -> np.ndarray:
+    """Uniform [0, 1) floats from (seed, counter) pairs via splitmix64, so draws don't depend on batching"""
+    x = seeds + (counters + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+class IndexedSynonymAug:
+    """Synonym replacement with the same distribution as nlpaug's ``SynonymAug(aug_src='wordnet')``, from a SynonymIndex
+
+    Like nlpaug, ``ceil(aug_p * tokens)`` (clamped to [aug_min, aug_max])
+    replaceable tokens are picked uniformly without replacement, each is
+    swapped for a uniformly drawn lemma of its row if it has one, and the
+    text is detokenized. Token rows are a binary search, and picking tokens and
+    synonyms is a few NumPy ops over every token of a batch of documents;
+    only the replaced tokens are touched in Python. Random numbers come from
+    each document's seed, so a document augments the same way in any batch.
+    The tags are per word rather than per occurrence, which is the one
+    difference from nlpaug.
+    """
+
+    def __init__(self, index: SynonymIndex, aug_p: float = 0.3, aug_min: int = 1, aug_max: int = 10):
+        from nlpaug.augmenter.word.word_augmenter import WordAugmenter
+        from nlpaug.util.text.tokenizer import Tokenizer
+
+        self.index = index
+        self.aug_p = aug_p
+        self.aug_min = aug_min
+        self.aug_max = aug_max
+        self._tokenize = Tokenizer.tokenizer
+        self._detokenize = Tokenizer.reverse_tokenizer
+        self._word_case = WordAugmenter.get_word_case
+
+    def config(self) -> Dict:
+        return {
+            "class": type(self).__name__,
+            "aug_p": self.aug_p,
+            "aug_min": self.aug_min,
+            "aug_max": self.aug_max,
+            "index": self.index.digest(),
+        }
+
+    def augment(self, text: str, seed: Optional[int] = None) -> List[str]:
+        """nlpaug-style single-text call; without a seed, one is drawn from the global random module"""
+        return self.augment_batch([text], [random.getrandbits(64) if seed is None else seed])
+
+    def augment_batch(self, texts: Sequence[str], seeds: Sequence[int]) -> List[str]:
+        tokens = [self._tokenize(text) if text and text.strip() else [] for text in texts]
+        lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(texts))
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        rows = self.index.rows([token for doc in tokens for token in doc])
+
+        doc = np.repeat(np.arange(len(texts)), lengths)
+        position = (np.arange(len(rows)) - offsets[doc]).astype(np.uint64)
+        doc_seeds = np.array([seed & 0xFFFFFFFFFFFFFFFF for seed in seeds], dtype=np.uint64)[doc]
+
+        # Pick the replaceable tokens with the smallest random keys in each document
+        replaceable = ~self.index.skip[rows]
+        keys = np.where(replaceable, _uniforms(doc_seeds, 2 * position), 2.0)
+        order = np.lexsort((keys, doc))
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order)) - offsets[doc[order]]
+        aug_counts = np.clip(np.ceil(self.aug_p * lengths), self.aug_min, self.aug_max).astype(np.int64)
+        picked = replaceable & (rank < aug_counts[doc])
+
+        # Then a uniformly drawn synonym for each picked token that has any
+        counts = self.index.synonym_counts(rows)
+        replaced = np.flatnonzero(picked & (counts > 0))
+        choices = (_uniforms(doc_seeds[replaced], 2 * position[replaced] + np.uint64(1)) * counts[replaced]).astype(np.int64)
+        substitutes = self.index.indices[self.index.indptr[rows[replaced]] + choices]
+
+        for i, substitute in zip(replaced.tolist(), substitutes.tolist()):
+            d, p = doc[i], i - offsets[doc[i]]
+            original, candidate = tokens[d][p], self.index.substitute(substitute)
+            if self._word_case(original) == "capitalize" and self._word_case(candidate) == "lower":
+                candidate = candidate.capitalize()
+            tokens[d][p] = candidate
+
+        # nlpaug re-joins every text it picked tokens in, even when none had synonyms
+        touched = np.bincount(doc[picked], minlength=len(texts)) > 0
+        return [self._detokenize(tokens[d]) if touched[d] else text for d, text in enumerate(texts)]
+
+class AugmentationCache:
+    """Content-addressed store of augmented texts
+
+    Entries are keyed by a 16-byte hash of (text hash, augmentation type,
+    augmenter config, seed) and stored in Parquet segments, one per shard
+    that had misses. All keys are kept sorted in ``keys-<generation>.npy``,
+    with each entry's segment and row in ``locations-<generation>.npy``.
+    Both are memory-mapped, so worker processes share them, and a batch is
+    looked up with one ``searchsorted``. ``cache.json`` names the current
+    generation and its segments and is replaced atomically by ``commit``.
+    Segments written by workers become visible to lookups after a commit.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.join(path, "segments"), exist_ok=True)
+        state = {"generation": 0, "segments": []}
+        if os.path.exists(os.path.join(path, "cache.json")):
+            with open(os.path.join(path, "cache.json")) as f:
+                state = json.load(f)
+
+        self.generation = state["generation"]
+        self.segments = state["segments"]
+        if self.generation:
+            self.keys = np.load(self._file("keys"), mmap_mode="r")
+            self.locations = np.load(self._file("locations"), mmap_mode="r")
+        else:
+            self.keys = np.empty(0, dtype="S16")
+            self.locations = np.empty((0, 2), dtype=np.int32)
+        # Most recently read segments; hits for a shard usually come from one or two
+        self._tables = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _file(self, name: str, generation: Optional[int] = None) -> str:
+        return os.path.join(self.path, f"{name}-{self.generation if generation is None else generation:06d}.npy")
+
+    def lookup(self, keys: Sequence[bytes]) -> np.ndarray:
+        """Positions of ``keys`` in the cache, -1 where missing"""
+        query = np.array(keys, dtype="S16")
+        if not len(self.keys) or not len(query):
+            return np.full(len(query), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.keys, query), len(self.keys) - 1)
+        return np.where(self.keys[positions] == query, positions, -1)
+
+    def get(self, positions: Sequence[int]) -> List[Tuple[str, str]]:
+        """(text, augmentation) for cache positions returned by lookup"""
+        locations = self.locations[np.asarray(positions, dtype=np.int64)]
+        results = [None] * len(locations)
+        for segment in np.unique(locations[:, 0]).tolist():
+            table = self._segment(segment)
+            selected = np.flatnonzero(locations[:, 0] == segment)
+            rows = table.take(pa.array(locations[selected, 1]))
+            for i, text, augmentation in zip(
+                selected.tolist(), rows.column("text").to_pylist(), rows.column("augmentation").to_pylist()
+            ):
+                results[i] = (text, augmentation)
+        return results
+
+    def _segment(self, segment: int) -> pa.Table:
+        if segment not in self._tables:
+            if len(self._tables) >= 2:
+                self._tables.pop(next(iter(self._tables)))
+            self._tables[segment] = pq.read_table(
+                os.path.join(self.path, "segments", self.segments[segment]), columns=["text", "augmentation"]
+            )
+        return self._tables[segment]
+
+    def write_segment(self, keys: List[bytes], texts: List[str], augmentations: List[str]) -> str:
+        """Store new entries in a segment file named after its keys; returns the name for commit"""
+        name = f"segment-{hashlib.blake2b(b''.join(keys), digest_size=16).hexdigest()}.parquet"
+        path = os.path.join(self.path, "segments", name)
+        pq.write_table(
+            pa.table({"key": pa.array(keys, pa.binary(16)), "text": texts, "augmentation": augmentations}),
+            path + ".tmp",
+        )
+        os.replace(path + ".tmp", path)
+        return name
+
+    def commit(self, segments: List[str]):
+        """Add written segments to the index as a new generation"""
+        segments = [name for name in segments if name not in self.segments]
+        if not segments:
+            return
+
+        keys, locations = [np.asarray(self.keys)], [np.asarray(self.locations)]
+        for i, name in enumerate(segments, len(self.segments)):
+            segment_keys = pq.read_table(os.path.join(self.path, "segments", name), columns=["key"]).column("key")
+            keys.append(np.array(segment_keys.to_pylist(), dtype="S16"))
+            locations.append(np.stack([np.full(len(segment_keys), i), np.arange(len(segment_keys))], axis=1))
+
+        # Sorted and deduplicated; the first (oldest) copy of a key wins
+        keys, first = np.unique(np.concatenate(keys), return_index=True)
+        locations = np.concatenate(locations).astype(np.int32)[first]
+
+        previous, generation = self.generation, self.generation + 1
+        np.save(self._file("keys", generation), keys)
+        np.save(self._file("locations", generation), locations)
+        state_path = os.path.join(self.path, "cache.json")
+        with open(state_path + ".tmp", "w") as f:
+            json.dump({"generation": generation, "segments": self.segments + segments}, f)
+        os.replace(state_path + ".tmp", state_path)
+        if previous:
+            for name in ("keys", "locations"):
+                os.remove(self._file(name, previous))
+
+        self.generation, self.segments = generation, self.segments + segments
+        self.keys, self.locations = keys, locations
+        self._tables = {}
+
+class AugmentedShards:
+    """Lazy access to the shards of an augmentation run through its manifest
+
+    Nothing is read until a shard is asked for, so a training loader can
+    stream or pick shards without loading the whole augmented dataset.
+    """
+
+    def __init__(self, path: str = OUTPUT_DIR):
+        manifest_path = path if path.endswith(".json") else os.path.join(path, MANIFEST_FILE)
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        self.root = os.path.dirname(manifest_path)
+
+    def __len__(self) -> int:
+        return self.manifest["examples"]
+
+    @property
+    def num_shards(self) -> int:
+        return len(self.manifest["shards"])
+
+    def shard_path(self, i: int) -> str:
+        return os.path.join(self.root, self.manifest["shards"][i]["file"])
+
+    def shard(self, i: int, columns: Optional[List[str]] = None) -> pa.Table:
+        return pq.read_table(self.shard_path(i), columns=columns)
+
+    def iter_batches(
+        self, batch_size: int = BATCH_SIZE, shards: Optional[Iterable[int]] = None, columns: Optional[List[str]] = None
+    ) -> Iterator[Dict[str, list]]:
+        """Stream column batches from the given shards (all of them by default), one shard open at a time"""
+        for i in range(self.num_shards) if shards is None else shards:
+            for batch in pq.ParquetFile(self.shard_path(i)).iter_batches(batch_size=batch_size, columns=columns):
+                yield batch.to_pydict()
+
+    def to_iterable_dataset(self, shards: Optional[List[int]] = None):
+        """A datasets.IterableDataset over the shards, which DataLoader workers split between them"""
+        from datasets import IterableDataset
+
+        def examples(shards):
+            for batch in self.iter_batches(shards=shards):
+                yield from (dict(zip(batch, values)) for values in zip(*batch.values()))
+
+        return IterableDataset.from_generator(
+            examples, gen_kwargs={"shards": list(range(self.num_shards)) if shards is None else shards}
+        )
+
+def create_augmenters(synonym_index: Optional[str] = None) -> Dict:
+    """Augmenters by augmentation type; synonyms come from a SynonymIndex directory when one is given"""
+    import nlpaug.augmenter.word as naw
+    return {
+        "synonym": IndexedSynonymAug(SynonymIndex(synonym_index)) if synonym_index else naw.SynonymAug(aug_src='wordnet'),
+        "random": naw.RandomWordAug(),
+    }
+
+def augmenter_config(augmenter) -> Dict:
+    """Settings that determine an augmenter's output, for cache keys and the manifest"""
+    if hasattr(augmenter, "config"):
+        return augmenter.config()
+    import nlpaug
+    config = {"class": type(augmenter).__name__, "nlpaug": nlpaug.__version__}
+    for attr in ("action", "aug_src", "aug_p", "aug_min", "aug_max", "stopwords"):
+        if hasattr(augmenter, attr):
+            config[attr] = getattr(augmenter, attr)
+    return config
+
+def config_digest(config: Dict) -> str:
+    return hashlib.blake2b(json.dumps(config, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+def init_worker(dataset: Dataset, synonym_index: Optional[str] = None, cache_dir: Optional[str] = None):
+    """Process pool initializer: keep the (memory-mapped) source split, build augmenters and open the cache"""
+    _WORKER["dataset"] = dataset
+    _WORKER["augmenters"] = create_augmenters(synonym_index)
+    _WORKER["cache"] = AugmentationCache(cache_dir) if cache_dir else None
+
+def example_seed(text: str, seed: int) -> int:
+    """Seed for one example, derived from the run seed and the example's text"""
+    digest = hashlib.blake2b(text.encode(), digest_size=8, key=str(seed).encode())
+    return int.from_bytes(digest.digest(), "little")
+
+def cache_key(text: str, augmentation_type: str, digest: str, seed: int) -> bytes:
+    """Cache key of one example: (text hash, augmentation type, augmenter config digest, seed)"""
+    text_hash = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    fields = f"{augmentation_type}\0{digest}\0{seed}\0{AUGMENTATION_VERSION}".encode()
+    return hashlib.blake2b(text_hash + fields, digest_size=16).digest()
+
+def choose_augmentation(seed: int) -> str:
+    """Pick an example's augmentation type from its seed"""
+    return random.Random(seed).choice(AUGMENTATION_TYPES)
+
+@contextmanager
+def seeded_globals(seed: int):
+    """Seed the global generators nlpaug draws from for one example, restoring the caller's state afterwards"""
+    states = random.getstate(), np.random.get_state()
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    # Replay the draw choose_augmentation made, so outputs (and cache entries) match earlier runs
+    random.choice(AUGMENTATION_TYPES)
+    try:
+        yield
+    finally:
+        random.setstate(states[0])
+        np.random.set_state(states[1])
+
+def apply_augmenter(augmenter, text: str, augmentation_type: str) -> Tuple[str, str]:
+    """Run an nlpaug augmenter on one text; returns (text, augmentation type)"""
+    try:
+        augmented = augmenter.augment(text)
+    except LookupError:
+        # Missing NLTK corpora fail every example; don't hide that
+        raise
+    except Exception:
+        return text, "failed"
+
+    # nlpaug returns a list of augmentations, empty when it declined the input
+    if isinstance(augmented, list):
+        augmented = augmented[0] if augmented else None
+    if not augmented:
+        return text, "failed"
+    return augmented, augmentation_type
+
+def augment_text(text: str, augmenters: Dict, seed: int) -> Tuple[str, str]:
+    """Augment one text with a randomly chosen technique; returns (text, augmentation type)"""
+    augmentation_type = choose_augmentation(seed)
+    if augmentation_type == "none":
+        return text, augmentation_type
+    with seeded_globals(seed):
+        return apply_augmenter(augmenters[augmentation_type], text, augmentation_type)
+
+def plan_augmentations(texts: List[str], seed: int) -> Tuple[List[int], List[str]]:
+    """Per-example seeds and augmentation types for a batch"""
+    seeds = [example_seed(text, seed) for text in texts]
+    return seeds, [choose_augmentation(text_seed) for text_seed in seeds]
+
+def run_augmenters(texts: List[str], seeds: List[int], types: List[str], augmenters: Dict) -> List[Tuple[str, str]]:
+    """(text, augmentation) for planned examples
+
+    Augmenters with an ``augment_batch`` method get all their texts in one call.
+    """
+    results = [None] * len(texts)
+    batched = {}
+    for i, (text, text_seed, augmentation_type) in enumerate(zip(texts, seeds, types)):
+        if augmentation_type == "none":
+            results[i] = (text, augmentation_type)
+        elif hasattr(augmenters[augmentation_type], "augment_batch"):
+            batched.setdefault(augmentation_type, []).append(i)
+        else:
+            with seeded_globals(text_seed):
+                results[i] = apply_augmenter(augmenters[augmentation_type], text, augmentation_type)
+
+    for augmentation_type, indices in batched.items():
+        augmented = augmenters[augmentation_type].augment_batch([texts[i] for i in indices], [seeds[i] for i in indices])
+        for i, augmented_text in zip(indices, augmented):
+            results[i] = (augmented_text, augmentation_type) if augmented_text else (texts[i], "failed")
+    return results
+
+def augment_batch(texts: List[str], augmenters: Dict, seed: int) -> Tuple[List[str], List[str]]:
+    """Augment a batch of texts; returns the texts and the augmentation applied to each"""
+    results = run_augmenters(texts, *plan_augmentations(texts, seed), augmenters)
+    return [text for text, _ in results], [augmentation for _, augmentation in results]
+
+def augment_shard(
+    start: int,
+    stop: int,
+    path: str,
+    seed: int,
+    batch_size: int = BATCH_SIZE,
+    digests: Optional[Dict[str, str]] = None,
+    previous_fingerprint: Optional[str] = None,
+) -> Dict:
+    """Augment examples [start, stop) of the worker's split into one Parquet shard, batch by batch
+
+    Examples are looked up in the worker's cache by key first and only
+    misses are augmented; they are returned as a new cache segment to
+    commit. A shard whose fingerprint (its keys and labels) matches
+    ``previous_fingerprint`` and whose file exists is kept as it is.
+    """
+    dataset, augmenters, cache = _WORKER["dataset"], _WORKER["augmenters"], _WORKER.get("cache")
+    digests = digests or {}
+    start_time = time.perf_counter()
+    cpu_start = time.process_time()
+
+    # Plan every example first: its seed, augmentation type and cache key
+    plans = []
+    fingerprint = hashlib.blake2b(digest_size=16)
+    for batch_start in range(start, stop, batch_size):
+        batch = dataset[batch_start:min(stop, batch_start + batch_size)]
+        seeds, types = plan_augmentations(batch["text"], seed)
+        keys = [
+            cache_key(text, augmentation_type, digests.get(augmentation_type, ""), seed)
+            for text, augmentation_type in zip(batch["text"], types)
+        ]
+        fingerprint.update(b"".join(keys))
+        fingerprint.update(np.asarray(batch["label"], dtype=np.int64).tobytes())
+        plans.append((batch_start, seeds, types, keys))
+    fingerprint = fingerprint.hexdigest()
+
+    result = {"path": path, "examples": stop - start, "fingerprint": fingerprint, "reused": False, "segment": None}
+    if fingerprint == previous_fingerprint and os.path.exists(path):
+        return dict(result, reused=True, cache_hits=0, seconds=time.perf_counter() - start_time,
+                    cpu_seconds=time.process_time() - cpu_start, augmentations={})
+
+    counts = Counter()
+    hits = computed_count = 0
+    new_keys, new_texts, new_augmentations = [], [], []
+    # Written under a temporary name so a shard file is always complete
+    tmp_path = path + ".tmp"
+    with pq.ParquetWriter(tmp_path, AUGMENTED_SCHEMA) as writer:
+        for batch_start, seeds, types, keys in plans:
+            batch = dataset[batch_start:batch_start + len(keys)]
+            texts = batch["text"]
+            results = [None] * len(texts)
+
+            missing = [i for i, augmentation_type in enumerate(types) if augmentation_type != "none"]
+            if cache is not None and missing:
+                positions = cache.lookup([keys[i] for i in missing])
+                found = [(i, position) for i, position in zip(missing, positions.tolist()) if position >= 0]
+                for (i, _), cached in zip(found, cache.get([position for _, position in found])):
+                    results[i] = cached
+                hits += len(found)
+                # Failures may be transient, so an entry cached by an older run is retried
+                missing = [i for i in missing if results[i] is None or results[i][1] == "failed"]
+                hits -= sum(results[i] is not None for i in missing)
+
+            computed = run_augmenters(
+                [texts[i] for i in missing], [seeds[i] for i in missing], [types[i] for i in missing], augmenters
+            )
+            computed_count += len(missing)
+            for i, (text, augmentation) in zip(missing, computed):
+                results[i] = (text, augmentation)
+                if augmentation == "failed":
+                    # Never cached, so the next run tries again
+                    continue
+                new_keys.append(keys[i])
+                new_texts.append(text)
+                new_augmentations.append(augmentation)
+            for i, augmentation_type in enumerate(types):
+                if augmentation_type == "none":
+                    results[i] = (texts[i], augmentation_type)
+
+            augmentations = [augmentation for _, augmentation in results]
+            counts.update(augmentations)
+            writer.write_table(pa.table(
+                {"text": [text for text, _ in results], "label": batch["label"], "augmentation": augmentations},
+                schema=AUGMENTED_SCHEMA,
+            ))
+    os.replace(tmp_path, path)
+
+    if cache is not None and new_keys:
+        result["segment"] = cache.write_segment(new_keys, new_texts, new_augmentations)
+
+    return dict(
+        result,
+        cache_hits=hits,
+        computed=computed_count,
+        seconds=time.perf_counter() - start_time,
+        cpu_seconds=time.process_time() - cpu_start,
+        augmentations=dict(counts),
+    )
+
+def augment_to_parquet(
+    dataset: Dataset,
+    output_dir: str,
+    seed: int = DEFAULT_SEED,
+    num_proc: Optional[int] = None,
+    batch_size: int = BATCH_SIZE,
+    shard_size: int = SHARD_SIZE,
+    synonym_index: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+) -> Dict:
+    """Augment a text/label split into Parquet shards under output_dir and return a throughput report
+
+    Shards are the unit of work: ``num_proc`` workers (every CPU by default)
+    each take the next shard, so the output holds one file per
+    ``shard_size`` examples, in order. Synonyms come from the SynonymIndex
+    at ``synonym_index`` if given, else from nlpaug's WordNet lookups. With
+    a ``cache_dir``, examples already augmented with the same text, type,
+    augmenter config and seed are reused, and so are whole shards whose
+    contents did not change since the last run into ``output_dir``.
+
+    ``manifest.json`` in ``output_dir`` lists the shards with the settings
+    that produced them, for ``AugmentedShards``; the report is also written
+    to ``augmentation_report.json``.
+    """
+    num_proc = num_proc or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+
+    # Cache keys cover each augmenter's settings, so changing one only recomputes its examples
+    configs = {name: augmenter_config(augmenter) for name, augmenter in create_augmenters(synonym_index).items()}
+    digests = {name: config_digest(config) for name, config in configs.items()}
+
+    # Shards of the last run into output_dir, reused when their fingerprint still matches
+    previous = {}
+    if cache_dir and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = {shard["file"]: shard for shard in json.load(f)["shards"]}
+
+    shards = [
+        (start, min(start + shard_size, len(dataset)), os.path.join(output_dir, f"shard-{i:05d}.parquet"))
+        for i, start in enumerate(range(0, len(dataset), shard_size))
+    ]
+    planned = {path for _, _, path in shards}
+    for stale in glob.glob(os.path.join(output_dir, "shard-*.parquet")):
+        if stale not in planned:
+            os.remove(stale)
+
+    def shard_args(start, stop, path):
+        fingerprint = previous.get(os.path.basename(path), {}).get("fingerprint")
+        return start, stop, path, seed, batch_size, digests, fingerprint
+
+    start_time = time.perf_counter()
+    results = []
+    if num_proc == 1:
+        init_worker(dataset, synonym_index, cache_dir)
+        for start, stop, path in shards:
+            results.append(augment_shard(*shard_args(start, stop, path)))
+            print(f"  Processed {stop}/{len(dataset)} examples...")
+    else:
+        initargs = (dataset, synonym_index, cache_dir)
+        with ProcessPoolExecutor(max_workers=num_proc, initializer=init_worker, initargs=initargs) as pool:
+            futures = [pool.submit(augment_shard, *shard_args(start, stop, path)) for start, stop, path in shards]
+            for future in as_completed(futures):
+                results.append(future.result())
+                print(f"  Processed {sum(result['examples'] for result in results)}/{len(dataset)} examples...")
+    seconds = time.perf_counter() - start_time
+
+    results.sort(key=lambda result: result["path"])
+    cache_entries = None
+    if cache_dir:
+        cache = AugmentationCache(cache_dir)
+        cache.commit([result["segment"] for result in results if result["segment"]])
+        cache_entries = len(cache)
+
+    # Reused shards keep the counts recorded when they were written
+    for result in results:
+        if result["reused"]:
+            result["augmentations"] = previous[os.path.basename(result["path"])]["augmentations"]
+
+    augmentations = Counter()
+    for result in results:
+        augmentations.update(result["augmentations"])
+    cpu_seconds = sum(result["cpu_seconds"] for result in results)
+    computed = sum(result.get("computed", 0) for result in results)
+
+    manifest = {
+        "version": AUGMENTATION_VERSION,
+        "examples": len(dataset),
+        "seed": seed,
+        "shard_size": shard_size,
+        "augmenters": configs,
+        "schema": {field.name: str(field.type) for field in AUGMENTED_SCHEMA},
+        "shards": [
+            dict(
+                file=os.path.basename(result["path"]),
+                examples=result["examples"],
+                fingerprint=result["fingerprint"],
+                augmentations=result["augmentations"],
+            )
+            for result in results
+        ],
+    }
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    report = {
+        "examples": len(dataset),
+        "seed": seed,
+        "processes": num_proc,
+        "batch_size": batch_size,
+        "shard_size": shard_size,
+        "synonym_source": "index" if synonym_index else "nlpaug",
+        "seconds": seconds,
+        "examples_per_second": len(dataset) / seconds if seconds else 0.0,
+        "examples_per_second_per_core": len(dataset) / seconds / num_proc if seconds else 0.0,
+        "examples_per_cpu_second": len(dataset) / cpu_seconds if cpu_seconds else 0.0,
+        "augmentations": dict(augmentations),
+        "cache": {
+            "computed": computed,
+            "hits": sum(result.get("cache_hits", 0) for result in results),
+            "reused_shards": sum(result["reused"] for result in results),
+            "entries": cache_entries,
+        },
+        "shards": [
+            dict(
+                file=os.path.basename(result["path"]),
+                examples=result["examples"],
+                seconds=result["seconds"],
+                reused=result["reused"],
+                cache_hits=result.get("cache_hits", 0),
+                augmentations=result["augmentations"],
+            )
+            for result in results
+        ],
+    }
+    with open(os.path.join(output_dir, REPORT_FILE), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def get_augmented_dataset(
+    sample_size: Optional[int] = 5000,
+    save: bool = True,
+    output_dir: str = OUTPUT_DIR,
+    seed: int = DEFAULT_SEED,
+    num_proc: Optional[int] = None,
+    batch_size: int = BATCH_SIZE,
+    shard_size: int = SHARD_SIZE,
+    synonym_index: Optional[str] = None,
+    cache_dir: Optional[str] = CACHE_DIR,
+):
+    """Generate augmented dataset for training
+
+    ``sample_size=None`` augments the whole IMDB train split. Shards are
+    written to ``output_dir``; with ``save=False`` they go to a temporary
+    directory that is removed once the dataset has been loaded. Synonyms come
+    from nlpaug's per-call WordNet lookups unless ``synonym_index`` names an
+    index directory (e.g. ``SYNONYM_INDEX_DIR``); a missing index is built
+    first, which POS-tags the whole train split once.
+    Augmentations are cached in ``cache_dir`` (``None`` disables the cache),
+    so reruns and larger ``sample_size`` values only augment new examples.
+    Training code that doesn't need the whole dataset in memory can open
+    ``output_dir`` with ``AugmentedShards`` instead.
+    """
+    print("Loading IMDB dataset...")
+    dataset = load_dataset("imdb")
+    nltk.download('wordnet', quiet=True)
+
+    if synonym_index and not SynonymIndex.is_current(synonym_index):
+        print(f"Building synonym index over the train split vocabulary in {synonym_index}...")
+        nltk.download('averaged_perceptron_tagger', quiet=True)
+        texts = (text for batch in dataset["train"].iter(batch_size=1000) for text in batch["text"])
+        index = SynonymIndex.build(texts, synonym_index)
+        print(f"Indexed {len(index)} words in {index.meta['build_seconds']:.1f}s")
+
+    # Take a subset for augmentation
+    train_subset = dataset["train"]
+    if sample_size is not None:
+        print(f"Selecting {sample_size} examples for augmentation...")
+        train_subset = train_subset.select(range(min(sample_size, len(train_subset))))
+
+    print("Applying augmentation techniques...")
+    with tempfile.TemporaryDirectory() as tmp:
+        shard_dir = output_dir if save else tmp
+        report = augment_to_parquet(
+            train_subset, shard_dir, seed, num_proc, batch_size, shard_size, synonym_index, cache_dir
+        )
+        print(
+            f"Augmented {report['examples']} examples in {report['seconds']:.1f}s: "
+            f"{report['examples_per_second']:.1f} examples/s, "
+            f"{report['examples_per_second_per_core']:.1f} examples/s per core on {report['processes']} processes"
+        )
+        print(f"Augmentations applied: {report['augmentations']}")
+        if cache_dir:
+            cache = report["cache"]
+            print(
+                f"Cache: {cache['computed']} examples augmented, {cache['hits']} cache hits, "
+                f"{cache['reused_shards']} shards reused, {cache['entries']} entries"
+            )
+
+        shard_files = [os.path.join(shard_dir, shard["file"]) for shard in AugmentedShards(shard_dir).manifest["shards"]]
+        augmented_dataset = Dataset.from_parquet(shard_files) if shard_files else Dataset.from_dict(
+            {"text": [], "label": [], "augmentation": []}
+        )
+
+    if save:
+        print(f"Augmented dataset saved to {output_dir}")
+
+    print("Augmentation complete!")
+    return augmented_dataset
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Augment IMDB training examples into Parquet shards")
+    parser.add_argument("--sample-size", type=int, default=5000, help="Examples to augment; 0 for the whole split")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--num-proc", type=int, default=None, help="Worker processes (default: every CPU)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument(
+        "--synonym-index",
+        nargs="?",
+        const=SYNONYM_INDEX_DIR,
+        default=None,
+        help=f"Look synonyms up in an index (default dir: {SYNONYM_INDEX_DIR}), built from the train split if missing; "
+        "without this flag nlpaug's WordNet lookups are used",
+    )
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Augmentation cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="Augment every example, without reading or filling the cache")
+    args = parser.parse_args()
+
+    get_augmented_dataset(
+        sample_size=args.sample_size or None,
+        output_dir=args.output_dir,
+        seed=args.seed,
+        num_proc=args.num_proc,
+        batch_size=args.batch_size,
+        shard_size=args.shard_size,
+        synonym_index=args.synonym_index,
+        cache_dir=None if args.no_cache else args.cache_dir,
+    )
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+import torch
+from peft import PeftModel
+from peft.utils.other import ModulesToSaveWrapper, _set_trainable
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger("model-server.adapters")
+
+# Metrics
+ADAPTER_EVENTS = Counter("lora_adapter_events_total", "LoRA adapter page-ins and evictions", ["event"])
+ADAPTERS_RESIDENT = Gauge("lora_adapters_resident", "LoRA adapters currently held in memory")
+
+class UnknownAdapter(KeyError):
+    """Raised when a request names an adapter that is not configured"""
+
+class AdapterSource:
+    """Where adapters come from: explicit ``name -> path`` pairs and/or a directory
+
+    Every subdirectory of ``directory`` holding an ``adapter_config.json`` is
+    an adapter named after the subdirectory, so per-customer adapters can be
+    added without restarting the server.
+    """
+
+    def __init__(self, paths: Optional[Dict[str, str]] = None, directory: Optional[str] = None):
+        self.paths = dict(paths or {})
+        self.directory = directory
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.paths or self.directory)
+
+    def resolve(self, name: str) -> str:
+        if name in self.paths:
+            return self.paths[name]
+
+        # Only plain directory names, never paths outside the adapter directory
+        if self.directory and name == os.path.basename(name) and not name.startswith("."):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(os.path.join(path, "adapter_config.json")):
+                return path
+
+        raise UnknownAdapter(f"Unknown adapter: {name}")
+
+class AdapterPool:
+    """LoRA adapters paged in and out of one shared base model
+
+    The base model is wrapped in a ``PeftModel`` when the first adapter is
+    loaded; at most ``max_resident`` adapters are kept, evicting the least
+    recently used. peft selects the active adapter by mutating the model, so
+    every forward pass runs under one lock: callers should group work by
+    adapter so each switch is paid once per group rather than per request.
+    """
+
+    def __init__(self, model, source: AdapterSource, device: torch.device, max_resident: int = 8):
+        self.base_model = model
+        self.source = source
+        self.device = device
+        self.max_resident = max(1, max_resident)
+        self.model = None
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def resident(self):
+        return list(self._resident)
+
+    def validate(self, name: str):
+        """Raise UnknownAdapter unless ``name`` can be loaded"""
+        if name not in self._resident:
+            self.source.resolve(name)
+
+    def run(self, adapter: Optional[str], fn: Callable, *args):
+        """Call ``fn(model, *args)`` with ``adapter`` active, or the plain base model if None"""
+        with self._lock:
+            if adapter is None:
+                if self.model is None:
+                    return fn(self.base_model, *args)
+                with self._base_only():
+                    return fn(self.model, *args)
+
+            self._page_in(adapter)
+            self.model.set_adapter(adapter)
+            return fn(self.model, *args)
+
+    def _page_in(self, name: str):
+        if name in self._resident:
+            self._resident.move_to_end(name)
+            ADAPTER_EVENTS.labels("hit").inc()
+            return
+
+        path = self.source.resolve(name)
+        start_time = time.perf_counter()
+        if self.model is None:
+            self.model = PeftModel.from_pretrained(self.base_model, path, adapter_name=name)
+        else:
+            # peft only creates per-adapter classification heads for the first
+            # adapter, so later adapters' heads would silently not load
+            _set_trainable(self.model, name)
+            self.model.load_adapter(path, adapter_name=name)
+        self.model.eval()
+
+        # Match the base model's device and dtype (bf16 bases otherwise mix dtypes)
+        self._cast_adapter(name, next(self.base_model.parameters()).dtype)
+
+        self._resident[name] = path
+        ADAPTER_EVENTS.labels("load").inc()
+        logger.info(f"Loaded adapter {name} from {path} in {time.perf_counter() - start_time:.2f} seconds")
+
+        while len(self._resident) > self.max_resident:
+            self._evict(next(iter(self._resident)))
+        ADAPTERS_RESIDENT.set(len(self._resident))
+
+    def _evict(self, name: str):
+        # peft has no delete_adapter yet, so drop the adapter's entries from
+        # every per-adapter dict it added to the model
+        for module in list(self.model.modules()):
+            for container in self._adapter_containers(module):
+                if name in container:
+                    del container[name]
+        self.model.peft_config.pop(name, None)
+        del self._resident[name]
+        ADAPTER_EVENTS.labels("eviction").inc()
+        logger.info(f"Evicted adapter {name}")
+
+    def _cast_adapter(self, name: str, dtype: torch.dtype):
+        for module in self.model.modules():
+            for container in self._adapter_containers(module):
+                if isinstance(container, torch.nn.ModuleDict) and name in container:
+                    container[name].to(device=self.device, dtype=dtype)
+                elif isinstance(container, torch.nn.ParameterDict) and name in container:
+                    container[name] = torch.nn.Parameter(
+                        container[name].to(device=self.device, dtype=dtype), requires_grad=False
+                    )
+
+    @staticmethod
+    def _adapter_containers(module: torch.nn.Module):
+        """Per-adapter dicts on a module (lora_A, lora_B, scaling, modules_to_save, ...)"""
+        for attr, value in list(vars(module).items()) + list(module._modules.items()):
+            if attr.startswith("_"):
+                continue
+            if isinstance(value, (dict, torch.nn.ModuleDict, torch.nn.ParameterDict)):
+                yield value
+
+    @contextmanager
+    def _base_only(self):
+        """Disable LoRA layers and per-adapter heads for one base-model forward pass"""
+        heads = [module for module in self.model.modules() if isinstance(module, ModulesToSaveWrapper)]
+        active = [module.active_adapter for module in heads]
+
+        self.model.base_model.disable_adapter_layers()
+        for module in heads:
+            module.active_adapter = None
+        try:
+            yield
+        finally:
+            self.model.base_model.enable_adapter_layers()
+            for module, active_adapter in zip(heads, active):
+                module.active_adapter = active_adapter
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Sequence
+
+from prometheus_client import Histogram
+
+logger = logging.getLogger("model-server.batching")
+
+# Metrics
+BATCH_SIZE = Histogram(
+    "model_batch_size",
+    "Number of requests coalesced into a single forward pass",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+BATCH_QUEUE_DEPTH = Histogram(
+    "model_batch_queue_depth",
+    "Requests waiting in the micro-batching queue when a batch is flushed",
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+BATCH_WAIT = Histogram(
+    "model_batch_wait_seconds",
+    "Time a request spent queued before its batch was flushed",
+)
+
+def plan_length_buckets(
+    lengths: Sequence[int],
+    boundaries: Sequence[int] = (64, 128, 256, 512),
+    max_bucket_size: Optional[int] = None,
+) -> List[List[int]]:
+    """Group item indices into sub-batches of similar token length
+
+    Items are sorted by length and a new bucket starts whenever the length
+    crosses the next boundary or the bucket reaches ``max_bucket_size``, so
+    each sub-batch only pads up to its own longest item.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    boundaries = sorted(boundaries)
+
+    buckets = []
+    current: List[int] = []
+    current_limit = None
+    for i in order:
+        limit = next((b for b in boundaries if lengths[i] <= b), None)
+        full = max_bucket_size is not None and len(current) >= max_bucket_size
+        if current and (limit != current_limit or full):
+            buckets.append(current)
+            current = []
+        current.append(i)
+        current_limit = limit
+
+    if current:
+        buckets.append(current)
+    return buckets
+
+class MicroBatcher:
+    """Coalesces single-item requests into batches flushed on size or deadline
+
+    Callers ``await submit(item)`` and get back their own result. A background
+    task collects queued items and hands them to ``process_batch`` as one list
+    once ``max_batch_size`` items are waiting or the oldest item has waited
+    ``max_wait_ms`` milliseconds, whichever comes first. Up to
+    ``max_in_flight`` batches are processed concurrently, and ``submit``
+    raises ``asyncio.QueueFull`` once ``max_queue_size`` items are waiting.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        max_queue_size: int = 0,
+        max_in_flight: int = 1,
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        self.max_in_flight = max_in_flight
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._flushes = set()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Start the flush loop on the running event loop"""
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and fail any request still waiting"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher stopped"))
+
+    async def submit(self, item: Any) -> Any:
+        """Queue a single item and wait for its result"""
+        if self._worker is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> list:
+        # Block for the first item, then fill the batch until the deadline
+        batch = [await self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                # Deadline passed: still take whatever is already queued
+                while len(batch) < self.max_batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        while True:
+            # Only pull the next batch once there is capacity to process it
+            await self._in_flight.acquire()
+            try:
+                batch = await self._collect()
+            except asyncio.CancelledError:
+                self._in_flight.release()
+                raise
+            task = asyncio.get_running_loop().create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list):
+        try:
+            # Drop requests whose caller has already gone away
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                return
+
+            flushed_at = time.perf_counter()
+            BATCH_SIZE.observe(len(batch))
+            BATCH_QUEUE_DEPTH.observe(self._queue.qsize())
+            for _, _, enqueued_at in batch:
+                BATCH_WAIT.observe(flushed_at - enqueued_at)
+
+            items = [item for item, _, _ in batch]
+            try:
+                results = await self.process_batch(items)
+            except Exception as e:
+                logger.error(f"Batch of {len(items)} failed: {str(e)}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._in_flight.release()
@@ -0,0 +1,108 @@
+import hashlib
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Optional
+
+from prometheus_client import Counter, Gauge
+
+# Metrics
+CACHE_EVENTS = Counter("prediction_cache_events_total", "Prediction cache lookups and evictions", ["event"])
+CACHE_ENTRIES = Gauge("prediction_cache_entries", "Entries held in the prediction cache")
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFC with whitespace runs collapsed"""
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
+class PredictionCache:
+    """Content-addressed LRU cache of model predictions with TTL expiry
+
+    Keys are a SHA-256 of the normalized text and the model identity, so a
+    new model version can never be served a stale prediction. The cache is
+    bounded by ``max_entries`` and, if set, an approximate ``max_bytes``;
+    least recently used entries are evicted first. Setting ``max_entries``
+    to 0 disables caching.
+    """
+
+    def __init__(self, max_entries: int = 100000, max_bytes: int = 0, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(text: str, model_id: str) -> str:
+        digest = hashlib.sha256(model_id.encode())
+        digest.update(b"\0")
+        digest.update(normalize_text(text).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _entry_size(key: str, value: Any) -> int:
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, tuple):
+            size += sum(sys.getsizeof(item) for item in value)
+        return size
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                CACHE_EVENTS.labels("miss").inc()
+                return None
+
+            value, expires_at, size = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                CACHE_EVENTS.labels("expired").inc()
+                CACHE_EVENTS.labels("miss").inc()
+                return None
+
+            self._entries.move_to_end(key)
+            CACHE_EVENTS.labels("hit").inc()
+            return value
+
+    def put(self, key: str, value: Any):
+        if not self.enabled:
+            return
+
+        size = self._entry_size(key, value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds, size)
+            self._bytes += size
+            CACHE_ENTRIES.set(len(self._entries))
+
+            # Evict least recently used entries until within bounds
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._entries)))
+                CACHE_EVENTS.labels("eviction").inc()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            CACHE_ENTRIES.set(0)
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+        CACHE_ENTRIES.set(len(self._entries))
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+import torch
+from prometheus_client import Counter, Gauge
+
+import inference
+
+logger = logging.getLogger("model-server.executor")
+
+# Metrics
+EXECUTOR_PENDING = Gauge("model_executor_pending", "Inference jobs admitted and not yet finished")
+EXECUTOR_REJECTED = Counter("model_executor_rejected_total", "Inference jobs rejected because the queue was full")
+
+class ExecutorSaturated(Exception):
+    """Raised when the inference queue is full; callers should retry later"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class InferenceExecutor:
+    """Runs blocking model calls off the event loop with bounded admission
+
+    ``thread`` mode runs ``local_fn`` on a small thread pool that shares the
+    in-process model; torch's intra-op pool is split evenly between the
+    workers so concurrent forward passes do not oversubscribe the cores.
+    ``process`` mode starts ``workers`` processes that each load their own CPU
+    replica of ``model_path`` and run ``inference.replica_predict``.
+
+    At most ``max_pending`` jobs may be running or queued at once; beyond
+    that ``run`` raises ``ExecutorSaturated`` instead of queueing, unless
+    called with ``wait=True``. Waiting callers (work the server has already
+    accepted, such as micro-batches and streams) queue in FIFO order, and
+    each finished job hands its slot straight to the oldest waiter.
+    """
+
+    def __init__(
+        self,
+        local_fn: Callable,
+        mode: str = "thread",
+        workers: int = 1,
+        max_pending: int = 4,
+        intra_op_threads: Optional[int] = None,
+        model_path: Optional[str] = None,
+    ):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown inference mode: {mode}")
+
+        self.local_fn = local_fn
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self.intra_op_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.model_path = model_path
+        self._pool = None
+        self._start_lock = threading.Lock()
+        self._pending = 0
+        self._avg_latency = 0.0
+        # Futures of callers waiting for a slot, oldest first
+        self._waiters = deque()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def started(self) -> bool:
+        return self._pool is not None
+
+    def start(self):
+        """Create the worker pool; in process mode blocks until every replica is loaded
+
+        Blocking, so call it from the server's startup (or a thread), not the
+        event loop. Concurrent calls wait for the first one to finish.
+        """
+        with self._start_lock:
+            if self._pool is not None:
+                return
+
+            if self.mode == "thread":
+                torch.set_num_threads(self.intra_op_threads)
+                pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+            else:
+                # fork is unsafe once torch has started its thread pools
+                pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=inference.init_replica,
+                    initargs=(self.model_path, self.intra_op_threads),
+                )
+                # Wait for replicas to load so startup failures surface here
+                futures = [pool.submit(inference.replica_ready) for _ in range(self.workers)]
+                if not all(future.result() for future in futures):
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise RuntimeError("Model replica failed to load")
+            self._pool = pool
+
+        logger.info(
+            f"Inference executor started: mode={self.mode} workers={self.workers} "
+            f"intra_op_threads={self.intra_op_threads} max_pending={self.max_pending}"
+        )
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely to free up"""
+        waves = self._pending / self.workers
+        return max(1, math.ceil(self._avg_latency * waves))
+
+    async def _acquire(self, wait: bool):
+        if self._pending < self.max_pending:
+            self._pending += 1
+            EXECUTOR_PENDING.set(self._pending)
+            return
+        if not wait:
+            EXECUTOR_REJECTED.inc()
+            raise ExecutorSaturated(self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Cancelled after being handed a slot: pass it on
+                self._release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def _release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot goes to the waiter, so pending stays the same
+                waiter.set_result(None)
+                return
+        self._pending -= 1
+        EXECUTOR_PENDING.set(self._pending)
+
+    async def run(self, *args, wait: bool = False) -> Any:
+        """Run one inference job on the pool; ``wait`` waits for a free slot instead of raising ExecutorSaturated"""
+        if self._pool is None:
+            # Normally started at server startup; loading replicas here must not block the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.start)
+
+        await self._acquire(wait)
+
+        if self.mode == "process":
+            fn = partial(inference.replica_predict, *args)
+        else:
+            fn = partial(self.local_fn, *args)
+
+        start_time = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn)
+        finally:
+            self._release()
+            # Exponentially weighted average of job latency for Retry-After
+            latency = time.perf_counter() - start_time
+            self._avg_latency = 0.8 * self._avg_latency + 0.2 * latency if self._avg_latency else latency
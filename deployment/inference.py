@@ -0,0 +1,366 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer
+
+from batching import plan_length_buckets
+
+logger = logging.getLogger("model-server.inference")
+
+MAX_LENGTH = 512
+LENGTH_BUCKETS = tuple(int(b) for b in os.environ.get("LENGTH_BUCKETS", "64,128,256,512").split(","))
+
+# Sentiment label for each class index
+LABELS = ("Negative", "Positive")
+
+# Synchronize CUDA between stages so per-stage timings are exact (costs some throughput)
+SYNC_STAGE_TIMINGS = os.environ.get("SYNC_STAGE_TIMINGS", "false").lower() == "true"
+
+# Numeric precision and execution backend applied at load time
+PRECISIONS = ("fp32", "bf16", "int8")
+BACKENDS = ("eager", "compile", "torchscript")
+MODEL_PRECISION = os.environ.get("MODEL_PRECISION", "fp32")
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "eager")
+
+# Map checkpoints into memory instead of reading them (safetensors only)
+MODEL_MMAP = os.environ.get("MODEL_MMAP", "true").lower() == "true"
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+# Model replica owned by this process when running inside a process pool worker
+_REPLICA = {"model": None, "tokenizer": None}
+
+def class_labels(config) -> Tuple[str, ...]:
+    """Class names by index from a model config's id2label
+
+    Binary checkpoints saved without names (``LABEL_0``, ``LABEL_1``) are
+    the sentiment models this server was built for and get ``LABELS``.
+    """
+    id2label = getattr(config, "id2label", None) or {}
+    labels = tuple(str(id2label[i]) for i in sorted(id2label))
+    if not labels or (len(labels) == len(LABELS) and labels == tuple(f"LABEL_{i}" for i in range(len(labels)))):
+        return LABELS
+    return labels
+
+def load_tokenizer(model_path: str):
+    """Load the Rust-backed fast tokenizer, warning if only the Python one exists"""
+    tokenizer = AutoTokenizer.from_pretrained(model_path, use_fast=True)
+    if not tokenizer.is_fast:
+        logger.warning(f"No fast tokenizer found for {model_path}; tokenization will run in Python")
+    return tokenizer
+
+def safetensors_files(model_path: str) -> List[str]:
+    """Safetensors shards of a checkpoint directory, or [] if it has none"""
+    index_path = os.path.join(model_path, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            shards = sorted(set(json.load(f)["weight_map"].values()))
+        return [os.path.join(model_path, shard) for shard in shards]
+
+    single_path = os.path.join(model_path, "model.safetensors")
+    return [single_path] if os.path.exists(single_path) else []
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """Tensors backed directly by a private memory map of a safetensors file
+
+    Pages come from the page cache and are only copied if written to, so
+    every process on the node that maps the same checkpoint shares one copy
+    of the weights.
+    """
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + begin)
+        tensors[name] = tensor.reshape(info["shape"])
+    return tensors
+
+def load_mmap_model(model_path: str, **config_kwargs):
+    """Build the model on the meta device and point its weights at mmap'd tensors
+
+    Raises ``ValueError`` if the checkpoint does not cover every parameter
+    and buffer, so the caller can fall back to ``from_pretrained``.
+    """
+    files = safetensors_files(model_path)
+    if not files:
+        raise ValueError(f"No safetensors checkpoint in {model_path}")
+
+    config = AutoConfig.from_pretrained(model_path, **config_kwargs)
+    with torch.device("meta"):
+        model = AutoModelForSequenceClassification.from_config(config)
+
+    prefix = model.base_model_prefix
+    for path in files:
+        for name, tensor in mmap_safetensors(path).items():
+            # Base-model checkpoints omit the task model's prefix
+            try:
+                module_name, _, attr = name.rpartition(".")
+                module = model.get_submodule(module_name)
+            except AttributeError:
+                module_name, _, attr = f"{prefix}.{name}".rpartition(".")
+                module = model.get_submodule(module_name)
+
+            if attr in module._parameters:
+                module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+            elif attr in module._buffers:
+                module._buffers[attr] = tensor
+
+    model.tie_weights()
+    missing = [name for name, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if missing:
+        raise ValueError(f"Checkpoint is missing {len(missing)} tensors, e.g. {missing[0]}")
+    return model
+
+@contextmanager
+def _phase(name: str, timings: Optional[Dict[str, float]], on_phase: Optional[Callable[[str], None]]):
+    if on_phase is not None:
+        on_phase(name)
+    start_time = time.perf_counter()
+    yield
+    if timings is not None:
+        timings[name] = time.perf_counter() - start_time
+
+def load_model_and_tokenizer(
+    model_path: str,
+    device: torch.device,
+    precision: str = MODEL_PRECISION,
+    backend: str = MODEL_BACKEND,
+    warmup: bool = True,
+    timings: Optional[Dict[str, float]] = None,
+    on_phase: Optional[Callable[[str], None]] = None,
+):
+    """Load the tokenizer and sequence classification model for inference
+
+    Safetensors checkpoints are memory-mapped when ``MODEL_MMAP`` is set;
+    anything else goes through ``from_pretrained``. The model is then
+    converted to ``precision`` and wrapped by ``backend`` (see
+    ``optimize_model``), and warmed up so lazy initialisation and
+    compilation happen before the first request.
+
+    Seconds spent in each phase (tokenizer, weights, device_transfer,
+    optimize, warmup) are written to ``timings``, and ``on_phase`` is
+    called with the name of each phase as it starts.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model precision {precision}, expected one of {PRECISIONS}")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend {backend}, expected one of {BACKENDS}")
+
+    with _phase("tokenizer", timings, on_phase):
+        tokenizer = load_tokenizer(model_path)
+
+    with _phase("weights", timings, on_phase):
+        # TorchScript tracing needs tuple outputs instead of ModelOutput objects
+        config_kwargs = {"torchscript": backend == "torchscript"}
+        model = None
+        if MODEL_MMAP:
+            try:
+                model = load_mmap_model(model_path, **config_kwargs)
+            except ValueError as e:
+                logger.info(f"Memory-mapped load unavailable, using from_pretrained: {str(e)}")
+        if model is None:
+            model = AutoModelForSequenceClassification.from_pretrained(model_path, **config_kwargs)
+
+    with _phase("device_transfer", timings, on_phase):
+        model.to(device)
+        model.eval()
+
+    with _phase("optimize", timings, on_phase):
+        # Traced models lose their config, so class names are read beforehand
+        labels = class_labels(model.config)
+        model = optimize_model(model, tokenizer, device, precision, backend)
+        model.class_labels = labels
+
+    if warmup:
+        with _phase("warmup", timings, on_phase):
+            warmup_model(model, tokenizer, device)
+    return model, tokenizer
+
+def optimize_model(model, tokenizer, device: torch.device, precision: str, backend: str):
+    """Apply the requested precision and backend to an eval-mode model
+
+    - ``bf16`` casts all weights to bfloat16
+    - ``int8`` dynamically quantizes the Linear layers (CPU only)
+    - ``compile`` wraps the model with ``torch.compile`` using dynamic shapes
+    - ``torchscript`` traces the model on a padded example batch
+    """
+    if precision == "bf16":
+        model = model.to(torch.bfloat16)
+    elif precision == "int8":
+        if device.type != "cpu":
+            logger.warning("Dynamic int8 quantization only runs on CPU; keeping fp32 weights")
+        else:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if backend == "compile":
+        model = torch.compile(model, dynamic=True)
+    elif backend == "torchscript":
+        pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+        example = pad_batch([[pad_token_id + 1] * 8, [pad_token_id + 1] * 4], pad_token_id, tokenizer.padding_side)
+        example = {k: v.to(device) for k, v in example.items()}
+        with torch.no_grad():
+            model = torch.jit.trace(
+                model,
+                example_kwarg_inputs={"input_ids": example["input_ids"], "attention_mask": example["attention_mask"]},
+                strict=False,
+            )
+        model = torch.jit.freeze(model)
+
+    logger.info(f"Model ready for inference: precision={precision} backend={backend}")
+    return model
+
+def warmup_model(model, tokenizer, device: torch.device, batch_size: int = 2):
+    """Run forward passes per length bucket to trigger lazy init and compilation
+
+    Two shapes are used per bucket so ``torch.compile`` settles on a
+    dynamic-shape graph during warmup rather than on the first requests.
+    """
+    start_time = time.perf_counter()
+    token_id = (tokenizer.pad_token_id or 0) + 1
+    for length in LENGTH_BUCKETS:
+        length = min(length, MAX_LENGTH)
+        predict_encoded(model, tokenizer, [[token_id] * length] * batch_size, device)
+        predict_encoded(model, tokenizer, [[token_id] * max(1, length // 2 + 1)], device)
+    logger.info(f"Warmup over {len(LENGTH_BUCKETS)} length buckets took {time.perf_counter() - start_time:.2f} seconds")
+
+def tokenize(tokenizer, texts: List[str]) -> List[List[int]]:
+    """Batch-encode texts in one call to the fast tokenizer, without padding"""
+    return tokenizer(texts, truncation=True, max_length=MAX_LENGTH, return_attention_mask=False)["input_ids"]
+
+def pad_batch(input_ids: List[List[int]], pad_token_id: int, padding_side: str = "left") -> Dict[str, torch.Tensor]:
+    """Pad token id lists to the longest one and build the attention mask"""
+    max_len = max(len(ids) for ids in input_ids)
+    padded = torch.full((len(input_ids), max_len), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(input_ids), max_len), dtype=torch.long)
+
+    for row, ids in enumerate(input_ids):
+        if padding_side == "left":
+            padded[row, max_len - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, max_len - len(ids):] = 1
+        else:
+            padded[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, :len(ids)] = 1
+
+    return {"input_ids": padded, "attention_mask": attention_mask}
+
+def predict_encoded(
+    model,
+    tokenizer,
+    input_ids: List[List[int]],
+    device: torch.device,
+    logit_noise: Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
+) -> Tuple[List[Tuple[str, float]], Dict[str, float]]:
+    """Run length-bucketed forward passes over token ids
+
+    Inputs are grouped into buckets of similar length and each bucket is
+    padded only to its own longest item. Returns (sentiment, score) pairs in
+    the original order and the seconds spent in the h2d, forward, softmax and
+    postprocess stages, summed over buckets. ``logit_noise``, if given, is
+    applied to each bucket's logits before softmax (e.g. a differential
+    privacy mechanism) and timed as a dp_noise stage. On CUDA, kernels run
+    asynchronously, so without SYNC_STAGE_TIMINGS their time lands in
+    whichever later stage waits for them.
+    """
+    # Stages in pipeline order, which observe_stages relies on
+    timings = {"h2d": 0.0, "forward": 0.0}
+    if logit_noise is not None:
+        timings["dp_noise"] = 0.0
+    timings.update(softmax=0.0, postprocess=0.0)
+    if not input_ids:
+        return [], timings
+
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    lengths = [len(ids) for ids in input_ids]
+    sync = SYNC_STAGE_TIMINGS and device.type == "cuda"
+
+    def lap(stage: str, since: float) -> float:
+        if sync:
+            torch.cuda.synchronize(device)
+        now = time.perf_counter()
+        timings[stage] += now - since
+        return now
+
+    order, top_scores, top_classes = [], [], []
+    for bucket in plan_length_buckets(lengths, LENGTH_BUCKETS):
+        start_time = time.perf_counter()
+        inputs = pad_batch([input_ids[i] for i in bucket], pad_token_id, tokenizer.padding_side)
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+        start_time = lap("h2d", start_time)
+
+        with torch.no_grad():
+            outputs = model(**inputs)
+        start_time = lap("forward", start_time)
+
+        # Traced models return tuples; bf16 logits are upcast before softmax
+        logits = outputs[0] if isinstance(outputs, (tuple, list)) else outputs.logits
+        if logit_noise is not None:
+            logits = logit_noise(logits.float())
+            start_time = lap("dp_noise", start_time)
+        scores, classes = torch.nn.functional.softmax(logits.float(), dim=1).max(dim=1)
+        order.extend(bucket)
+        top_scores.append(scores)
+        top_classes.append(classes)
+        lap("softmax", start_time)
+
+    # One device-to-host transfer for the whole batch instead of a sync per row
+    start_time = time.perf_counter()
+    top_scores = torch.cat(top_scores).cpu().numpy().tolist()
+    top_classes = torch.cat(top_classes).cpu().numpy().tolist()
+
+    labels = getattr(model, "class_labels", None) or class_labels(getattr(model, "config", None))
+    predictions = [None] * len(input_ids)
+    for i, predicted_class, predicted_score in zip(order, top_classes, top_scores):
+        predictions[i] = (labels[predicted_class], predicted_score)
+
+    lap("postprocess", start_time)
+    return predictions, timings
+
+def predict_texts(model, tokenizer, texts: List[str], device: torch.device) -> List[Tuple[str, float]]:
+    """Tokenize and score texts in one call"""
+    predictions, _ = predict_encoded(model, tokenizer, tokenize(tokenizer, texts), device)
+    return predictions
+
+def init_replica(model_path: str, intra_op_threads: Optional[int] = None):
+    """Process pool initializer: load a private CPU model replica"""
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    model, tokenizer = load_model_and_tokenizer(model_path, torch.device("cpu"))
+    _REPLICA["model"] = model
+    _REPLICA["tokenizer"] = tokenizer
+    logger.info(f"Replica loaded {model_path} with {torch.get_num_threads()} intra-op threads")
+
+def replica_ready() -> bool:
+    return _REPLICA["model"] is not None
+
+def replica_predict(
+    input_ids: List[List[int]], logit_noise: Optional[Callable[[torch.Tensor], torch.Tensor]] = None
+) -> Tuple[List[Tuple[str, float]], Dict[str, float]]:
+    """Run predict_encoded against this worker's replica"""
+    return predict_encoded(_REPLICA["model"], _REPLICA["tokenizer"], input_ids, torch.device("cpu"), logit_noise)
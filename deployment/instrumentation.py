@@ -0,0 +1,209 @@
+import collections
+import json
+import logging
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+import torch
+from fastapi.responses import JSONResponse
+from opentelemetry import trace
+from prometheus_client import Histogram
+
+logger = logging.getLogger("model-server.instrumentation")
+
+# Metrics
+STAGE_LATENCY = Histogram("model_inference_stage_seconds", "Inference latency per pipeline stage", ["stage"])
+
+# Tracing is off unless asked for, so the request path only pays for histogram observations
+TRACING_ENABLED = os.environ.get("ENABLE_TRACING", "false").lower() == "true"
+PROFILING_ENABLED = os.environ.get("ENABLE_PROFILING", "false").lower() == "true"
+MAX_PROFILE_SECONDS = float(os.environ.get("MAX_PROFILE_SECONDS", 60))
+PROFILE_MODES = ("stack", "torch")
+
+tracer = trace.get_tracer("model-server")
+
+def configure_tracing(app):
+    """Install an OpenTelemetry tracer provider and FastAPI request spans if ENABLE_TRACING is set"""
+    if not TRACING_ENABLED:
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    try:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    except ImportError:
+        logger.warning("OTLP exporter not installed; exporting spans to stdout")
+        exporter = ConsoleSpanExporter()
+
+    service_name = os.environ.get("OTEL_SERVICE_NAME", "bloom-sentiment-api")
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+    try:
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        FastAPIInstrumentor.instrument_app(app)
+    except ImportError:
+        logger.warning("opentelemetry-instrumentation-fastapi not installed; no request spans")
+
+    logger.info(f"Tracing enabled for {service_name}")
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage that runs on the event loop"""
+    start_ns = time.time_ns()
+    span = tracer.start_span(name) if TRACING_ENABLED else None
+    try:
+        yield
+    finally:
+        end_ns = time.time_ns()
+        STAGE_LATENCY.labels(name).observe((end_ns - start_ns) / 1e9)
+        if span is not None:
+            span.end(end_time=end_ns)
+
+def observe_stage(name: str, seconds: float, end_ns: Optional[int] = None):
+    """Record a stage measured elsewhere, e.g. on an executor thread or replica process"""
+    STAGE_LATENCY.labels(name).observe(seconds)
+    if TRACING_ENABLED:
+        end_ns = end_ns or time.time_ns()
+        tracer.start_span(name, start_time=end_ns - int(seconds * 1e9)).end(end_time=end_ns)
+
+def observe_stages(timings: Dict[str, float]):
+    """Record executor-side stage timings, in order, as spans laid back to back ending now
+
+    The stages ran on another thread or process and are summed over length
+    buckets, so only their durations are known here.
+    """
+    end_ns = time.time_ns() - int(sum(timings.values()) * 1e9)
+    for name, seconds in timings.items():
+        end_ns += int(seconds * 1e9)
+        observe_stage(name, seconds, end_ns)
+
+class InstrumentedJSONResponse(JSONResponse):
+    """JSONResponse that records its rendering time as the serialize stage"""
+
+    def render(self, content) -> bytes:
+        with stage("serialize"):
+            return super().render(content)
+
+# Profiling
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+_PROFILE_LOCK = threading.Lock()
+# Model calls handed to the thread running the torch profiler; None when no torch capture is running
+_TORCH_SESSION = {"calls": None, "lock": threading.Lock()}
+
+def profile(mode: str, seconds: float):
+    """Capture a profile of the live process for ``seconds``; blocks, so run it off the event loop
+
+    ``stack`` samples every thread's Python stack and returns folded stacks
+    (``frame;frame;frame count`` lines, as consumed by flamegraph.pl or
+    speedscope). ``torch`` runs every model call made in this process during
+    the window under one torch.profiler session and returns its Chrome trace.
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode: {mode}")
+    seconds = min(seconds, MAX_PROFILE_SECONDS)
+
+    if not _PROFILE_LOCK.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        logger.info(f"Capturing {mode} profile for {seconds:.1f} seconds")
+        if mode == "stack":
+            return sample_stacks(seconds)
+        return capture_torch_trace(seconds)
+    finally:
+        _PROFILE_LOCK.release()
+
+def sample_stacks(seconds: float, interval: float = 0.01) -> str:
+    own_thread = threading.get_ident()
+    counts = collections.Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            frames.append(names.get(thread_id, str(thread_id)))
+            counts[";".join(reversed(frames))] += 1
+        time.sleep(interval)
+
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+def capture_torch_trace(seconds: float) -> Dict:
+    """Run one torch.profiler session for ``seconds`` around all model calls passed to ``torch_profiled``
+
+    torch.profiler only records the thread that started it, but its state is
+    global to the process, so sessions on several inference threads would
+    collide. Instead this thread holds the only session and runs the model
+    calls itself: while it captures, model calls are serialized onto it and
+    the inference threads wait for their results.
+    """
+    calls = queue.SimpleQueue()
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    profiled_calls = 0
+    with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+        with _TORCH_SESSION["lock"]:
+            _TORCH_SESSION["calls"] = calls
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                try:
+                    call = calls.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                _run_call(*call)
+                profiled_calls += 1
+        finally:
+            with _TORCH_SESSION["lock"]:
+                _TORCH_SESSION["calls"] = None
+            # Nothing is queued after this point; run what already was
+            while not calls.empty():
+                _run_call(*calls.get())
+                profiled_calls += 1
+
+    with tempfile.NamedTemporaryFile(suffix=".json") as f:
+        prof.export_chrome_trace(f.name)
+        with open(f.name) as trace_file:
+            events = json.load(trace_file).get("traceEvents", [])
+    logger.info(f"Torch profile covered {profiled_calls} model calls")
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"model_calls": profiled_calls}}
+
+def _run_call(future: Future, fn: Callable, args: tuple):
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(fn(*args))
+    except BaseException as e:
+        future.set_exception(e)
+
+def torch_profiled(fn: Callable, *args):
+    """Call ``fn(*args)``, on the profiling thread if a torch profile is being captured"""
+    with _TORCH_SESSION["lock"]:
+        calls = _TORCH_SESSION["calls"]
+        if calls is not None:
+            future = Future()
+            calls.put((future, fn, args))
+    if calls is None:
+        return fn(*args)
+    return future.result()
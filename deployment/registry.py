@@ -0,0 +1,237 @@
+import gc
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+import torch
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger("model-server.registry")
+
+# Metrics
+MODEL_RELOADS = Counter("model_reloads_total", "Model loads through the registry", ["model", "status"])
+MODEL_IN_FLIGHT = Gauge("model_in_flight_requests", "Requests holding a model version", ["model", "version"])
+SHARED_WEIGHT_BYTES = Gauge("model_shared_weight_bytes", "Weight bytes aliased to another loaded model", ["model"])
+
+class ModelVersion:
+    """One loaded model and tokenizer, plus the bookkeeping needed to retire it safely"""
+
+    def __init__(self, name: str, path: str, version: str, model, tokenizer):
+        self.name = name
+        self.path = path
+        self.version = version
+        self.model = model
+        self.tokenizer = tokenizer
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.retired = False
+        self.shared_bytes = 0
+        self.adapters = None
+
+    @property
+    def identity(self) -> str:
+        """Stable id for cache keys; changes whenever different weights are served"""
+        return f"{self.name}:{self.path}@{self.version}"
+
+    def describe(self) -> Dict:
+        return {
+            "name": self.name,
+            "path": self.path,
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "in_flight": self.in_flight,
+            "shared_weight_bytes": self.shared_bytes,
+            "adapters": self.adapters.resident if self.adapters is not None else [],
+        }
+
+def share_identical_weights(model, reference) -> int:
+    """Alias ``model``'s parameters to ``reference``'s wherever they are bit-identical
+
+    A/B variants fine-tuned from the same base usually differ in a handful of
+    layers; aliasing the rest means the duplicate copies are freed as soon as
+    the loader drops them. Returns the number of bytes now shared.
+    """
+    if not isinstance(model, torch.nn.Module) or not isinstance(reference, torch.nn.Module):
+        return 0
+
+    reference_params = dict(reference.named_parameters())
+    shared = 0
+
+    with torch.no_grad():
+        for name, param in list(model.named_parameters()):
+            ref = reference_params.get(name)
+            if ref is None or ref is param:
+                continue
+            if ref.shape != param.shape or ref.dtype != param.dtype or ref.device != param.device:
+                continue
+            if not torch.equal(ref, param):
+                continue
+
+            module_name, _, attr = name.rpartition(".")
+            module = model.get_submodule(module_name) if module_name else model
+            module._parameters[attr] = ref
+            shared += param.numel() * param.element_size()
+
+    return shared
+
+class ModelRegistry:
+    """Named models with zero-downtime replacement
+
+    Requests ``acquire`` the active version of a model for their whole
+    lifetime. ``load`` builds and warms up a new version off to the side,
+    then swaps it in atomically; the version it replaces keeps serving the
+    requests that already hold it and is freed once the last one releases.
+    ``on_load`` is called with each loaded version before it serves traffic
+    and ``on_publish`` with each newly active version.
+    """
+
+    def __init__(
+        self,
+        loader: Callable,
+        default_name: str,
+        on_load: Optional[Callable] = None,
+        on_publish: Optional[Callable] = None,
+    ):
+        self.loader = loader
+        self.default_name = default_name
+        self.on_load = on_load
+        self.on_publish = on_publish
+        self._active: Dict[str, ModelVersion] = {}
+        self._loading: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        return list(self._active)
+
+    def get(self, name: Optional[str] = None) -> ModelVersion:
+        """Active version of ``name`` (the default model if None); raises KeyError if unknown"""
+        name = name or self.default_name
+        try:
+            return self._active[name]
+        except KeyError:
+            raise KeyError(f"Unknown model: {name}")
+
+    @contextmanager
+    def acquire(self, name: Optional[str] = None) -> Iterator[ModelVersion]:
+        """Pin the active version of ``name`` until the block exits"""
+        with self._lock:
+            version = self.get(name)
+            version.in_flight += 1
+        MODEL_IN_FLIGHT.labels(version.name, version.version).inc()
+
+        try:
+            yield version
+        finally:
+            MODEL_IN_FLIGHT.labels(version.name, version.version).dec()
+            with self._lock:
+                version.in_flight -= 1
+                free = version.retired and version.in_flight == 0
+            if free:
+                self._free(version)
+
+    def publish(self, version: ModelVersion) -> Optional[ModelVersion]:
+        """Make ``version`` the active one for its name and retire the previous one"""
+        with self._lock:
+            previous = self._active.get(version.name)
+            self._active[version.name] = version
+            free = False
+            if previous is not None:
+                previous.retired = True
+                free = previous.in_flight == 0
+
+        logger.info(f"Serving {version.identity}")
+        if self.on_publish is not None:
+            self.on_publish(version)
+        if free:
+            self._free(previous)
+        return previous
+
+    def load(
+        self,
+        name: str,
+        path: str,
+        version: str,
+        share_weights_with: Optional[str] = None,
+        **loader_kwargs,
+    ) -> ModelVersion:
+        """Load, warm up and publish a model version; blocks until it is serving"""
+        self._start_loading(name, path, version)
+        return self._load(name, path, version, share_weights_with, **loader_kwargs)
+
+    def _start_loading(self, name: str, path: str, version: str):
+        """Mark ``name`` as loading; RuntimeError if a load of it is already running"""
+        with self._lock:
+            if self._loading.get(name, {}).get("state") == "loading":
+                raise RuntimeError(f"Model {name} is already loading")
+            self._loading[name] = {"state": "loading", "path": path, "version": version, "error": None}
+
+    def _load(
+        self,
+        name: str,
+        path: str,
+        version: str,
+        share_weights_with: Optional[str] = None,
+        **loader_kwargs,
+    ) -> ModelVersion:
+        try:
+            model, tokenizer = self.loader(path, **loader_kwargs)
+            loaded = ModelVersion(name, path, version, model, tokenizer)
+
+            # Alias weights that are identical to another served model
+            reference_name = share_weights_with or (name if name in self._active else None)
+            if reference_name is not None and reference_name in self._active:
+                loaded.shared_bytes = share_identical_weights(model, self._active[reference_name].model)
+                SHARED_WEIGHT_BYTES.labels(name).set(loaded.shared_bytes)
+                if loaded.shared_bytes:
+                    logger.info(f"{loaded.identity} shares {loaded.shared_bytes / 2**20:.1f} MiB with {reference_name}")
+
+            if self.on_load is not None:
+                self.on_load(loaded)
+            self.publish(loaded)
+        except Exception as e:
+            logger.error(f"Error loading model {name} from {path}: {str(e)}")
+            MODEL_RELOADS.labels(name, "failed").inc()
+            self._loading[name].update(state="failed", error=str(e))
+            raise
+
+        MODEL_RELOADS.labels(name, "succeeded").inc()
+        self._loading[name].update(state="ready")
+        return loaded
+
+    def load_in_background(self, name: str, path: str, version: str, **kwargs) -> threading.Thread:
+        """Start ``load`` on a daemon thread; progress is reported by ``status``
+
+        The load is claimed before this returns, so of two concurrent calls
+        for the same name the second raises RuntimeError.
+        """
+        self._start_loading(name, path, version)
+
+        def run():
+            try:
+                self._load(name, path, version, **kwargs)
+            except Exception:
+                pass  # Logged and recorded in status by load()
+
+        thread = threading.Thread(target=run, name=f"model-loader-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> Dict:
+        models = {}
+        for name in set(self._active) | set(self._loading):
+            active = self._active.get(name)
+            models[name] = {
+                "active": active.describe() if active is not None else None,
+                "load": self._loading.get(name),
+            }
+        return models
+
+    def _free(self, version: ModelVersion):
+        logger.info(f"Releasing {version.identity}")
+        version.model = None
+        version.tokenizer = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
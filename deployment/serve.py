@@ -1,20 +1,41 @@
-
 import os
+import sys
 import time
+import asyncio
 import json
 import logging
+import threading
 import torch
 import uvicorn
-from fastapi import FastAPI, HTTPException, Depends, Request, status
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, status
 from fastapi.security import OAuth2PasswordBearer, APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import PlainTextResponse, Response
+from starlette.datastructures import MutableHeaders
 from pydantic import BaseModel
-from typing import List, Optional, Dict
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from typing import List, Optional, Dict, Union
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 from datetime import datetime, timedelta
 import numpy as np
+import inference
+from batching import MicroBatcher
+from cache import PredictionCache
+from executor import InferenceExecutor, ExecutorSaturated
+from registry import ModelRegistry, ModelVersion
+from adapters import AdapterPool, AdapterSource, UnknownAdapter
+from streaming import NDJSONResponse, iter_ndjson, ndjson_line
+import instrumentation
+from instrumentation import InstrumentedJSONResponse, ProfilerBusy
+
+# Privacy helpers live in security/, next to this file in the image and beside deployment/ in the repo
+for security_dir in ("security", os.path.join("..", "security")):
+    security_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), security_dir)
+    if os.path.isdir(security_dir) and security_dir not in sys.path:
+        sys.path.append(security_dir)
+
+from differential_privacy import NoiseMechanism, PrivacyAccountant, PrivacyBudgetExceeded
 
 # Setup logging
 logging.basicConfig(
@@ -28,7 +49,10 @@ app = FastAPI(
     title="BLOOM Sentiment Analysis API",
     description="API for sentiment analysis using fine-tuned BLOOM model",
     version="1.0.0",
+    # Renders JSON bodies while timing the serialize stage
+    default_response_class=InstrumentedJSONResponse,
 )
+instrumentation.configure_tracing(app)
 
 # Add CORS middleware
 app.add_middleware(
@@ -47,18 +71,33 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 REQUESTS = Counter("http_requests_total", "Total HTTP requests", ["method", "endpoint", "status"])
 LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "endpoint"])
 PREDICTIONS = Counter("model_predictions_total", "Total model predictions", ["class"])
+STARTUP_PHASE = Gauge("model_startup_phase_seconds", "Seconds spent in each model load phase", ["phase"])
+MODEL_READY = Gauge("model_ready", "1 once the model is loaded and warmed up")
 
 # Input/Output models
 class SentimentRequest(BaseModel):
     text: str
+    model: Optional[str] = None
+    adapter: Optional[str] = None
     include_metadata: Optional[bool] = False
+    compact: Optional[bool] = False
 
 class BatchSentimentRequest(BaseModel):
     texts: List[str]
+    model: Optional[str] = None
+    adapter: Optional[str] = None
+    include_metadata: Optional[bool] = False
+    compact: Optional[bool] = False
+
+class TokenizedSentimentRequest(BaseModel):
+    input_ids: List[List[int]]
+    model: Optional[str] = None
+    adapter: Optional[str] = None
     include_metadata: Optional[bool] = False
+    compact: Optional[bool] = False
 
 class SentimentResponse(BaseModel):
-    text: str
+    text: Optional[str] = None
     sentiment: str
     score: float
     processing_time: float
@@ -68,39 +107,237 @@ class BatchSentimentResponse(BaseModel):
     results: List[SentimentResponse]
     processing_time: float
 
+class CompactSentimentResult(BaseModel):
+    sentiment: str
+    score: float
+
+class CompactBatchSentimentResponse(BaseModel):
+    results: List[CompactSentimentResult]
+    processing_time: float
+    metadata: Optional[Dict] = None
+
+class ModelLoadRequest(BaseModel):
+    path: str
+    version: str
+    share_weights_with: Optional[str] = None
+
 # Global variables
-MODEL = None
-TOKENIZER = None
+MODEL_PATH = os.environ.get("MODEL_PATH", "/models/bloom-finetuned-sentiment")
+MODEL_NAME = os.environ.get("MODEL_NAME", os.path.basename(MODEL_PATH.rstrip("/")))
+# Extra models served alongside the default one, as "name=path,name=path"
+MODEL_VARIANTS = [
+    tuple(variant.split("=", 1))
+    for variant in os.environ.get("MODEL_VARIANTS", "").split(",")
+    if "=" in variant
+]
+# LoRA adapters served on top of each base model, as "name=path,name=path"
+# and/or a directory with one adapter per subdirectory
+LORA_ADAPTERS = dict(
+    tuple(adapter.split("=", 1))
+    for adapter in os.environ.get("LORA_ADAPTERS", "").split(",")
+    if "=" in adapter
+)
+LORA_ADAPTER_DIR = os.environ.get("LORA_ADAPTER_DIR") or None
+LORA_MAX_RESIDENT = int(os.environ.get("LORA_MAX_RESIDENT", 8))
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 32))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 5))
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", MAX_BATCH_SIZE))
+TOKENIZER_WORKERS = int(os.environ.get("TOKENIZER_WORKERS", 1))
+MAX_QUEUED_REQUESTS = int(os.environ.get("MAX_QUEUED_REQUESTS", 256))
+INFERENCE_MODE = os.environ.get("INFERENCE_MODE", "thread")
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 1))
+INFERENCE_INTRA_OP_THREADS = int(os.environ.get("INFERENCE_INTRA_OP_THREADS", 0)) or None
+# Micro-batches in flight at once: one extra so the next one tokenizes while the current one runs
+BATCHER_MAX_IN_FLIGHT = INFERENCE_WORKERS + 1
+# Admission limit; by default leaves room for /predict/batch and streams beside a busy batcher
+INFERENCE_MAX_PENDING = int(os.environ.get("INFERENCE_MAX_PENDING", BATCHER_MAX_IN_FLIGHT + 2 * INFERENCE_WORKERS))
+MODEL_VERSION = os.environ.get("MODEL_VERSION", "1.0.0")
+# Differential privacy for returned scores: noise is added to the logits when DP_EPSILON > 0
+DP_EPSILON = float(os.environ.get("DP_EPSILON", 0))
+DP_DELTA = float(os.environ.get("DP_DELTA", 1e-5))
+DP_MECHANISM = os.environ.get("DP_MECHANISM", "gaussian")
+DP_CLIP_NORM = float(os.environ.get("DP_CLIP_NORM", 1.0))
+# Total epsilon each client may spend; 0 tracks spending without a limit
+DP_CLIENT_EPSILON_BUDGET = float(os.environ.get("DP_CLIENT_EPSILON_BUDGET", 0)) or None
 API_KEYS = {
     "test-key-1": "service-1",
     "test-key-2": "service-2",
     # In production, these would be securely loaded from a vault or environment
 }
+# Keys with the admin scope, which may load models (comma-separated); none by default
+ADMIN_API_KEYS = frozenset(key for key in os.environ.get("ADMIN_API_KEYS", "").split(",") if key)
+# Models loaded through the API must live under this directory
+MODEL_ROOT = os.path.realpath(os.environ.get("MODEL_ROOT", os.path.dirname(MODEL_PATH.rstrip("/"))))
+
+# Calibrated logit noise and the per-client epsilon spent on it
+def create_dp_noise() -> Optional[NoiseMechanism]:
+    if DP_EPSILON <= 0:
+        return None
+    try:
+        return NoiseMechanism(DP_MECHANISM, DP_EPSILON, DP_DELTA, DP_CLIP_NORM)
+    except ValueError as e:
+        raise RuntimeError(
+            f"Invalid differential privacy settings (DP_MECHANISM={DP_MECHANISM}, DP_EPSILON={DP_EPSILON}, "
+            f"DP_DELTA={DP_DELTA}, DP_CLIP_NORM={DP_CLIP_NORM}): {e}"
+        ) from e
+
+DP_NOISE = create_dp_noise()
+DP_ACCOUNTANT = PrivacyAccountant(DP_CLIENT_EPSILON_BUDGET)
+
+# Run bucketed forward passes over token ids on an in-process model version
+def run_inference(version: ModelVersion, input_ids: List[List[int]], adapter: Optional[str] = None) -> tuple:
+    return instrumentation.torch_profiled(predict_version, version, input_ids, adapter)
+
+def predict_version(version: ModelVersion, input_ids: List[List[int]], adapter: Optional[str]) -> tuple:
+    if version.adapters is not None:
+        return version.adapters.run(adapter, inference.predict_encoded, version.tokenizer, input_ids, DEVICE, DP_NOISE)
+    return inference.predict_encoded(version.model, version.tokenizer, input_ids, DEVICE, DP_NOISE)
+
+# Tokenization runs on its own threads so it overlaps the previous batch's forward pass
+TOKENIZER_POOL = ThreadPoolExecutor(max_workers=TOKENIZER_WORKERS, thread_name_prefix="tokenize")
+
+# Runs model calls off the event loop, either on threads or on replica processes
+EXECUTOR = InferenceExecutor(
+    run_inference,
+    mode=INFERENCE_MODE,
+    workers=INFERENCE_WORKERS,
+    max_pending=INFERENCE_MAX_PENDING,
+    intra_op_threads=INFERENCE_INTRA_OP_THREADS,
+    model_path=MODEL_PATH,
+)
+
+# Predictions keyed by normalized text and model identity
+PREDICTION_CACHE = PredictionCache(
+    max_entries=int(os.environ.get("PREDICTION_CACHE_MAX_ENTRIES", 100000)),
+    max_bytes=int(os.environ.get("PREDICTION_CACHE_MAX_BYTES", 0)),
+    ttl_seconds=float(os.environ.get("PREDICTION_CACHE_TTL", 3600)),
+)
+
+# Loaded models by name; requests pin a version so reloads never interrupt them
+def load_version(path: str, **kwargs) -> tuple:
+    return inference.load_model_and_tokenizer(path, DEVICE, **kwargs)
+
+ADAPTER_SOURCE = AdapterSource(LORA_ADAPTERS, LORA_ADAPTER_DIR)
+
+def on_model_loaded(version: ModelVersion):
+    # Adapters patch eager nn.Linear layers, which compiled/traced/int8 models no longer have
+    if ADAPTER_SOURCE.configured:
+        if inference.MODEL_BACKEND != "eager" or inference.MODEL_PRECISION == "int8":
+            logger.warning("LoRA adapters require MODEL_BACKEND=eager and a float precision; adapters disabled")
+            return
+        version.adapters = AdapterPool(version.model, ADAPTER_SOURCE, DEVICE, max_resident=LORA_MAX_RESIDENT)
+
+def on_model_published(version: ModelVersion):
+    # Predictions from a previous model must not be served again
+    PREDICTION_CACHE.clear()
+
+REGISTRY = ModelRegistry(
+    load_version, default_name=MODEL_NAME, on_load=on_model_loaded, on_publish=on_model_published
+)
+
+# Model load state machine: starting -> loading -> ready, or failed
+LOAD_STATE = {"state": "starting", "phase": None, "error": None, "timings": {}}
+
+def set_load_phase(phase: str):
+    LOAD_STATE["phase"] = phase
+    logger.info(f"Model load phase: {phase}")
 
 # Load the model
 def load_model():
-    global MODEL, TOKENIZER
-
-    model_path = os.environ.get("MODEL_PATH", "/models/bloom-finetuned-sentiment")
+    model_path = MODEL_PATH
     logger.info(f"Loading model from {model_path}")
+    LOAD_STATE.update(state="loading", phase=None, error=None, timings={})
+    MODEL_READY.set(0)
 
     try:
         start_time = time.time()
-
-        # Load tokenizer and model
-        TOKENIZER = AutoTokenizer.from_pretrained(model_path)
-        MODEL = AutoModelForSequenceClassification.from_pretrained(model_path)
-        MODEL.to(DEVICE)
-        MODEL.eval()
-
-        logger.info(f"Model loaded successfully in {time.time() - start_time:.2f} seconds")
-        return True
+        timings = LOAD_STATE["timings"]
+
+        if EXECUTOR.mode == "process":
+            if ADAPTER_SOURCE.configured:
+                logger.warning("LoRA adapters are not supported with INFERENCE_MODE=process; adapters disabled")
+            # Each worker process loads its own replica; only tokenize here
+            set_load_phase("tokenizer")
+            phase_start = time.perf_counter()
+            tokenizer = inference.load_tokenizer(model_path)
+            timings["tokenizer"] = time.perf_counter() - phase_start
+
+            set_load_phase("replicas")
+            phase_start = time.perf_counter()
+            EXECUTOR.start()
+            timings["replicas"] = time.perf_counter() - phase_start
+            REGISTRY.publish(ModelVersion(MODEL_NAME, model_path, MODEL_VERSION, None, tokenizer))
+        else:
+            # Load tokenizer and model
+            REGISTRY.load(MODEL_NAME, model_path, MODEL_VERSION, timings=timings, on_phase=set_load_phase)
+            EXECUTOR.start()
+
+        for phase, seconds in timings.items():
+            STARTUP_PHASE.labels(phase).set(seconds)
+        breakdown = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items())
+        logger.info(f"Model loaded successfully in {time.time() - start_time:.2f} seconds ({breakdown})")
+
+        LOAD_STATE.update(state="ready", phase=None)
+        MODEL_READY.set(1)
     except Exception as e:
         logger.error(f"Error loading model: {str(e)}")
+        LOAD_STATE.update(state="failed", error=str(e))
         return False
 
+    # Variants load one at a time after the default model is already serving
+    for name, path in MODEL_VARIANTS:
+        if EXECUTOR.mode == "process":
+            logger.warning(f"Skipping model variant {name}: extra models require INFERENCE_MODE=thread")
+            continue
+        try:
+            REGISTRY.load(name, path, MODEL_VERSION, share_weights_with=MODEL_NAME)
+        except Exception:
+            pass  # Logged by the registry; the default model keeps serving
+    return True
+
+def model_ready() -> bool:
+    return LOAD_STATE["state"] == "ready"
+
+def require_ready():
+    if not model_ready():
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model not ready ({LOAD_STATE['state']})",
+            headers={"Retry-After": "5"},
+        )
+
+def resolve_model(name: Optional[str]) -> str:
+    """Name of a served model, defaulting to MODEL_NAME; 404 if it is not loaded"""
+    name = name or MODEL_NAME
+    if name not in REGISTRY.names():
+        raise HTTPException(status_code=404, detail=f"Unknown model: {name}")
+    return name
+
+def require_adapter(version: ModelVersion, adapter: Optional[str]):
+    """400 if ``version`` cannot serve adapters, 404 if ``adapter`` is unknown"""
+    if adapter is None:
+        return
+    if version.adapters is None:
+        if EXECUTOR.mode == "process" and ADAPTER_SOURCE.configured:
+            raise HTTPException(status_code=400, detail="LoRA adapters are not supported with INFERENCE_MODE=process")
+        raise HTTPException(status_code=400, detail="LoRA adapters are not enabled on this server")
+    try:
+        version.adapters.validate(adapter)
+    except UnknownAdapter:
+        raise HTTPException(status_code=404, detail=f"Unknown adapter: {adapter}")
+
+def cache_identity(version: ModelVersion, adapter: Optional[str]) -> str:
+    return version.identity if adapter is None else f"{version.identity}+{adapter}"
+
+def server_busy(error: Exception) -> HTTPException:
+    retry_after = getattr(error, "retry_after", None) or EXECUTOR.retry_after()
+    return HTTPException(
+        status_code=503,
+        detail="Server is at capacity, retry later",
+        headers={"Retry-After": str(retry_after)},
+    )
+
 # Security dependency
 async def verify_api_key(api_key: str = Depends(api_key_header)):
     if api_key not in API_KEYS:
@@ -110,72 +347,300 @@ async def verify_api_key(api_key: str = Depends(api_key_header)):
         )
     return api_key
 
+# Model management needs the admin scope on top of a valid key
+async def verify_admin_key(api_key: str = Depends(verify_api_key)):
+    if api_key not in ADMIN_API_KEYS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Requires the admin scope")
+    return api_key
+
+def resolve_model_path(path: str) -> str:
+    """``path`` resolved under MODEL_ROOT (relative paths are taken from it); 400 if it points outside"""
+    resolved = os.path.realpath(os.path.join(MODEL_ROOT, path))
+    if os.path.commonpath([resolved, MODEL_ROOT]) != MODEL_ROOT:
+        raise HTTPException(status_code=400, detail="Model path must be inside MODEL_ROOT")
+    return resolved
+
+# Charge a client the privacy budget for a number of noisy predictions
+def spend_privacy_budget(api_key: str, predictions: int):
+    if DP_NOISE is None:
+        return
+    # Charged before scoring, so failed requests still count; cached
+    # predictions are charged too, although re-serving them leaks nothing new
+    try:
+        DP_ACCOUNTANT.charge(API_KEYS[api_key], DP_NOISE.epsilon, DP_NOISE.delta, predictions)
+    except PrivacyBudgetExceeded as e:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
+
 # Request timing middleware
-@app.middleware("http")
-async def add_timing_middleware(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
+# Plain ASGI rather than @app.middleware("http") so streaming endpoints can
+# keep reading the request body after the response has started
+class TimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.time()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Process-Time", str(time.time() - start_time))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            process_time = time.time() - start_time
 
-    # Record metrics
-    endpoint = request.url.path
-    method = request.method
-    status_code = response.status_code
+            # Record metrics
+            endpoint = scope["path"]
+            method = scope["method"]
 
-    REQUESTS.labels(method=method, endpoint=endpoint, status=status_code).inc()
-    LATENCY.labels(method=method, endpoint=endpoint).observe(process_time)
+            REQUESTS.labels(method=method, endpoint=endpoint, status=status_code).inc()
+            LATENCY.labels(method=method, endpoint=endpoint).observe(process_time)
 
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+app.add_middleware(TimingMiddleware)
 
-# Health check endpoint
+# Liveness endpoint: the process is up and the model has not failed to load
 @app.get("/health")
 async def health():
-    if MODEL is None or TOKENIZER is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
-    return {"status": "healthy", "device": str(DEVICE)}
+    if LOAD_STATE["state"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Model failed to load: {LOAD_STATE['error']}")
+    return {"status": "healthy", "state": LOAD_STATE["state"], "device": str(DEVICE)}
+
+# Readiness endpoint: the model is loaded and warmed up
+@app.get("/ready")
+async def ready():
+    if not model_ready():
+        raise HTTPException(
+            status_code=503,
+            detail={"state": LOAD_STATE["state"], "phase": LOAD_STATE["phase"]},
+        )
+    return {
+        "status": "ready",
+        "device": str(DEVICE),
+        "models": REGISTRY.names(),
+        "startup_timings": LOAD_STATE["timings"],
+    }
 
 # Metrics endpoint
 @app.get("/metrics")
 async def metrics():
-    return JSONResponse(
-        content=generate_latest().decode("utf-8"),
-        media_type=CONTENT_TYPE_LATEST,
+    # Passed as a header so Starlette does not append a second charset
+    return Response(content=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+# Sampling profiler endpoint; 404 unless ENABLE_PROFILING is set
+@app.post("/debug/profile", dependencies=[Depends(verify_api_key)])
+async def debug_profile(seconds: float = 10, mode: str = "stack"):
+    """Profile the live server for ``seconds``
+
+    ``stack`` returns folded Python stacks of every thread (flamegraph.pl /
+    speedscope input); ``torch`` returns a Chrome trace of the model calls
+    made during the window (thread inference mode only).
+    """
+    if not instrumentation.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if mode not in instrumentation.PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(instrumentation.PROFILE_MODES)}")
+    if seconds <= 0:
+        raise HTTPException(status_code=400, detail="seconds must be positive")
+    if mode == "torch" and EXECUTOR.mode == "process":
+        # Model calls run in replica processes, which this process cannot profile
+        raise HTTPException(status_code=400, detail="mode=torch needs INFERENCE_MODE=thread")
+    if mode == "torch" and EXECUTOR.mode == "process":
+        # Model calls run in replica processes, which this process cannot profile
+        raise HTTPException(status_code=400, detail="mode=torch needs INFERENCE_MODE=thread")
+
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(None, instrumentation.profile, mode, seconds)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if mode == "stack":
+        return PlainTextResponse(result)
+    return InstrumentedJSONResponse(
+        content=result,
+        headers={"Content-Disposition": f"attachment; filename=profile-{int(time.time())}.json"},
     )
 
+def count_predictions(predictions: List[tuple]):
+    # One counter increment per class rather than per prediction
+    for sentiment, count in collections.Counter(sentiment for sentiment, _ in predictions).items():
+        PREDICTIONS.labels(sentiment).inc(count)
+
+def response_metadata(version: ModelVersion, adapter: Optional[str]) -> Dict:
+    """Metadata shared by every result of one request"""
+    metadata = {
+        "model": version.name,
+        "adapter": adapter,
+        "timestamp": datetime.now().isoformat(),
+        "device": str(DEVICE),
+        "version": version.version
+    }
+    if DP_NOISE is not None:
+        metadata["differential_privacy"] = DP_NOISE.describe()
+    return metadata
+
+def batch_response(
+    predictions: List[tuple],
+    processing_time: float,
+    texts: Optional[List[str]] = None,
+    metadata: Optional[Dict] = None,
+    compact: bool = False,
+):
+    """Build a batch response body
+
+    Compact responses leave out the echoed text and per-row fields, carry
+    ``metadata`` once for the whole batch, and are serialized directly rather
+    than validated row by row against the response model.
+    """
+    if compact:
+        results = [{"sentiment": sentiment, "score": score} for sentiment, score in predictions]
+        content = {"results": results, "processing_time": processing_time}
+        if metadata is not None:
+            content["metadata"] = metadata
+        return InstrumentedJSONResponse(content=content)
+
+    results = []
+    for i, (sentiment, predicted_score) in enumerate(predictions):
+        result = {
+            "sentiment": sentiment,
+            "score": predicted_score,
+            "processing_time": processing_time
+        }
+        if texts is not None:
+            result["text"] = texts[i]
+        if metadata is not None:
+            result["metadata"] = dict(metadata, batch_index=i)
+        results.append(result)
+
+    return {"results": results, "processing_time": processing_time}
+
+# Tokenize on the tokenizer pool, then score token ids on the executor
+# ``wait`` queues for an executor slot instead of failing fast (for work already accepted)
+async def run_encoded(
+    version: ModelVersion, input_ids: List[List[int]], adapter: Optional[str] = None, wait: bool = False
+) -> List[tuple]:
+    if EXECUTOR.mode == "process":
+        # Replicas hold their own copy of the default model
+        predictions, timings = await EXECUTOR.run(input_ids, DP_NOISE, wait=wait)
+    else:
+        predictions, timings = await EXECUTOR.run(version, input_ids, adapter, wait=wait)
+    instrumentation.observe_stages(timings)
+    return predictions
+
+async def run_tokenized(
+    version: ModelVersion, texts: List[str], adapter: Optional[str] = None, wait: bool = False
+) -> List[tuple]:
+    with instrumentation.stage("tokenize"):
+        input_ids = await asyncio.get_running_loop().run_in_executor(
+            TOKENIZER_POOL, inference.tokenize, version.tokenizer, texts
+        )
+    return await run_encoded(version, input_ids, adapter, wait)
+
+# Score texts and remember the results
+async def run_model(
+    version: ModelVersion, texts: List[str], keys: List[str], adapter: Optional[str] = None, wait: bool = False
+) -> List[tuple]:
+    predictions = await run_tokenized(version, texts, adapter, wait)
+    for key, prediction in zip(keys, predictions):
+        PREDICTION_CACHE.put(key, prediction)
+    return predictions
+
+# Score a batch, sending only cache misses to the model
+async def run_batch(
+    version: ModelVersion, texts: List[str], adapter: Optional[str] = None, wait: bool = False
+) -> List[tuple]:
+    model_id = cache_identity(version, adapter)
+    keys = [PREDICTION_CACHE.make_key(text, model_id) for text in texts]
+    predictions = [PREDICTION_CACHE.get(key) for key in keys]
+
+    # Identical texts within the batch are only scored once
+    missing = {}
+    for i, prediction in enumerate(predictions):
+        if prediction is None:
+            missing.setdefault(keys[i], []).append(i)
+
+    if missing:
+        miss_texts = [texts[indices[0]] for indices in missing.values()]
+        computed = await run_model(version, miss_texts, list(missing), adapter, wait)
+        for indices, prediction in zip(missing.values(), computed):
+            for i in indices:
+                predictions[i] = prediction
+
+    count_predictions(predictions)
+    return predictions
+
+# Score a micro-batch of (model version, adapter, text, cache key, enqueue time) items that already missed the cache
+async def run_micro_batch(items: List[tuple]) -> List[tuple]:
+    flushed_at = time.time_ns()
+
+    # One forward pass per model version and adapter within this cycle, so
+    # each adapter switch is paid once per group rather than per request.
+    # Queued requests were already accepted, so wait for an executor slot
+    # rather than failing the whole micro-batch when the executor is busy
+    groups = {}
+    for i, (version, adapter, text, key, enqueued_at) in enumerate(items):
+        groups.setdefault((version, adapter), []).append(i)
+        instrumentation.observe_stage("queue_wait", (flushed_at - enqueued_at) / 1e9, flushed_at)
+
+    predictions = [None] * len(items)
+    for (version, adapter), indices in groups.items():
+        group_predictions = await run_model(
+            version, [items[i][2] for i in indices], [items[i][3] for i in indices], adapter, wait=True
+        )
+        for i, prediction in zip(indices, group_predictions):
+            predictions[i] = prediction
+
+    count_predictions(predictions)
+    return predictions
+
+# Coalesces concurrent /predict calls into shared forward passes
+BATCHER = MicroBatcher(
+    run_micro_batch,
+    max_batch_size=MAX_BATCH_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    max_queue_size=MAX_QUEUED_REQUESTS,
+    max_in_flight=BATCHER_MAX_IN_FLIGHT,
+)
+
 # Prediction endpoint
 @app.post("/predict", response_model=SentimentResponse, dependencies=[Depends(verify_api_key)])
-async def predict(request: SentimentRequest):
-    if MODEL is None or TOKENIZER is None:
-        if not load_model():
-            raise HTTPException(status_code=503, detail="Model not loaded and could not be loaded")
+async def predict(
+    request: SentimentRequest,
+    x_model: Optional[str] = Header(None),
+    x_adapter: Optional[str] = Header(None),
+    api_key: str = Depends(verify_api_key),
+):
+    require_ready()
+    model_name = resolve_model(request.model or x_model)
+    adapter = request.adapter or x_adapter
+    require_adapter(REGISTRY.get(model_name), adapter)
+    spend_privacy_budget(api_key, 1)
 
     start_time = time.time()
 
     try:
-        # Tokenize
-        inputs = TOKENIZER(request.text, return_tensors="pt", truncation=True, max_length=512)
-        inputs = {k: v.to(DEVICE) for k, v in inputs.items()}
-
-        # Inference
-        with torch.no_grad():
-            outputs = MODEL(**inputs)
-
-        # Process results
-        scores = torch.nn.functional.softmax(outputs.logits, dim=1)
-        predicted_class = torch.argmax(scores, dim=1).item()
-        predicted_score = scores[0][predicted_class].item()
-
-        # Map to sentiment label
-        sentiment = "Positive" if predicted_class == 1 else "Negative"
-
-        # Increment prediction counter
-        PREDICTIONS.labels(class=sentiment).inc()
+        with REGISTRY.acquire(model_name) as version:
+            key = PREDICTION_CACHE.make_key(request.text, cache_identity(version, adapter))
+            cached = PREDICTION_CACHE.get(key)
+            if cached is not None:
+                count_predictions([cached])
+                sentiment, predicted_score = cached
+            else:
+                # Queue for the next micro-batch
+                sentiment, predicted_score = await BATCHER.submit((version, adapter, request.text, key, time.time_ns()))
 
         # Prepare response
         processing_time = time.time() - start_time
         response = {
-            "text": request.text,
             "sentiment": sentiment,
             "score": predicted_score,
             "processing_time": processing_time
@@ -183,87 +648,235 @@ async def predict(request: SentimentRequest):
 
         # Add metadata if requested
         if request.include_metadata:
-            response["metadata"] = {
-                "model": os.path.basename(os.environ.get("MODEL_PATH", "bloom-finetuned")),
-                "timestamp": datetime.now().isoformat(),
-                "device": str(DEVICE),
-                "version": "1.0.0"
-            }
+            response["metadata"] = response_metadata(version, adapter)
+
+        if request.compact:
+            return InstrumentedJSONResponse(content=response)
 
+        response["text"] = request.text
         return response
 
+    except (ExecutorSaturated, asyncio.QueueFull) as e:
+        raise server_busy(e)
     except Exception as e:
         logger.error(f"Prediction error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 # Batch prediction endpoint
-@app.post("/predict/batch", response_model=BatchSentimentResponse, dependencies=[Depends(verify_api_key)])
-async def predict_batch(request: BatchSentimentRequest):
-    if MODEL is None or TOKENIZER is None:
-        if not load_model():
-            raise HTTPException(status_code=503, detail="Model not loaded and could not be loaded")
+@app.post(
+    "/predict/batch",
+    response_model=Union[BatchSentimentResponse, CompactBatchSentimentResponse],
+    dependencies=[Depends(verify_api_key)],
+)
+async def predict_batch(
+    request: BatchSentimentRequest,
+    x_model: Optional[str] = Header(None),
+    x_adapter: Optional[str] = Header(None),
+    api_key: str = Depends(verify_api_key),
+):
+    """Score up to MAX_BATCH_SIZE texts; ``compact`` omits the echoed texts"""
+    require_ready()
+    model_name = resolve_model(request.model or x_model)
+    adapter = request.adapter or x_adapter
+    require_adapter(REGISTRY.get(model_name), adapter)
 
     if len(request.texts) > MAX_BATCH_SIZE:
         raise HTTPException(status_code=400, detail=f"Batch size exceeds maximum of {MAX_BATCH_SIZE}")
+    spend_privacy_budget(api_key, len(request.texts))
 
     start_time = time.time()
 
     try:
-        results = []
-
         # Process in batch
-        inputs = TOKENIZER(request.texts, padding=True, truncation=True, return_tensors="pt", max_length=512)
-        inputs = {k: v.to(DEVICE) for k, v in inputs.items()}
-
-        with torch.no_grad():
-            outputs = MODEL(**inputs)
-
-        # Process each result
-        scores = torch.nn.functional.softmax(outputs.logits, dim=1)
-        predicted_classes = torch.argmax(scores, dim=1).tolist()
-
-        for i, (text, predicted_class) in enumerate(zip(request.texts, predicted_classes)):
-            predicted_score = scores[i][predicted_class].item()
-            sentiment = "Positive" if predicted_class == 1 else "Negative"
-
-            # Increment prediction counter
-            PREDICTIONS.labels(class=sentiment).inc()
-
-            result = {
-                "text": text,
-                "sentiment": sentiment,
-                "score": predicted_score,
-                "processing_time": 0  # Will be updated with the batch time
-            }
-
-            # Add metadata if requested
-            if request.include_metadata:
-                result["metadata"] = {
-                    "model": os.path.basename(os.environ.get("MODEL_PATH", "bloom-finetuned")),
-                    "timestamp": datetime.now().isoformat(),
-                    "device": str(DEVICE),
-                    "batch_index": i,
-                    "version": "1.0.0"
-                }
-
-            results.append(result)
-
-        # Update processing time for all results
-        processing_time = time.time() - start_time
-        for result in results:
-            result["processing_time"] = processing_time
-
-        return {"results": results, "processing_time": processing_time}
+        with REGISTRY.acquire(model_name) as version:
+            predictions = await run_batch(version, request.texts, adapter)
+
+        metadata = response_metadata(version, adapter) if request.include_metadata else None
+        return batch_response(
+            predictions,
+            time.time() - start_time,
+            texts=request.texts,
+            metadata=metadata,
+            compact=request.compact,
+        )
 
+    except ExecutorSaturated as e:
+        raise server_busy(e)
     except Exception as e:
         logger.error(f"Batch prediction error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Batch prediction failed: {str(e)}")
 
+# Pre-tokenized prediction endpoint
+@app.post(
+    "/predict/tokens",
+    response_model=Union[BatchSentimentResponse, CompactBatchSentimentResponse],
+    dependencies=[Depends(verify_api_key)],
+)
+async def predict_tokens(
+    request: TokenizedSentimentRequest,
+    x_model: Optional[str] = Header(None),
+    x_adapter: Optional[str] = Header(None),
+    api_key: str = Depends(verify_api_key),
+):
+    """Score token id sequences produced upstream with the model's own tokenizer"""
+    require_ready()
+    model_name = resolve_model(request.model or x_model)
+    adapter = request.adapter or x_adapter
+    require_adapter(REGISTRY.get(model_name), adapter)
+
+    if len(request.input_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch size exceeds maximum of {MAX_BATCH_SIZE}")
+
+    vocab_size = len(REGISTRY.get(model_name).tokenizer)
+    for ids in request.input_ids:
+        if not ids:
+            raise HTTPException(status_code=400, detail="input_ids sequences must not be empty")
+        if min(ids) < 0 or max(ids) >= vocab_size:
+            raise HTTPException(status_code=400, detail=f"Token ids must be in [0, {vocab_size})")
+    spend_privacy_budget(api_key, len(request.input_ids))
+
+    start_time = time.time()
+
+    try:
+        input_ids = [ids[:inference.MAX_LENGTH] for ids in request.input_ids]
+        with REGISTRY.acquire(model_name) as version:
+            predictions = await run_encoded(version, input_ids, adapter)
+        count_predictions(predictions)
+
+        metadata = response_metadata(version, adapter) if request.include_metadata else None
+        return batch_response(predictions, time.time() - start_time, metadata=metadata, compact=request.compact)
+
+    except ExecutorSaturated as e:
+        raise server_busy(e)
+    except Exception as e:
+        logger.error(f"Token prediction error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Token prediction failed: {str(e)}")
+
+# Score one streamed chunk, queueing for an executor slot instead of failing
+async def run_stream_batch(
+    version: ModelVersion, adapter: Optional[str], batch: List[tuple], api_key: str
+) -> List[bytes]:
+    try:
+        spend_privacy_budget(api_key, len(batch))
+    except HTTPException as e:
+        return [ndjson_line({"line": line_number, "error": e.detail}) for line_number, _, _ in batch]
+
+    try:
+        # Resumes as soon as a slot frees up, so the stream keeps flowing under load
+        predictions = await run_batch(version, [text for _, _, text in batch], adapter, wait=True)
+    except Exception as e:
+        logger.error(f"Stream prediction error: {str(e)}")
+        return [
+            ndjson_line({"line": line_number, "error": f"Prediction failed: {str(e)}"})
+            for line_number, _, _ in batch
+        ]
+
+    lines = []
+    for (line_number, item_id, _), (sentiment, score) in zip(batch, predictions):
+        result = {"line": line_number, "sentiment": sentiment, "score": score}
+        if item_id is not None:
+            result["id"] = item_id
+        lines.append(ndjson_line(result))
+    return lines
+
+async def stream_predictions(request: Request, model_name: str, adapter: Optional[str], api_key: str):
+    # The whole stream is scored by the version that was active when it started
+    with REGISTRY.acquire(model_name) as version:
+        async for line in score_stream(request, version, adapter, api_key):
+            yield line
+
+async def score_stream(request: Request, version: ModelVersion, adapter: Optional[str], api_key: str):
+    batch = []
+    in_flight = None
+
+    async for line_number, item in iter_ndjson(request):
+        if isinstance(item, str):
+            item = {"text": item}
+        if not isinstance(item, dict) or not isinstance(item.get("text"), str):
+            error = str(item) if isinstance(item, ValueError) else "Expected a JSON string or an object with a 'text' field"
+            yield ndjson_line({"line": line_number, "error": error})
+            continue
+
+        batch.append((line_number, item.get("id"), item["text"]))
+        if len(batch) >= STREAM_BATCH_SIZE:
+            # Keep one batch scoring while the next one is read
+            if in_flight is not None:
+                for line in await in_flight:
+                    yield line
+            in_flight = asyncio.ensure_future(run_stream_batch(version, adapter, batch, api_key))
+            batch = []
+
+    if in_flight is not None:
+        for line in await in_flight:
+            yield line
+    if batch:
+        for line in await run_stream_batch(version, adapter, batch, api_key):
+            yield line
+
+# Streaming bulk prediction endpoint
+@app.post("/predict/stream", dependencies=[Depends(verify_api_key)])
+async def predict_stream(
+    request: Request,
+    model: Optional[str] = None,
+    adapter: Optional[str] = None,
+    x_model: Optional[str] = Header(None),
+    x_adapter: Optional[str] = Header(None),
+    api_key: str = Depends(verify_api_key),
+):
+    """Score an NDJSON body of texts, streaming NDJSON results back as lines arrive
+
+    Each input line is either a JSON string or an object with ``text`` and an
+    optional ``id``. Each output line carries the input ``line`` number, the
+    ``id`` if one was given, and ``sentiment``/``score`` or an ``error``. The
+    model and LoRA adapter are chosen by the ``model``/``adapter`` query
+    parameters or the X-Model/X-Adapter headers.
+    """
+    require_ready()
+    model_name = resolve_model(model or x_model)
+    adapter = adapter or x_adapter
+    require_adapter(REGISTRY.get(model_name), adapter)
+
+    return NDJSONResponse(stream_predictions(request, model_name, adapter, api_key))
+
+# Model registry endpoints
+@app.get("/models", dependencies=[Depends(verify_api_key)])
+async def list_models():
+    return {"default": MODEL_NAME, "models": REGISTRY.status()}
+
+@app.post("/models/{name}/load", status_code=202, dependencies=[Depends(verify_admin_key)])
+async def load_named_model(name: str, request: ModelLoadRequest):
+    """Load a model version in the background and swap it in once it is warmed up
+
+    Requests keep being served by the current version of ``name`` until the
+    swap; the old version is freed when its last in-flight request finishes.
+    """
+    if EXECUTOR.mode == "process":
+        raise HTTPException(status_code=400, detail="Model reloads require INFERENCE_MODE=thread")
+    if request.share_weights_with is not None and request.share_weights_with not in REGISTRY.names():
+        raise HTTPException(status_code=404, detail=f"Unknown model: {request.share_weights_with}")
+    path = resolve_model_path(request.path)
+
+    try:
+        REGISTRY.load_in_background(name, path, request.version, share_weights_with=request.share_weights_with)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return {"status": "loading", "model": name, "path": path, "version": request.version}
+
 # Load model at startup
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting model server...")
-    load_model()
+    BATCHER.start()
+
+    # Load in the background so /health answers while weights load and warm up
+    LOAD_STATE["state"] = "loading"
+    threading.Thread(target=load_model, name="model-loader", daemon=True).start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await BATCHER.stop()
+    EXECUTOR.shutdown()
 
 # Main entry point
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+import json
+from typing import Any, AsyncIterator, Tuple
+
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+class DuplexStreamingResponse(StreamingResponse):
+    """Streaming response that lets the endpoint keep reading the request body
+
+    Starlette's StreamingResponse consumes ``receive`` to watch for client
+    disconnects, which would swallow request body chunks that the response
+    generator is still reading. Here disconnects surface through
+    ``request.stream()`` instead.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+
+        if self.background is not None:
+            await self.background()
+
+class NDJSONResponse(DuplexStreamingResponse):
+    media_type = "application/x-ndjson"
+
+async def iter_ndjson(request: Request) -> AsyncIterator[Tuple[int, Any]]:
+    """Yield (line_number, parsed_value) for each non-empty line of the body as it arrives
+
+    Lines that are not valid JSON are yielded as ``ValueError`` instances so
+    the caller can report them without aborting the stream.
+    """
+    buffer = b""
+    line_number = 0
+
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, _parse_line(line)
+
+    if buffer.strip():
+        yield line_number + 1, _parse_line(buffer)
+
+def _parse_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ValueError(f"Invalid JSON: {str(e)}")
+
+def ndjson_line(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode() + b"\n"
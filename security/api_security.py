@@ -1,89 +1,192 @@
-
 import os
 import jwt
 import time
+import logging
 import hashlib
 import secrets
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List, Union
-from fastapi import HTTPException, Security, Depends, status
+from fastapi import HTTPException, Security, Depends, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, APIKeyHeader
 
+from rate_limiting import RateLimit, create_store
+
+logger = logging.getLogger("api-security")
+
 # JWT Secret Key - in production, load from secure location
 JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-secret-key-for-jwt")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_MINUTES = 30
 
+# Verified tokens are cached until they expire; clients reuse one token for many requests
+JWT_CACHE_MAX_ENTRIES = int(os.environ.get("JWT_CACHE_MAX_ENTRIES", 10000))
+
 # API Key header security
 api_key_header = APIKeyHeader(name="X-API-Key")
 
 # Bearer token security
 token_auth_scheme = HTTPBearer()
 
+# Rate limiting: "rate_limit" requests per period, with bursts of up to "burst" at once
+RATE_LIMIT_PERIOD_SECONDS = float(os.environ.get("RATE_LIMIT_PERIOD_SECONDS", 3600))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 10))
+# Whether requests are admitted (true) or rejected with 503 (false) while the limiter backend is failing
+RATE_LIMIT_FAIL_OPEN = os.environ.get("RATE_LIMIT_FAIL_OPEN", "true").lower() in ("1", "true", "yes")
+
+def digest(secret: str) -> bytes:
+    """SHA-256 of an API key or token, used to index them without storing the secret itself"""
+    return hashlib.sha256(secret.encode()).digest()
+
+class APIKeyIndex:
+    """API keys indexed by their SHA-256 digest, so the store never holds a usable key
+
+    Client info is parsed once when a key is added: scopes become a frozenset
+    and the rate limit a ``RateLimit``, so a lookup is one hash and one dict
+    lookup. The dict compares SHA-256 digests of the presented key, not the
+    key itself, so lookup timing reveals nothing useful about a valid key
+    and no separate constant-time comparison is needed.
+    """
+
+    def __init__(self):
+        self._entries: Dict[bytes, Dict] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, api_key: str) -> bool:
+        return self.lookup(api_key) is not None
+
+    def add(self, api_key: str, client_info: Dict):
+        client_info = dict(client_info, scopes=frozenset(client_info.get("scopes", ())))
+        client_info["limit"] = RateLimit(
+            client_info["rate_limit"],
+            period=RATE_LIMIT_PERIOD_SECONDS,
+            burst=client_info.get("burst", RATE_LIMIT_BURST),
+        )
+        self._entries[digest(api_key)] = client_info
+
+    def revoke(self, api_key: str):
+        self._entries.pop(digest(api_key), None)
+
+    def lookup(self, api_key: str) -> Optional[Dict]:
+        """Client info for ``api_key``, or None if it is not a known key"""
+        return self._entries.get(digest(api_key))
+
+class TokenClaims(dict):
+    """Verified JWT payload with its scopes pre-parsed into a frozenset; treat as read-only"""
+
+    def __init__(self, payload: Dict):
+        super().__init__(payload)
+        self.scope_set = frozenset(payload.get("scopes", ()))
+
+class TokenCache:
+    """Verified JWT claims keyed by token digest, each dropped once its token expires
+
+    Only tokens that passed signature verification are added, so invalid
+    tokens cannot fill the cache. When full, the oldest entry is evicted.
+    """
+
+    def __init__(self, max_entries: int = JWT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: Dict[bytes, TokenClaims] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token_digest: bytes, now: float) -> Optional[TokenClaims]:
+        claims = self._entries.get(token_digest)
+        if claims is not None and claims["exp"] <= now:
+            with self._lock:
+                self._entries.pop(token_digest, None)
+            return None
+        return claims
+
+    def put(self, token_digest: bytes, claims: TokenClaims):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            while len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+            self._entries[token_digest] = claims
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
 # API Key store - in production, use a database
-API_KEYS = {
-    # Format: "api_key": {"client_id": "client1", "scopes": ["read", "write"], "rate_limit": 100}
-}
+# Holds key digests only: "digest": {"client_id": "client1", "scopes": frozenset({"read"}), "rate_limit": 100, ...}
+API_KEYS = APIKeyIndex()
+
+# Verified JWT cache
+TOKEN_CACHE = TokenCache()
 
-# Rate limiting store
-RATE_LIMITS = {
-    # Format: "client_id": {"count": 0, "reset_at": timestamp}
-}
+# Rate limiting store - set RATE_LIMIT_BACKEND=redis to share limits across replicas
+RATE_LIMIT_STORE = create_store()
+
+# Requests checked while the limiter backend was failing, by outcome ("admitted" or "rejected")
+RATE_LIMIT_FAILURES = {"admitted": 0, "rejected": 0}
 
 class APISecurityManager:
     """Manages API security including authentication, authorization, and rate limiting"""
 
     @staticmethod
-    def generate_api_key(client_id: str, scopes: List[str], rate_limit: int = 100) -> str:
+    def generate_api_key(
+        client_id: str, scopes: List[str], rate_limit: int = 100, burst: Optional[int] = None
+    ) -> str:
         """Generate a new API key for a client"""
         # Create a random API key
         api_key = secrets.token_hex(16)
 
-        # Store API key info
-        API_KEYS[api_key] = {
+        # Store API key info under the key's digest
+        API_KEYS.add(api_key, {
             "client_id": client_id,
             "scopes": scopes,
-            "rate_limit": rate_limit
-        }
+            "rate_limit": rate_limit,
+            "burst": min(rate_limit, burst if burst is not None else RATE_LIMIT_BURST)
+        })
 
         return api_key
 
     @staticmethod
-    def verify_api_key(api_key: str = Security(api_key_header)):
+    def verify_api_key(response: Response, api_key: str = Security(api_key_header)):
         """Verify API key and apply rate limiting"""
-        if api_key not in API_KEYS:
+        client_info = API_KEYS.lookup(api_key)
+        if client_info is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid API key",
                 headers={"WWW-Authenticate": "APIKey"},
             )
 
-        # Get client info
-        client_info = API_KEYS[api_key]
-        client_id = client_info["client_id"]
-
         # Apply rate limiting
-        now = int(time.time())
-
-        # Initialize rate limit tracking if needed
-        if client_id not in RATE_LIMITS:
-            # Reset window is 1 hour
-            RATE_LIMITS[client_id] = {"count": 0, "reset_at": now + 3600}
-
-        # Check if the window has expired and reset if needed
-        if now > RATE_LIMITS[client_id]["reset_at"]:
-            RATE_LIMITS[client_id] = {"count": 0, "reset_at": now + 3600}
+        try:
+            decision = RATE_LIMIT_STORE.hit(client_info["client_id"], client_info["limit"])
+        except Exception as e:
+            # By default fail open, so an unreachable limiter backend does not take the API down
+            outcome = "admitted" if RATE_LIMIT_FAIL_OPEN else "rejected"
+            RATE_LIMIT_FAILURES[outcome] += 1
+            logger.warning(
+                f"Rate limiter unavailable, {outcome} request from {client_info['client_id']} "
+                f"({RATE_LIMIT_FAILURES[outcome]} {outcome} so far): {type(e).__name__}: {e}"
+            )
+            if not RATE_LIMIT_FAIL_OPEN:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Rate limiter unavailable",
+                    headers={"Retry-After": "1"},
+                )
+            return client_info
 
-        # Check rate limit
-        rate_limit = client_info["rate_limit"]
-        if RATE_LIMITS[client_id]["count"] >= rate_limit:
+        if not decision.allowed:
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail=f"Rate limit exceeded. Try again after {RATE_LIMITS[client_id]['reset_at'] - now} seconds.",
+                detail=f"Rate limit exceeded. Try again after {decision.headers()['Retry-After']} seconds.",
+                headers=decision.headers(),
             )
 
-        # Increment request count
-        RATE_LIMITS[client_id]["count"] += 1
+        response.headers.update(decision.headers())
 
         # Return client info for further use
         return client_info
@@ -104,31 +207,25 @@ class APISecurityManager:
         return token
 
     @staticmethod
-    def verify_jwt_token(credentials: HTTPAuthorizationCredentials = Security(token_auth_scheme)):
+    def verify_jwt_token(credentials: HTTPAuthorizationCredentials = Security(token_auth_scheme)) -> TokenClaims:
         """Verify JWT token and extract claims"""
         token = credentials.credentials
+        now = time.time()
+
+        # Tokens seen before skip decoding and signature verification until they expire
+        token_digest = digest(token)
+        claims = TOKEN_CACHE.get(token_digest, now)
+        if claims is not None:
+            return claims
 
         try:
             payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-
-            # Check expiration
-            exp = payload.get("exp")
-            if exp is None:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Token has no expiration",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
-
-            if datetime.fromtimestamp(exp) < datetime.utcnow():
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Token has expired",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
-
-            return payload
-
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has expired",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
         except jwt.PyJWTError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -136,17 +233,36 @@ class APISecurityManager:
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
+        # Check expiration
+        exp = payload.get("exp")
+        if exp is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has no expiration",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        if exp <= now:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has expired",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        claims = TokenClaims(payload)
+        TOKEN_CACHE.put(token_digest, claims)
+        return claims
+
     @staticmethod
-    def check_scope(required_scope: str, token_scopes: List[str]) -> bool:
+    def check_scope(required_scope: str, token_scopes: Union[frozenset, List[str]]) -> bool:
         """Check if token has the required scope"""
         return required_scope in token_scopes
 
 # Dependency for scope-based authorization
 def require_scope(required_scope: str):
     """Dependency that checks if a token has the required scope"""
-    def _require_scope(payload: Dict = Depends(APISecurityManager.verify_jwt_token)):
-        scopes = payload.get("scopes", [])
-        if not APISecurityManager.check_scope(required_scope, scopes):
+    def _require_scope(payload: TokenClaims = Depends(APISecurityManager.verify_jwt_token)):
+        if not APISecurityManager.check_scope(required_scope, payload.scope_set):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Insufficient permissions. Required scope: {required_scope}",
@@ -0,0 +1,196 @@
+import math
+import os
+import threading
+from typing import Dict, Optional, Union
+
+import numpy as np
+import torch
+
+MECHANISMS = ("gaussian", "laplace")
+
+class PrivacyBudgetExceeded(Exception):
+    """Raised when a release would take a client past its privacy budget"""
+
+def _gaussian_delta(sigma: float, epsilon: float, sensitivity: float) -> float:
+    """Smallest delta for which Gaussian noise of std sigma is (epsilon, delta)-DP (Balle & Wang 2018, Theorem 8)"""
+    a, b = sensitivity / (2 * sigma), epsilon * sigma / sensitivity
+    tail = 0.5 * math.erfc((a + b) / math.sqrt(2))
+    # exp(epsilon) * tail without overflowing for large epsilon
+    scaled_tail = math.exp(epsilon + math.log(tail)) if tail > 0 else 0.0
+    return 0.5 * math.erfc((b - a) / math.sqrt(2)) - scaled_tail
+
+def gaussian_sigma(epsilon: float, delta: float, sensitivity: float) -> float:
+    """Noise standard deviation for the (epsilon, delta) Gaussian mechanism
+
+    Uses the analytic calibration, which holds for any epsilon (the classic
+    ``sqrt(2 ln(1.25 / delta)) / epsilon`` bound needs epsilon < 1) and
+    adds less noise. Found by bisection, rounding up.
+    """
+    low, high = 0.0, sensitivity
+    while _gaussian_delta(high, epsilon, sensitivity) > delta:
+        low, high = high, 2 * high
+    for _ in range(100):
+        middle = (low + high) / 2
+        if _gaussian_delta(middle, epsilon, sensitivity) > delta:
+            low = middle
+        else:
+            high = middle
+    return high
+
+def laplace_scale(epsilon: float, sensitivity: float) -> float:
+    """Noise scale b for the epsilon Laplace mechanism"""
+    return sensitivity / epsilon
+
+class NoiseMechanism:
+    """Calibrated noise for batches of vectors such as embeddings or logits
+
+    Every row is first clipped to ``clip_norm`` (L2 norm for the Gaussian
+    mechanism, L1 for Laplace), so one input can move its row by at most
+    ``2 * clip_norm``; that is the sensitivity the noise is calibrated to.
+    Each row is then an (epsilon, delta)-DP release of its input. Clipping
+    and noise are single vectorized ops over the whole batch, on whatever
+    device the batch is on.
+
+    Noise comes from generators seeded from ``os.urandom`` in each process,
+    never from torch's or NumPy's default (and predictable) seeds.
+    """
+
+    def __init__(self, mechanism: str = "gaussian", epsilon: float = 0.5, delta: float = 1e-5, clip_norm: float = 1.0):
+        if mechanism not in MECHANISMS:
+            raise ValueError(f"Unknown noise mechanism: {mechanism}")
+        if epsilon <= 0 or clip_norm <= 0:
+            raise ValueError("epsilon and clip_norm must be positive")
+        if mechanism == "gaussian" and not 0 < delta < 1:
+            raise ValueError("The Gaussian mechanism needs 0 < delta < 1")
+
+        self.mechanism = mechanism
+        self.epsilon = epsilon
+        self.delta = delta if mechanism == "gaussian" else 0.0
+        self.clip_norm = clip_norm
+        self.sensitivity = 2 * clip_norm
+        if mechanism == "gaussian":
+            self.scale = gaussian_sigma(epsilon, delta, self.sensitivity)
+        else:
+            self.scale = laplace_scale(epsilon, self.sensitivity)
+        self._generators = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Generators are per process; a copy sent to a worker seeds its own
+        state = dict(self.__dict__)
+        state["_generators"] = {}
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __call__(self, batch: Union[torch.Tensor, np.ndarray]) -> Union[torch.Tensor, np.ndarray]:
+        if isinstance(batch, torch.Tensor):
+            return self.apply_torch(batch)
+        return self.apply_numpy(np.asarray(batch))
+
+    def apply_torch(self, batch: torch.Tensor) -> torch.Tensor:
+        """Clip rows and add noise; the last dimension is the vector dimension"""
+        batch = batch.float()
+        norms = batch.norm(p=2 if self.mechanism == "gaussian" else 1, dim=-1, keepdim=True)
+        clipped = batch * (self.clip_norm / norms.clamp_min(self.clip_norm))
+
+        generator = self._torch_generator(batch.device)
+        if self.mechanism == "gaussian":
+            noise = torch.randn(batch.shape, generator=generator, device=batch.device) * self.scale
+        else:
+            # Inverse CDF of the Laplace distribution; u is kept off 0 so log1p never sees -1
+            uniform = torch.rand(batch.shape, generator=generator, device=batch.device)
+            uniform = uniform.clamp_(min=torch.finfo(uniform.dtype).eps) - 0.5
+            noise = -self.scale * uniform.sign() * torch.log1p(-2 * uniform.abs())
+        return clipped + noise
+
+    def apply_numpy(self, batch: np.ndarray) -> np.ndarray:
+        batch = batch.astype(np.float64, copy=False)
+        norms = np.linalg.norm(batch, ord=2 if self.mechanism == "gaussian" else 1, axis=-1, keepdims=True)
+        clipped = batch * (self.clip_norm / np.maximum(norms, self.clip_norm))
+
+        rng = self._numpy_generator()
+        if self.mechanism == "gaussian":
+            return clipped + rng.normal(0.0, self.scale, size=batch.shape)
+        return clipped + rng.laplace(0.0, self.scale, size=batch.shape)
+
+    def _torch_generator(self, device: torch.device) -> torch.Generator:
+        key = (os.getpid(), str(device))
+        generator = self._generators.get(key)
+        if generator is None:
+            with self._lock:
+                generator = self._generators.get(key)
+                if generator is None:
+                    generator = torch.Generator(device=device)
+                    generator.manual_seed(int.from_bytes(os.urandom(8), "little"))
+                    self._generators[key] = generator
+        return generator
+
+    def _numpy_generator(self) -> np.random.Generator:
+        key = (os.getpid(), "numpy")
+        generator = self._generators.get(key)
+        if generator is None:
+            with self._lock:
+                generator = self._generators.setdefault(key, np.random.default_rng())
+        return generator
+
+    def describe(self) -> Dict:
+        return {
+            "mechanism": self.mechanism,
+            "epsilon": self.epsilon,
+            "delta": self.delta,
+            "clip_norm": self.clip_norm,
+            "noise_scale": self.scale,
+        }
+
+class PrivacyAccountant:
+    """Cumulative (epsilon, delta) released to each client
+
+    Uses basic sequential composition: epsilons and deltas of successive
+    releases add up. A release that would exceed ``epsilon_budget`` (or
+    ``delta_budget``) is refused with ``PrivacyBudgetExceeded`` and not
+    charged. Budgets of None are unlimited, which still tracks spending.
+    """
+
+    def __init__(self, epsilon_budget: Optional[float] = None, delta_budget: Optional[float] = None):
+        self.epsilon_budget = epsilon_budget
+        self.delta_budget = delta_budget
+        self._spent: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def charge(self, client: str, epsilon: float, delta: float = 0.0, releases: int = 1) -> Dict:
+        """Record ``releases`` releases of (epsilon, delta) each for ``client``; returns its totals"""
+        with self._lock:
+            spent = self._spent.get(client, [0.0, 0.0, 0])
+            total_epsilon = spent[0] + epsilon * releases
+            total_delta = spent[1] + delta * releases
+            # Tolerate float rounding when a budget is spent exactly
+            if self.epsilon_budget is not None and total_epsilon > self.epsilon_budget * (1 + 1e-9):
+                raise PrivacyBudgetExceeded(
+                    f"Privacy budget exhausted for {client}: {spent[0]:.4g} of {self.epsilon_budget:.4g} epsilon spent"
+                )
+            if self.delta_budget is not None and total_delta > self.delta_budget * (1 + 1e-9):
+                raise PrivacyBudgetExceeded(
+                    f"Privacy budget exhausted for {client}: {spent[1]:.4g} of {self.delta_budget:.4g} delta spent"
+                )
+            self._spent[client] = [total_epsilon, total_delta, spent[2] + releases]
+            return self._totals(client)
+
+    def spent(self, client: str) -> Dict:
+        with self._lock:
+            return self._totals(client)
+
+    def reset(self, client: Optional[str] = None):
+        with self._lock:
+            if client is None:
+                self._spent.clear()
+            else:
+                self._spent.pop(client, None)
+
+    def _totals(self, client: str) -> Dict:
+        epsilon, delta, releases = self._spent.get(client, [0.0, 0.0, 0])
+        remaining = None if self.epsilon_budget is None else max(0.0, self.epsilon_budget - epsilon)
+        return {"epsilon": epsilon, "delta": delta, "releases": releases, "epsilon_remaining": remaining}
@@ -1,16 +1,322 @@
-
+import io
 import os
+import json
 import base64
+import struct
 import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterable, Iterator, List, Union
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.backends import default_backend
 
+PBKDF2_ITERATIONS = 100000
+# Iteration counts accepted from encrypted file headers; anything higher would let a crafted file stall the reader
+MAX_PBKDF2_ITERATIONS = int(os.environ.get("MAX_PBKDF2_ITERATIONS", 10 * PBKDF2_ITERATIONS))
+
+# Derived keys kept in memory by the default key ring
+KEYRING_MAX_KEYS = int(os.environ.get("KEYRING_MAX_KEYS", 16))
+
+# Record format for encrypt_many: salt (16) | nonce (12) | ciphertext + tag.
+# Records share a salt, and so a derived key, until MAX_RECORDS_PER_SALT
+# have been encrypted, well below the 2**32 random-nonce limit for GCM.
+RECORD_SALT_SIZE = 16
+RECORD_NONCE_SIZE = 12
+MAX_RECORDS_PER_SALT = 2 ** 30
+
+# Streaming encrypted file format
+#
+#   header: magic (8) | version (1) | reserved (3) | PBKDF2 iterations (4) |
+#           chunk size (4) | plaintext size (8) | salt (16) | nonce prefix (8)
+#   body:   AES-256-GCM ciphertext + 16-byte tag for each chunk; every chunk
+#           holds ``chunk size`` plaintext bytes except the last
+#
+# Chunk i is encrypted under nonce = nonce prefix || i (4 bytes) and
+# authenticated together with the header, its index and a last-chunk flag,
+# so chunks cannot be reordered, moved between files or truncated away.
+# Chunk offsets follow from the header alone, which gives random access.
+STREAM_MAGIC = b"XNLAEAD\x00"
+STREAM_VERSION = 1
+STREAM_HEADER = struct.Struct(">8sB3xIIQ16s8s")
+STREAM_TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+SAFETENSORS_DTYPES = {
+    "F64": "float64",
+    "F32": "float32",
+    "F16": "float16",
+    "BF16": "bfloat16",
+    "I64": "int64",
+    "I32": "int32",
+    "I16": "int16",
+    "I8": "int8",
+    "U8": "uint8",
+    "BOOL": "bool",
+}
+
+class DecryptionError(ValueError):
+    """Raised when encrypted data is corrupt, truncated or the password is wrong"""
+
+def _zeroize(buffer: bytearray):
+    buffer[:] = bytes(len(buffer))
+
+class _DerivedKey:
+    def __init__(self, key: bytearray):
+        self.key = key
+        self.aead = AESGCM(key)
+        self.in_use = 0
+        self.evicted = False
+
+class KeyRing:
+    """PBKDF2-derived keys cached per (password, salt, iterations)
+
+    Each key is derived once, then reused together with its AES-GCM cipher.
+    At most ``max_keys`` are held; the least recently used is evicted, and
+    its key bytes are overwritten with zeros as soon as no caller holds it
+    (copies made by callers of ``key`` are theirs to discard). Entries are
+    indexed by a hash of the password, never the password itself.
+    """
+
+    def __init__(self, max_keys: int = KEYRING_MAX_KEYS, iterations: int = PBKDF2_ITERATIONS):
+        self.max_keys = max(1, max_keys)
+        self.iterations = iterations
+        self._keys = OrderedDict()
+        self._encryption_salts = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    @contextmanager
+    def cipher(self, password: str, salt: bytes, iterations: int = None) -> Iterator[AESGCM]:
+        """AES-GCM cipher for the key derived from ``password`` and ``salt``, pinned until the block exits"""
+        entry = self._acquire(password, salt, self.iterations if iterations is None else iterations)
+        try:
+            yield entry.aead
+        finally:
+            self._release(entry)
+
+    def key(self, password: str, salt: bytes, iterations: int = None) -> bytes:
+        """Copy of the derived key, for the CBC helpers that take raw keys"""
+        entry = self._acquire(password, salt, self.iterations if iterations is None else iterations)
+        try:
+            return bytes(entry.key)
+        finally:
+            self._release(entry)
+
+    def encrypt_many(self, records: Iterable[Union[str, bytes]], password: str) -> List[bytes]:
+        """Encrypt records (e.g. logged predictions) with one key and cipher for the whole batch"""
+        records = [record.encode() if isinstance(record, str) else record for record in records]
+        salt = self._encryption_salt(password, len(records))
+        nonces = os.urandom(RECORD_NONCE_SIZE * len(records))
+
+        with self.cipher(password, salt) as aead:
+            encrypted = []
+            for i, record in enumerate(records):
+                nonce = nonces[i * RECORD_NONCE_SIZE:(i + 1) * RECORD_NONCE_SIZE]
+                encrypted.append(salt + nonce + aead.encrypt(nonce, record, salt))
+        return encrypted
+
+    def decrypt_many(self, records: Iterable[bytes], password: str) -> List[bytes]:
+        """Decrypt records from ``encrypt_many``; keys are derived once per distinct salt"""
+        records = list(records)
+        by_salt = {}
+        for i, record in enumerate(records):
+            by_salt.setdefault(bytes(record[:RECORD_SALT_SIZE]), []).append(i)
+
+        decrypted = [None] * len(records)
+        header_size = RECORD_SALT_SIZE + RECORD_NONCE_SIZE
+        for salt, indices in by_salt.items():
+            with self.cipher(password, salt) as aead:
+                for i in indices:
+                    record = records[i]
+                    try:
+                        decrypted[i] = aead.decrypt(record[RECORD_SALT_SIZE:header_size], record[header_size:], salt)
+                    except InvalidTag:
+                        raise DecryptionError(f"Record {i} failed authentication (wrong password or corrupted record)")
+        return decrypted
+
+    def clear(self):
+        """Evict every key, zeroizing those not currently in use"""
+        with self._lock:
+            while self._keys:
+                self._evict(next(iter(self._keys)))
+            self._encryption_salts.clear()
+
+    def _cache_key(self, password: str, salt: bytes, iterations: int):
+        return hashlib.sha256(salt + password.encode()).digest(), iterations
+
+    def _acquire(self, password: str, salt: bytes, iterations: int) -> _DerivedKey:
+        cache_key = self._cache_key(password, salt, iterations)
+        with self._lock:
+            entry = self._keys.get(cache_key)
+            if entry is not None:
+                self._keys.move_to_end(cache_key)
+                entry.in_use += 1
+                return entry
+
+        # Derive outside the lock so other keys stay usable meanwhile
+        derived, _ = EncryptionUtils.generate_key(password, salt, iterations)
+        candidate = _DerivedKey(bytearray(derived))
+        del derived
+
+        with self._lock:
+            entry = self._keys.get(cache_key)
+            if entry is None:
+                entry = self._keys[cache_key] = candidate
+                while len(self._keys) > self.max_keys:
+                    self._evict(next(iter(self._keys)))
+            else:
+                _zeroize(candidate.key)  # Another thread derived it first
+            entry.in_use += 1
+            return entry
+
+    def _release(self, entry: _DerivedKey):
+        with self._lock:
+            entry.in_use -= 1
+            if entry.evicted and entry.in_use == 0:
+                _zeroize(entry.key)
+
+    def _evict(self, cache_key):
+        entry = self._keys.pop(cache_key)
+        entry.evicted = True
+        if entry.in_use == 0:
+            _zeroize(entry.key)
+
+    def _encryption_salt(self, password: str, count: int) -> bytes:
+        password_id = hashlib.sha256(password.encode()).digest()
+        with self._lock:
+            salt, used = self._encryption_salts.get(password_id, (None, 0))
+            if salt is None or used + count > MAX_RECORDS_PER_SALT:
+                salt, used = os.urandom(RECORD_SALT_SIZE), 0
+            self._encryption_salts[password_id] = (salt, used + count)
+            return salt
+
+def _chunk_aad(header: bytes, index: int, last: bool) -> bytes:
+    return header + struct.pack(">IB", index, last)
+
+def _chunk_nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + struct.pack(">I", index)
+
+class EncryptedFileReader(io.RawIOBase):
+    """Seekable, read-only view of the plaintext of a file written by ``encrypt_file``
+
+    Chunks are decrypted and authenticated on demand and only the most
+    recently used one is kept, so peak memory is one chunk however large the
+    file is. Usable anywhere a binary file object is, e.g. ``torch.load``.
+    """
+
+    def __init__(self, path: str, password: str):
+        super().__init__()
+        self._keys = ExitStack()
+        self._cached_chunk = b""
+        self._file = open(path, "rb")
+        try:
+            self._header = self._file.read(STREAM_HEADER.size)
+            if len(self._header) != STREAM_HEADER.size:
+                raise DecryptionError(f"{path} is too short to be an encrypted file")
+            magic, version, iterations, self.chunk_size, self.size, salt, self._nonce_prefix = \
+                STREAM_HEADER.unpack(self._header)
+            if magic != STREAM_MAGIC:
+                raise DecryptionError(f"{path} is not an encrypted file")
+            if version != STREAM_VERSION:
+                raise DecryptionError(f"Unsupported encrypted file version: {version}")
+            if self.chunk_size == 0:
+                raise DecryptionError(f"{path} has a zero chunk size")
+            if not PBKDF2_ITERATIONS <= iterations <= MAX_PBKDF2_ITERATIONS:
+                raise DecryptionError(
+                    f"{path} asks for {iterations} PBKDF2 iterations, outside {PBKDF2_ITERATIONS}-{MAX_PBKDF2_ITERATIONS}"
+                )
+
+            self.num_chunks = max(1, -(-self.size // self.chunk_size))
+            expected_size = STREAM_HEADER.size + self.size + self.num_chunks * STREAM_TAG_SIZE
+            if os.fstat(self._file.fileno()).st_size != expected_size:
+                raise DecryptionError(f"{path} is truncated or has trailing data")
+
+            # The key stays pinned in the key ring until the reader is closed
+            self._aead = self._keys.enter_context(KEYRING.cipher(password, salt, iterations))
+        except Exception:
+            self._file.close()
+            raise
+
+        self._position = 0
+        self._cached_index = None
+
+    def read_chunk(self, index: int) -> bytes:
+        """Decrypted plaintext of chunk ``index``"""
+        if index == self._cached_index:
+            return self._cached_chunk
+        if not 0 <= index < self.num_chunks:
+            raise IndexError(f"Chunk {index} out of range")
+
+        last = index == self.num_chunks - 1
+        length = self.size - index * self.chunk_size if last else self.chunk_size
+        self._file.seek(STREAM_HEADER.size + index * (self.chunk_size + STREAM_TAG_SIZE))
+        ciphertext = self._file.read(length + STREAM_TAG_SIZE)
+
+        try:
+            chunk = self._aead.decrypt(
+                _chunk_nonce(self._nonce_prefix, index), ciphertext, _chunk_aad(self._header, index, last)
+            )
+        except InvalidTag:
+            raise DecryptionError(f"Chunk {index} failed authentication (wrong password or corrupted file)")
+
+        self._cached_index, self._cached_chunk = index, chunk
+        return chunk
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        for index in range(self.num_chunks):
+            yield self.read_chunk(index)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer) -> int:
+        """Fill ``buffer`` from the current position, across chunk boundaries"""
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < len(view) and self._position < self.size:
+            index, start = divmod(self._position, self.chunk_size)
+            chunk = self.read_chunk(index)
+            count = min(len(view) - filled, len(chunk) - start)
+            view[filled:filled + count] = chunk[start:start + count]
+            filled += count
+            self._position += count
+        return filled
+
+    def close(self):
+        self._file.close()
+        self._keys.close()
+        self._cached_chunk = b""
+        super().close()
+
+KEYRING = KeyRing()
+
 class EncryptionUtils:
     """Utilities for encryption and decryption of sensitive data"""
 
     @staticmethod
-    def generate_key(password: str, salt: bytes = None) -> bytes:
+    def generate_key(password: str, salt: bytes = None, iterations: int = PBKDF2_ITERATIONS) -> bytes:
         """Generate a key from password using PBKDF2"""
         if salt is None:
             salt = os.urandom(16)
@@ -20,7 +326,7 @@ class EncryptionUtils:
             'sha256',  # Hash algorithm
             password.encode(),  # Password as bytes
             salt,  # Salt
-            100000,  # Number of iterations
+            iterations,  # Number of iterations
             32  # Key length (32 bytes = 256 bits)
         )
 
@@ -76,7 +382,11 @@ class EncryptionUtils:
 
     @staticmethod
     def encrypt_model_weights(model_weights: bytes, password: str) -> dict:
-        """Encrypt model weights for secure storage"""
+        """Encrypt model weights for secure storage
+
+        Holds several copies of the weights in memory; prefer ``encrypt_file``
+        for checkpoints.
+        """
         # Generate key and salt
         salt = os.urandom(16)
         key, _ = EncryptionUtils.generate_key(password, salt)
@@ -96,11 +406,101 @@ class EncryptionUtils:
         # Decode salt
         salt = base64.b64decode(encrypted_data["salt"])
 
-        # Generate key
-        key, _ = EncryptionUtils.generate_key(password, salt)
+        # Derive the key, or reuse it if this password and salt were seen before
+        key = KEYRING.key(password, salt)
 
         # Decrypt weights
         encrypted_weights = base64.b64decode(encrypted_data["encrypted_weights"])
         decrypted_weights = EncryptionUtils.decrypt_data(encrypted_weights, key)
 
         return decrypted_weights.encode('latin1')
+
+    @staticmethod
+    def encrypt_file(
+        source_path: str, destination_path: str, password: str, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> int:
+        """Encrypt a file chunk by chunk with AES-256-GCM; returns the plaintext size
+
+        Reads and writes one chunk at a time, so checkpoints of any size
+        encrypt in constant memory. The output is written next to the
+        destination and renamed into place once complete; on failure the
+        partial output is removed.
+        """
+        if not 0 < chunk_size < 2 ** 32:
+            raise ValueError(f"chunk_size must be between 1 and 2**32 - 1 bytes, got {chunk_size}")
+        salt = os.urandom(16)
+        nonce_prefix = os.urandom(8)
+        key, _ = EncryptionUtils.generate_key(password, salt)
+        aead = AESGCM(key)
+
+        size = os.path.getsize(source_path)
+        num_chunks = max(1, -(-size // chunk_size))
+        header = STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, PBKDF2_ITERATIONS, chunk_size, size, salt, nonce_prefix)
+
+        temp_path = f"{destination_path}.tmp"
+        try:
+            with open(source_path, "rb") as source, open(temp_path, "wb") as destination:
+                destination.write(header)
+                for index in range(num_chunks):
+                    chunk = source.read(chunk_size)
+                    last = index == num_chunks - 1
+                    if len(chunk) != (size - index * chunk_size if last else chunk_size):
+                        raise IOError(f"{source_path} changed size while being encrypted")
+                    destination.write(aead.encrypt(
+                        _chunk_nonce(nonce_prefix, index), chunk, _chunk_aad(header, index, last)
+                    ))
+            os.replace(temp_path, destination_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        return size
+
+    @staticmethod
+    def open_encrypted(path: str, password: str) -> EncryptedFileReader:
+        """Open a file written by ``encrypt_file`` for streaming or random-access reads"""
+        return EncryptedFileReader(path, password)
+
+    @staticmethod
+    def decrypt_file(source_path: str, destination_path: str, password: str) -> int:
+        """Decrypt a file written by ``encrypt_file``; returns the plaintext size
+
+        Nothing is left behind if a chunk fails authentication, so a tampered
+        file never yields partial plaintext on disk.
+        """
+        temp_path = f"{destination_path}.tmp"
+        try:
+            with EncryptedFileReader(source_path, password) as reader, open(temp_path, "wb") as destination:
+                for chunk in reader.iter_chunks():
+                    destination.write(chunk)
+            os.replace(temp_path, destination_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        return reader.size
+
+    @staticmethod
+    def load_encrypted_safetensors(path: str, password: str) -> Dict:
+        """Decrypt a safetensors checkpoint straight into tensors
+
+        Each tensor's bytes are decrypted directly into its own storage, so
+        no plaintext copy of the checkpoint is ever held or written to disk.
+        """
+        import torch
+
+        tensors = {}
+        with EncryptedFileReader(path, password) as reader:
+            (header_size,) = struct.unpack("<Q", reader.read(8))
+            header = json.loads(reader.read(header_size))
+            data_start = 8 + header_size
+
+            for name, info in header.items():
+                if name == "__metadata__":
+                    continue
+                begin, end = info["data_offsets"]
+                storage = torch.empty(end - begin, dtype=torch.uint8)
+                reader.seek(data_start + begin)
+                if reader.readinto(storage.numpy()) != end - begin:
+                    raise DecryptionError(f"Tensor {name} extends past the end of {path}")
+                dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+                tensors[name] = storage.view(dtype).reshape(info["shape"])
+        return tensors
@@ -0,0 +1,308 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+class QuasiIdentifier:
+    """One quasi-identifier column, encoded as a NumPy array for partitioning
+
+    Integer and floating point columns without nulls are numeric and are
+    generalized to ``[min, max]`` ranges. Anything else is categorical: its
+    values are ranked in sorted order, so partitions split between runs of
+    neighbouring values, and generalized to the set of values present.
+    """
+
+    def __init__(self, name: str, numeric: bool):
+        self.name = name
+        self.numeric = numeric
+        self.integer = False
+        self.categories: List = []
+        self._chunks: List[np.ndarray] = []
+        self._codes: Dict = {}
+        self.values: Optional[np.ndarray] = None
+
+    @staticmethod
+    def is_numeric(field: pa.Field, null_count: int = 0) -> bool:
+        return (pa.types.is_integer(field.type) or pa.types.is_floating(field.type)) and null_count == 0
+
+    def append(self, column: pa.Array):
+        if self.numeric:
+            self.integer = self.integer or pa.types.is_integer(column.type)
+            self._chunks.append(column.to_numpy(zero_copy_only=False).astype(np.float64))
+            return
+
+        # Map each batch's dictionary onto codes shared by all batches
+        encoded = column.dictionary_encode()
+        batch_codes = np.array(
+            [self._codes.setdefault(value, len(self._codes)) for value in encoded.dictionary.to_pylist()],
+            dtype=np.int64,
+        )
+        indices = encoded.indices.fill_null(-1).to_numpy(zero_copy_only=False)
+        if (indices < 0).any():
+            null_code = self._codes.setdefault(None, len(self._codes))
+            batch_codes = np.append(batch_codes, null_code)
+        self._chunks.append(batch_codes[indices] if len(batch_codes) else indices)
+
+    def finish(self):
+        """Concatenate the appended batches; categorical codes are re-ranked in sorted value order"""
+        values = np.concatenate(self._chunks) if self._chunks else np.empty(0)
+        self._chunks = []
+        if not self.numeric:
+            categories = list(self._codes)
+            order = sorted(range(len(categories)), key=lambda i: (categories[i] is None, str(categories[i])))
+            rank = np.empty(len(categories), dtype=np.int64)
+            rank[order] = np.arange(len(categories))
+            self.categories = [categories[i] for i in order]
+            values = rank[values].astype(np.float64) if len(categories) else values.astype(np.float64)
+            self._codes = {}
+        self.values = values
+
+    @property
+    def domain_width(self) -> float:
+        """Spread of the whole column, used to normalize widths and information loss"""
+        if not len(self.values):
+            return 0.0
+        if self.numeric:
+            return float(self.values.max() - self.values.min())
+        return float(len(self.categories) - 1)
+
+class MondrianAnonymizer:
+    """k-anonymization by Mondrian multidimensional partitioning
+
+    Records are recursively split at the median of the quasi-identifier
+    with the widest normalized range, as long as both halves keep at least
+    ``k`` records; each final partition then has every quasi-identifier
+    generalized to the range or set of values it contains. Small groups are
+    merged into generalized ones rather than suppressed. This is the relaxed
+    variant: records with equal values may land on both sides of a split,
+    which keeps every split balanced.
+
+    Partitioning is vectorized one tree level at a time over all partitions,
+    with one sort per level, so it scales as O(n log n) per level and
+    O(log(n / k)) levels. Only the quasi-identifier columns are held in
+    memory; Parquet input is streamed in record batches twice, once to read
+    the quasi-identifiers and once to write generalized batches.
+    """
+
+    def __init__(self, k: int = 5, quasi_identifiers: Optional[List[str]] = None):
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        self.k = k
+        self.quasi_identifiers = quasi_identifiers
+
+    def anonymize_table(self, table: pa.Table) -> Tuple[pa.Table, Dict]:
+        """Generalize the quasi-identifier columns of an in-memory table"""
+        start_time = time.perf_counter()
+        columns = self._columns(table.schema, {name: table.column(name).null_count for name in table.column_names})
+        for batch in table.to_batches():
+            for column in columns:
+                column.append(batch.column(batch.schema.get_field_index(column.name)))
+
+        partition = self._partition(columns)
+        if partition is None:
+            empty = self._generalize_batch(table.slice(0, 0), columns, None, 0)
+            return empty, self._report(columns, None, table.num_rows, start_time)
+
+        anonymized = self._generalize_batch(table, columns, partition, 0)
+        return anonymized, self._report(columns, partition, table.num_rows, start_time)
+
+    def anonymize_parquet(self, source_path: str, destination_path: str, batch_size: int = 65536) -> Dict:
+        """Stream a Parquet file through the anonymizer into another Parquet file"""
+        start_time = time.perf_counter()
+        source = pq.ParquetFile(source_path)
+        metadata = source.metadata
+        # Columns without statistics may hold nulls, so they are treated as categorical
+        null_counts = {}
+        for row_group in range(metadata.num_row_groups):
+            for i in range(metadata.num_columns):
+                column = metadata.row_group(row_group).column(i)
+                statistics = column.statistics
+                may_have_nulls = statistics is None or not statistics.has_null_count or statistics.null_count > 0
+                null_counts[column.path_in_schema] = null_counts.get(column.path_in_schema, 0) + int(may_have_nulls)
+        columns = self._columns(source.schema_arrow, null_counts)
+
+        # Pass 1: quasi-identifiers only
+        for batch in source.iter_batches(batch_size=batch_size, columns=[column.name for column in columns]):
+            for i, column in enumerate(columns):
+                column.append(batch.column(i))
+
+        num_rows = metadata.num_rows
+        partition = self._partition(columns)
+
+        # Pass 2: every column, generalized batch by batch
+        writer = None
+        offset = 0
+        try:
+            if partition is not None:
+                for batch in source.iter_batches(batch_size=batch_size):
+                    anonymized = self._generalize_batch(pa.Table.from_batches([batch]), columns, partition, offset)
+                    offset += batch.num_rows
+                    if writer is None:
+                        writer = pq.ParquetWriter(destination_path, anonymized.schema)
+                    writer.write_table(anonymized)
+            if writer is None:
+                empty = self._generalize_batch(source.schema_arrow.empty_table(), columns, None, 0)
+                writer = pq.ParquetWriter(destination_path, empty.schema)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        return self._report(columns, partition, num_rows, start_time)
+
+    def _columns(self, schema: pa.Schema, null_counts: Dict[str, int]) -> List[QuasiIdentifier]:
+        names = self.quasi_identifiers if self.quasi_identifiers is not None else schema.names
+        missing = [name for name in names if schema.get_field_index(name) < 0]
+        if missing:
+            raise KeyError(f"Quasi-identifier columns not found: {missing}")
+        return [
+            QuasiIdentifier(name, QuasiIdentifier.is_numeric(schema.field(name), null_counts.get(name, 0)))
+            for name in names
+        ]
+
+    def _partition(self, columns: List[QuasiIdentifier]) -> Optional[Dict]:
+        """Split records into partitions of at least k; None if there are fewer than k records"""
+        for column in columns:
+            column.finish()
+        n = len(columns[0].values) if columns else 0
+        if n < self.k or not columns:
+            return None
+
+        values = np.stack([column.values for column in columns])
+        widths = np.array([column.domain_width for column in columns])
+        scale = np.where(widths > 0, widths, 1.0)[:, None]
+
+        # Rank of every record in every dimension, so splits can sort by integer keys
+        ranks = np.empty(values.shape, dtype=np.int64)
+        for d in range(len(columns)):
+            ranks[d, np.argsort(values[d], kind="stable")] = np.arange(n)
+
+        perm = np.arange(n)
+        starts = np.array([0])
+        sizes = np.array([n])
+        while True:
+            ordered = values[:, perm]
+            spans = (np.maximum.reduceat(ordered, starts, axis=1) - np.minimum.reduceat(ordered, starts, axis=1)) / scale
+            dims = spans.argmax(axis=0)
+            split = (sizes >= 2 * self.k) & (spans.max(axis=0) > 0)
+            if not split.any():
+                break
+
+            # Sort the records of every splitting partition by their rank in its chosen dimension
+            segment = np.repeat(np.arange(len(sizes)), sizes)
+            moving = split[segment]
+            positions = np.flatnonzero(moving)
+            keys = segment[positions] * np.int64(n) + ranks[dims[segment[positions]], perm[positions]]
+            perm[positions] = perm[positions][np.argsort(keys)]
+
+            halves = sizes // 2
+            new_starts = np.stack([starts, starts + halves], axis=1)
+            new_sizes = np.stack([halves, sizes - halves], axis=1)
+            starts = np.where(split[:, None], new_starts, np.stack([starts, starts], axis=1)).ravel()
+            sizes = np.where(split[:, None], new_sizes, np.stack([sizes, np.zeros_like(sizes)], axis=1)).ravel()
+            keep = sizes > 0
+            starts, sizes = starts[keep], sizes[keep]
+
+        labels = np.empty(n, dtype=np.int64)
+        labels[perm] = np.repeat(np.arange(len(sizes)), sizes)
+        ordered = values[:, perm]
+        return {
+            "labels": labels,
+            "sizes": sizes,
+            "minimums": np.minimum.reduceat(ordered, starts, axis=1),
+            "maximums": np.maximum.reduceat(ordered, starts, axis=1),
+            "distinct": self._distinct(columns, labels, len(sizes)),
+        }
+
+    @staticmethod
+    def _distinct(columns: List[QuasiIdentifier], labels: np.ndarray, num_partitions: int) -> Dict[str, Tuple]:
+        """Sorted distinct category codes of every partition, per categorical column
+
+        Returned as ``(offsets, codes)``: partition p holds ``codes[offsets[p]:offsets[p + 1]]``.
+        """
+        distinct = {}
+        for column in columns:
+            if column.numeric:
+                continue
+            width = len(column.categories)
+            pairs = np.unique(labels * width + column.values.astype(np.int64))
+            owners, codes = np.divmod(pairs, width)
+            distinct[column.name] = (np.searchsorted(owners, np.arange(num_partitions + 1)), codes)
+        return distinct
+
+    @staticmethod
+    def _generalized_values(column: QuasiIdentifier, index: int, partition: Dict) -> pa.Array:
+        """Generalized value of every partition: ``[low, high]`` or ``{a, b}``, or the value itself"""
+        if column.numeric:
+            bounds = [partition["minimums"][index], partition["maximums"][index]]
+            if column.integer:
+                bounds = [bound.astype(np.int64) for bound in bounds]
+            low, high = (pc.cast(pa.array(bound), pa.string()) for bound in bounds)
+            ranges = pc.binary_join_element_wise("[", low, ", ", high, "]", "")
+            return pc.if_else(pa.array(bounds[0] == bounds[1]), low, ranges)
+
+        offsets, codes = partition["distinct"][column.name]
+        names = pa.array([str(category) for category in column.categories], pa.string()).take(pa.array(codes))
+        joined = pc.binary_join(pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), names), ", ")
+        sets = pc.binary_join_element_wise("{", joined, "}", "")
+        return pc.if_else(pa.array(np.diff(offsets) == 1), joined, sets)
+
+    def _generalize_batch(self, table: pa.Table, columns: List[QuasiIdentifier], partition: Optional[Dict], offset: int):
+        """Replace quasi-identifier columns with dictionary-encoded generalized values"""
+        if partition is not None and "dictionaries" not in partition:
+            partition["dictionaries"] = {
+                column.name: self._generalized_values(column, i, partition)
+                for i, column in enumerate(columns)
+            }
+
+        labels = partition["labels"][offset:offset + table.num_rows] if partition is not None else np.empty(0, np.int64)
+        for column in columns:
+            dictionary = partition["dictionaries"][column.name] if partition is not None else pa.array([], pa.string())
+            generalized = pa.DictionaryArray.from_arrays(pa.array(labels.astype(np.int32), pa.int32()), dictionary)
+            table = table.set_column(table.schema.get_field_index(column.name), column.name, generalized)
+        return table
+
+    def _report(self, columns: List[QuasiIdentifier], partition: Optional[Dict], num_rows: int, start_time: float) -> Dict:
+        """Information loss as the normalized certainty penalty (NCP), per column and overall
+
+        NCP is 0 for an untouched value and 1 for a value generalized to the
+        column's whole domain: a range's width over the column's range, or a
+        set's size minus one over the number of categories minus one.
+        """
+        report = {
+            "k": self.k,
+            "records": num_rows,
+            "suppressed": num_rows if partition is None else 0,
+            "partitions": 0,
+            "min_partition_size": 0,
+            "mean_partition_size": 0.0,
+            "discernibility": num_rows * num_rows if partition is None else 0,
+            "ncp": 1.0 if partition is None else 0.0,
+            "ncp_per_column": {},
+            "seconds": time.perf_counter() - start_time,
+        }
+        if partition is None:
+            return report
+
+        sizes = partition["sizes"]
+        for i, column in enumerate(columns):
+            width = column.domain_width
+            if width == 0:
+                penalty = np.zeros(len(sizes))
+            elif column.numeric:
+                penalty = (partition["maximums"][i] - partition["minimums"][i]) / width
+            else:
+                offsets, _ = partition["distinct"][column.name]
+                penalty = (np.diff(offsets) - 1) / width
+            report["ncp_per_column"][column.name] = float((penalty * sizes).sum() / num_rows)
+
+        report.update(
+            partitions=len(sizes),
+            min_partition_size=int(sizes.min()),
+            mean_partition_size=float(sizes.mean()),
+            discernibility=int((sizes.astype(np.int64) ** 2).sum()),
+            ncp=float(np.mean(list(report["ncp_per_column"].values()))) if columns else 0.0,
+        )
+        return report
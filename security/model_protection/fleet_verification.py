@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import torch
+
+from watermarking import (
+    Z_THRESHOLD,
+    checkpoint_shapes,
+    checkpoint_tensors,
+    default_layers,
+    verify_checkpoint,
+    write_private,
+)
+
+logger = logging.getLogger("model-protection.fleet-verification")
+
+# Append-only JSON-lines file of watermark records. It holds the secret keys, so there is no
+# default location: set it explicitly, outside model directories and anything that gets shipped
+WATERMARK_KEY_INDEX = os.environ.get("WATERMARK_KEY_INDEX") or None
+# Rows hashed per weight matrix for a checkpoint fingerprint
+FINGERPRINT_ROWS_PER_LAYER = int(os.environ.get("FINGERPRINT_ROWS_PER_LAYER", 2))
+# Fingerprint rows a checkpoint must share with a watermarked model to be fully verified against its key
+PREFILTER_MIN_MATCHES = int(os.environ.get("PREFILTER_MIN_MATCHES", 1))
+
+def key_id(watermark_key: str) -> str:
+    """Public identifier of a watermark key, safe to put in reports"""
+    return hashlib.blake2b(watermark_key.encode(), digest_size=8).hexdigest()
+
+def fingerprint_checkpoint(path: str) -> List[str]:
+    """Hashes of a few sampled rows of every weight matrix in a safetensors checkpoint
+
+    Rows are picked from the tensor's shape alone, so any checkpoint of the
+    same architecture samples the same rows, and values are hashed as
+    bfloat16 so copies re-saved in another float precision still match.
+    Layer names are left out of the hash, so renamed prefixes match too.
+    Reads a few KB per layer.
+    """
+    from safetensors import safe_open
+
+    files = checkpoint_tensors(path)
+    shapes, floating = checkpoint_shapes(files)
+    fingerprints = []
+    for name in default_layers(shapes, floating):
+        shape = shapes[name]
+        with safe_open(files[name], framework="pt") as f:
+            tensor_slice = f.get_slice(name)
+            for sample in range(FINGERPRINT_ROWS_PER_LAYER):
+                digest = hashlib.blake2b(f"{shape}\0{sample}".encode(), digest_size=8).digest()
+                row = int.from_bytes(digest, "little") % shape[0]
+                values = tensor_slice[row:row + 1].to(torch.bfloat16).view(torch.int16).numpy()
+                fingerprints.append(hashlib.blake2b(values.tobytes(), digest_size=8).hexdigest())
+    return fingerprints
+
+class WatermarkKeyIndex:
+    """Known watermark keys with the layers they mark and fingerprints of the models carrying them
+
+    Records are appended to a JSON-lines file, which holds the raw keys and
+    is kept readable by its owner only. Fingerprint hashes are indexed in
+    memory, so matching a checkpoint's fingerprint against every known key
+    is one dict lookup per sampled row.
+    """
+
+    def __init__(self, path: str):
+        if not path:
+            raise ValueError("A watermark key index path is required (or set WATERMARK_KEY_INDEX)")
+        self.path = path
+        self.records: Dict[str, Dict] = {}
+        self._fingerprints: Dict[str, set] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        self._index(json.loads(line))
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def _index(self, record: Dict):
+        self.records[record["key_id"]] = record
+        for fingerprint in record["fingerprints"]:
+            self._fingerprints.setdefault(fingerprint, set()).add(record["key_id"])
+
+    def register(
+        self,
+        checkpoint: str,
+        watermark_key: str,
+        layers: Optional[List[str]] = None,
+        strength: Optional[float] = None,
+        source_model: Optional[str] = None,
+    ) -> Dict:
+        """Record a watermarked safetensors checkpoint and the key it was marked with"""
+        record = {
+            "key_id": key_id(watermark_key),
+            "watermark_key": watermark_key,
+            "model": checkpoint,
+            "source_model": source_model,
+            "layers": layers,
+            "strength": strength,
+            "fingerprints": fingerprint_checkpoint(checkpoint),
+            "timestamp": time.time(),
+        }
+        write_private(self.path, json.dumps(record) + "\n", append=True)
+        self._index(record)
+        logger.info(f"Registered watermark key {record['key_id']} for {checkpoint}")
+        return record
+
+    def register_info_file(self, info_path: str) -> Dict:
+        """Import a watermark_info.json written by watermark_model"""
+        with open(info_path) as f:
+            info = json.load(f)
+        return self.register(
+            info["watermarked_model"], info["watermark_key"], info.get("layers"), info.get("strength"),
+            info.get("original_model"),
+        )
+
+    def candidates(self, fingerprints: Iterable[str], min_matches: int = PREFILTER_MIN_MATCHES) -> Dict[str, int]:
+        """Key ids whose models share at least ``min_matches`` fingerprint rows, with the match counts"""
+        matches = Counter()
+        for fingerprint in set(fingerprints):
+            matches.update(self._fingerprints.get(fingerprint, ()))
+        return {key: count for key, count in matches.most_common() if count >= min_matches}
+
+def find_checkpoints(roots: Iterable[str]) -> List[str]:
+    """Safetensors checkpoints (directories or single files) under the given paths"""
+    checkpoints = []
+    for root in roots:
+        if root.endswith(".safetensors") or os.path.exists(os.path.join(root, "model.safetensors")) \
+                or os.path.exists(os.path.join(root, "model.safetensors.index.json")):
+            checkpoints.append(root)
+            continue
+        for directory, _, files in os.walk(root):
+            if "model.safetensors" in files or "model.safetensors.index.json" in files:
+                checkpoints.append(directory)
+    return sorted(set(checkpoints))
+
+def _fingerprint_task(path: str) -> Dict:
+    start_time = time.perf_counter()
+    try:
+        return {"path": path, "fingerprints": fingerprint_checkpoint(path), "seconds": time.perf_counter() - start_time}
+    except Exception as e:
+        return {"path": path, "error": f"{type(e).__name__}: {e}", "seconds": time.perf_counter() - start_time}
+
+def _verify_task(path: str, record: Dict, threshold: float) -> Dict:
+    try:
+        # One thread per task; the process pool already spreads tasks over the cores
+        result = verify_checkpoint(path, record["watermark_key"], record["layers"], threshold, workers=1)
+    except Exception as e:
+        return {"path": path, "key_id": record["key_id"], "error": f"{type(e).__name__}: {e}"}
+    return {
+        "path": path,
+        "key_id": record["key_id"],
+        "model": record["model"],
+        "z": result["z"],
+        "p_value": result["p_value"],
+        "detected": result["detected"],
+        "layers": result["layers"],
+        "missing_layers": result["missing_layers"],
+        "seconds": result["seconds"],
+    }
+
+def scan_checkpoints(
+    paths: Iterable[str],
+    key_index: WatermarkKeyIndex,
+    workers: Optional[int] = None,
+    threshold: float = Z_THRESHOLD,
+    min_matches: int = PREFILTER_MIN_MATCHES,
+    verify_all: bool = False,
+    prefilter_only: bool = False,
+) -> Dict:
+    """Check every checkpoint under ``paths`` for any known watermark and return a JSON-serializable report
+
+    Each checkpoint is fingerprinted first. One that shares fingerprint rows
+    with watermarked models is fully (streaming, blind) verified against
+    just their keys; one that matches none, e.g. a leaked copy fine-tuned
+    in the sampled rows, is verified against every key. Both stages run on
+    a process pool. ``prefilter_only`` skips checkpoints without
+    fingerprint matches, a shortcut that misses such copies;
+    ``verify_all`` verifies every checkpoint against every key.
+    """
+    checkpoints = find_checkpoints(paths)
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        fingerprinted = list(pool.map(_fingerprint_task, checkpoints))
+        fingerprint_seconds = time.perf_counter() - start_time
+
+        results = {}
+        tasks = []
+        for entry in fingerprinted:
+            result = {"path": entry["path"], "error": entry.get("error"), "candidates": [], "verifications": []}
+            if "fingerprints" in entry:
+                result["fingerprint_rows"] = len(entry["fingerprints"])
+                candidates = key_index.candidates(entry["fingerprints"], min_matches)
+                result["candidates"] = [
+                    {"key_id": key, "model": key_index.records[key]["model"], "matched_rows": count}
+                    for key, count in candidates.items()
+                ]
+                if verify_all or not (candidates or prefilter_only):
+                    keys = list(key_index.records)
+                else:
+                    keys = list(candidates)
+                tasks.extend((entry["path"], key_index.records[key]) for key in keys)
+            results[entry["path"]] = result
+
+        verify_start = time.perf_counter()
+        futures = [pool.submit(_verify_task, path, record, threshold) for path, record in tasks]
+        for future in futures:
+            verification = future.result()
+            results[verification["path"]]["verifications"].append(verification)
+        verify_seconds = time.perf_counter() - verify_start
+
+    for result in results.values():
+        result["detected"] = any(verification.get("detected") for verification in result["verifications"])
+        result["detected_keys"] = [
+            verification["key_id"] for verification in result["verifications"] if verification.get("detected")
+        ]
+
+    report = {
+        "keys": len(key_index),
+        "checkpoints": len(checkpoints),
+        "prefilter_hits": sum(bool(result["candidates"]) for result in results.values()),
+        "verifications": len(tasks),
+        "detected": sum(result["detected"] for result in results.values()),
+        "errors": sum(bool(result["error"]) for result in results.values()),
+        "threshold": threshold,
+        "min_matches": min_matches,
+        "verify_all": verify_all,
+        "prefilter_only": prefilter_only,
+        "seconds": {
+            "fingerprint": fingerprint_seconds,
+            "verify": verify_seconds,
+            "total": time.perf_counter() - start_time,
+        },
+        "results": [results[path] for path in checkpoints],
+    }
+    logger.info(
+        f"Scanned {report['checkpoints']} checkpoints against {report['keys']} keys: "
+        f"{report['prefilter_hits']} prefilter hits, {report['verifications']} verifications, "
+        f"{report['detected']} watermarked"
+    )
+    return report
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Find watermarked copies among many model checkpoints")
+    parser.add_argument(
+        "--index",
+        default=WATERMARK_KEY_INDEX,
+        required=WATERMARK_KEY_INDEX is None,
+        help="Watermark key index (JSON lines; default: WATERMARK_KEY_INDEX)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    register = commands.add_parser("register", help="Add a watermarked checkpoint and its key to the index")
+    register.add_argument("checkpoint", nargs="?", help="Watermarked safetensors checkpoint")
+    register.add_argument("--key", help="Watermark key the checkpoint was marked with")
+    register.add_argument("--info", help="Import a watermark_info.json instead")
+
+    scan = commands.add_parser("scan", help="Verify every checkpoint under the given paths")
+    scan.add_argument("paths", nargs="+", help="Checkpoint directories or registry roots to search")
+    scan.add_argument("--workers", type=int, default=None, help="Worker processes (default: every CPU)")
+    scan.add_argument("--threshold", type=float, default=Z_THRESHOLD, help="z-score above which a watermark is detected")
+    scan.add_argument("--min-matches", type=int, default=PREFILTER_MIN_MATCHES)
+    scan.add_argument("--verify-all", action="store_true", help="Verify every checkpoint against every key")
+    scan.add_argument(
+        "--prefilter-only",
+        action="store_true",
+        help="Only verify checkpoints matching a fingerprint (faster, misses copies fine-tuned in the sampled rows)",
+    )
+    scan.add_argument("--output", help="Path for the JSON report (default: stdout)")
+    args = parser.parse_args()
+
+    index = WatermarkKeyIndex(args.index)
+    if args.command == "register":
+        if args.info:
+            index.register_info_file(args.info)
+        elif args.checkpoint and args.key:
+            index.register(args.checkpoint, args.key)
+        else:
+            parser.error("register needs a checkpoint and --key, or --info")
+    else:
+        report = scan_checkpoints(
+            args.paths, index, args.workers, args.threshold, args.min_matches, args.verify_all, args.prefilter_only
+        )
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
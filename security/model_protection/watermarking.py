@@ -1,137 +1,355 @@
-
 import os
+import json
+import math
 import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
 import torch
-import random
-import numpy as np
 from transformers import AutoModelForSequenceClassification
 
-class ModelWatermarker:
-    """Implementation of model watermarking for LLM protection"""
+logger = logging.getLogger("model-protection.watermarking")
 
-    def __init__(self, model, watermark_key=None):
-        self.model = model
-        self.watermark_key = watermark_key or os.urandom(16).hex()
-        self.watermarked = False
+# Watermark added to each layer, as a fraction of the layer's weight standard deviation.
+# Detection z is about strength * sqrt(watermarked weights), so at 0.01 a model needs
+# (Z_THRESHOLD / 0.01) ** 2 = 160k watermarked weights to be detectable at all; use
+# strength_for() to size the watermark of smaller models
+WATERMARK_STRENGTH = 0.01
+# Combined z-score above which a checkpoint is considered watermarked (one-sided p < 3.2e-5)
+Z_THRESHOLD = 4.0
+# Weights generated, read and scored at a time; bounds the memory verification needs per worker
+CHUNK_ELEMENTS = 1 << 18
+# Smallest weight matrix that gets a watermark
+MIN_LAYER_ELEMENTS = 1024
 
-    def apply_watermark(self, seed=None):
-        """Apply a watermark to the model by subtly modifying specific weights"""
-        if self.watermarked:
-            return False
+# Safetensors dtypes that can carry a watermark
+FLOAT_DTYPES = ("F16", "BF16", "F32", "F64")
 
-        # Set seed for reproducibility, but use the watermark key to make it unique
-        if seed is None:
-            # Convert watermark_key to an integer seed
-            seed = int(self.watermark_key[:8], 16)
+_BIT_SHIFTS = torch.arange(8, dtype=torch.uint8)
 
-        # Set the seeds
-        torch.manual_seed(seed)
-        random.seed(seed)
-        np.random.seed(seed)
+def strength_for(elements: int, target_z: float = 2 * Z_THRESHOLD) -> float:
+    """Watermark strength at which ``elements`` watermarked weights verify at about ``target_z``"""
+    return target_z / math.sqrt(elements)
 
-        # Get model parameters that will be watermarked
-        # For this example, we'll watermark the last classification layer
-        if hasattr(self.model, 'score'):
-            target_layer = self.model.score
-            print(f"Watermarking classification layer with shape {target_layer.weight.shape}")
+def default_layers(shapes: Dict[str, Tuple[int, ...]], floating: Iterable[str]) -> List[str]:
+    """Names of the weight matrices (floating point, 2+ dims) worth watermarking, in checkpoint order"""
+    floating = set(floating)
+    return [
+        name for name, shape in shapes.items()
+        if name in floating and len(shape) >= 2 and math.prod(shape) >= MIN_LAYER_ELEMENTS
+    ]
 
-            # Backup original weights
-            original_weights = target_layer.weight.clone().detach()
+def model_layers(parameters: Dict[str, torch.Tensor]) -> List[str]:
+    shapes = {name: tuple(parameter.shape) for name, parameter in parameters.items()}
+    return default_layers(shapes, [name for name, parameter in parameters.items() if parameter.is_floating_point()])
 
-            # Add a very small watermark pattern
-            # The pattern is deterministic based on the seed but hard to detect
-            watermark_pattern = torch.randn_like(target_layer.weight) * 1e-5
+def chunk_rows(shape: Tuple[int, ...]) -> int:
+    """Rows of a layer per chunk; chunking depends only on the shape, so embedding and verification agree"""
+    row_elements = math.prod(shape[1:])
+    return max(1, CHUNK_ELEMENTS // row_elements)
 
-            # Apply the watermark
-            with torch.no_grad():
-                target_layer.weight.add_(watermark_pattern)
+def watermark_pattern(watermark_key: str, name: str, chunk: int, shape: Tuple[int, ...]) -> torch.Tensor:
+    """The ±1 pattern for one chunk of a layer, from its own generator seeded by (key, layer, chunk)"""
+    digest = hashlib.blake2b(f"{name}\0{chunk}".encode(), digest_size=8, key=watermark_key.encode()[:64])
+    generator = torch.Generator()
+    generator.manual_seed(int.from_bytes(digest.digest(), "little") >> 1)
+    # Draw random bytes and unpack their bits: 8 signs per draw, much cheaper than randint per element
+    elements = math.prod(shape)
+    random_bytes = torch.randint(0, 256, ((elements + 7) // 8,), generator=generator, dtype=torch.uint8)
+    bits = (random_bytes.unsqueeze(-1) >> _BIT_SHIFTS) & 1
+    return bits.flatten()[:elements].view(shape).to(torch.float32).mul_(2).sub_(1)
 
-            self.watermarked = True
+def iter_chunks(shape: Tuple[int, ...]) -> Iterable[Tuple[int, int, int]]:
+    """(chunk, start row, stop row) for each chunk of a layer"""
+    rows = chunk_rows(shape)
+    for chunk, start in enumerate(range(0, shape[0], rows)):
+        yield chunk, start, min(shape[0], start + rows)
 
-            # Calculate the difference
-            diff = torch.norm(target_layer.weight - original_weights).item()
-            print(f"Watermark applied. L2 difference: {diff}")
+def layer_std(weight: torch.Tensor) -> float:
+    """Standard deviation of a layer's weights, accumulated chunk by chunk in float64"""
+    total, squares = 0.0, 0.0
+    for _, start, stop in iter_chunks(tuple(weight.shape)):
+        rows = weight[start:stop].to(torch.float64)
+        total += rows.sum().item()
+        squares += rows.pow(2).sum().item()
+    mean = total / weight.numel()
+    return math.sqrt(max(0.0, squares / weight.numel() - mean ** 2))
 
-            return True
-        else:
-            print("Could not find appropriate layer to watermark")
-            return False
+def score_layer(watermark_key: str, name: str, shape: Tuple[int, ...], read_rows: Callable[[int, int], torch.Tensor]) -> Dict:
+    """z-score of one layer's correlation with its watermark pattern
 
-    def verify_watermark(self, suspected_model, threshold=1e-6):
-        """Verify if the suspected model contains our watermark"""
-        if not self.watermarked:
-            print("Original model not watermarked")
-            return False
+    Without a watermark, sum(W * P) over a random ±1 pattern P has mean 0
+    and variance sum(W ** 2) whatever the weights are, so
+    ``z = sum(W * P) / sqrt(sum(W ** 2))`` is standard normal. A watermark of
+    ``strength * std`` raises it to about ``strength * sqrt(elements)``.
+    Reads one chunk of rows at a time through ``read_rows(start, stop)``.
+    """
+    correlation, energy = 0.0, 0.0
+    for chunk, start, stop in iter_chunks(shape):
+        rows = read_rows(start, stop).to(torch.float32)
+        pattern = watermark_pattern(watermark_key, name, chunk, tuple(rows.shape))
+        correlation += torch.dot(rows.flatten(), pattern.flatten()).item()
+        energy += rows.pow(2).sum(dtype=torch.float64).item()
+    elements = math.prod(shape)
+    return {"elements": elements, "z": correlation / math.sqrt(energy) if energy > 0 else 0.0}
 
-        # Set seed for reproducibility, using the same watermark key
-        seed = int(self.watermark_key[:8], 16)
-        torch.manual_seed(seed)
-        random.seed(seed)
-        np.random.seed(seed)
+def combine_scores(scores: Dict[str, Dict], threshold: float = Z_THRESHOLD) -> Dict:
+    """Weighted Stouffer combination of layer z-scores (weights sqrt(elements)), standard normal without a watermark"""
+    total = sum(score["elements"] for score in scores.values())
+    z = sum(score["z"] * math.sqrt(score["elements"]) for score in scores.values()) / math.sqrt(total) if total else 0.0
+    return {
+        "z": z,
+        "p_value": 0.5 * math.erfc(z / math.sqrt(2)),
+        "threshold": threshold,
+        "detected": z > threshold,
+        "layers": len(scores),
+        "elements": total,
+    }
 
-        # Generate the expected watermark pattern
-        if hasattr(self.model, 'score') and hasattr(suspected_model, 'score'):
-            target_layer = self.model.score
-            suspected_layer = suspected_model.score
+def checkpoint_tensors(path: str) -> Dict[str, str]:
+    """Safetensors file holding each tensor of a checkpoint (a directory, sharded or not, or one file)"""
+    if path.endswith(".safetensors"):
+        files = [path]
+    else:
+        index_path = os.path.join(path, "model.safetensors.index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                return {name: os.path.join(path, file) for name, file in json.load(f)["weight_map"].items()}
+        files = [os.path.join(path, "model.safetensors")]
 
-            # Create the watermark pattern
-            watermark_pattern = torch.randn_like(target_layer.weight) * 1e-5
+    from safetensors import safe_open
+    tensors = {}
+    for file in files:
+        if not os.path.exists(file):
+            raise FileNotFoundError(f"No safetensors checkpoint at {path}")
+        with safe_open(file, framework="pt") as f:
+            tensors.update((name, file) for name in f.keys())
+    return tensors
 
-            # Get watermarked weights
-            watermarked_weights = target_layer.weight.clone().detach()
-            suspected_weights = suspected_layer.weight.clone().detach()
+def checkpoint_shapes(files: Dict[str, str]) -> Tuple[Dict[str, Tuple[int, ...]], List[str]]:
+    """Shape of every tensor in a checkpoint and the names of the floating-point ones, from the headers only"""
+    from safetensors import safe_open
 
-            # Remove the watermark to get the original weights
-            original_weights = watermarked_weights - watermark_pattern
+    shapes, floating = {}, []
+    for file in sorted(set(files.values())):
+        with safe_open(file, framework="pt") as f:
+            for name in f.keys():
+                tensor_slice = f.get_slice(name)
+                shapes[name] = tuple(tensor_slice.get_shape())
+                if tensor_slice.get_dtype() in FLOAT_DTYPES:
+                    floating.append(name)
+    return shapes, floating
 
-            # Calculate correlation between suspected model and both watermarked and original
-            corr_with_watermarked = torch.nn.functional.cosine_similarity(
-                watermarked_weights.flatten(), suspected_weights.flatten(), dim=0
-            ).item()
+def resolve_layer(name: str, names: Iterable[str]) -> Optional[str]:
+    """Checkpoint name of a watermarked layer; base-model checkpoints omit the task model's prefix and vice versa"""
+    names = set(names)
+    if name in names:
+        return name
+    for candidate in names:
+        if candidate.split(".", 1)[-1] == name or name.split(".", 1)[-1] == candidate:
+            return candidate
+    return None
 
-            corr_with_original = torch.nn.functional.cosine_similarity(
-                original_weights.flatten(), suspected_weights.flatten(), dim=0
-            ).item()
+def verify_checkpoint(
+    path: str,
+    watermark_key: str,
+    layers: Optional[Iterable[str]] = None,
+    threshold: float = Z_THRESHOLD,
+    workers: Optional[int] = None,
+) -> Dict:
+    """Blindly test a safetensors checkpoint for a watermark, streaming it chunk by chunk
 
-            # Check if suspected is closer to watermarked than to original
-            watermark_detected = (corr_with_watermarked - corr_with_original) > threshold
+    Needs only the key, not the original model. ``layers`` are the
+    watermarked layer names (every weight matrix by default). Layers are
+    scored on ``workers`` threads, each holding one chunk of weights and its
+    pattern at a time, so memory stays at a few MB per worker whatever the
+    checkpoint size.
+    """
+    from safetensors import safe_open
 
-            print(f"Correlation with watermarked: {corr_with_watermarked}")
-            print(f"Correlation with original: {corr_with_original}")
-            print(f"Watermark detected: {watermark_detected}")
+    files = checkpoint_tensors(path)
+    shapes, floating = checkpoint_shapes(files)
+    if layers is None:
+        layers = default_layers(shapes, floating)
+    matched = {name: resolve_layer(name, shapes) for name in layers}
+    missing = [name for name, checkpoint_name in matched.items() if checkpoint_name is None]
 
-            return watermark_detected
-        else:
-            print("Could not find appropriate layer to verify watermark")
+    def score(name: str) -> Tuple[str, Dict]:
+        checkpoint_name = matched[name]
+        with safe_open(files[checkpoint_name], framework="pt") as f:
+            tensor_slice = f.get_slice(checkpoint_name)
+            return name, score_layer(watermark_key, name, shapes[checkpoint_name], lambda start, stop: tensor_slice[start:stop])
+
+    start_time = time.perf_counter()
+    names = [name for name in matched if matched[name] is not None]
+    with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as pool:
+        scores = dict(pool.map(score, names))
+
+    result = combine_scores(scores, threshold)
+    result.update(path=path, missing_layers=missing, seconds=time.perf_counter() - start_time, layer_scores=scores)
+    logger.info(f"Watermark verification of {path}: z={result['z']:.2f} over {result['layers']} layers, detected={result['detected']}")
+    return result
+
+def verify_model(
+    model,
+    watermark_key: str,
+    layers: Optional[Iterable[str]] = None,
+    threshold: float = Z_THRESHOLD,
+    workers: Optional[int] = None,
+) -> Dict:
+    """Blindly test an in-memory model for a watermark, scoring layers in parallel"""
+    parameters = dict(model.named_parameters())
+    if layers is None:
+        layers = model_layers(parameters)
+    matched = {name: resolve_layer(name, parameters) for name in layers}
+
+    def score(name: str) -> Tuple[str, Dict]:
+        weight = parameters[matched[name]].detach()
+        return name, score_layer(watermark_key, name, tuple(weight.shape), lambda start, stop: weight[start:stop])
+
+    with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as pool:
+        scores = dict(pool.map(score, [name for name in matched if matched[name] is not None]))
+
+    result = combine_scores(scores, threshold)
+    result.update(missing_layers=[name for name in matched if matched[name] is None], layer_scores=scores)
+    logger.info(f"Watermark verification: z={result['z']:.2f} over {result['layers']} layers, detected={result['detected']}")
+    return result
+
+class ModelWatermarker:
+    """Keyed watermark spread across many layers of a model, verifiable without the original weights
+
+    Each watermarked layer gets ``strength * std(layer) * P`` added, where P
+    is a ±1 pattern drawn chunk by chunk from a ``torch.Generator`` seeded
+    by (key, layer name, chunk), so no global RNG state is touched and any
+    chunk can be regenerated on its own. Verification correlates a suspect
+    model's weights with the patterns (see ``score_layer``); a checkpoint on
+    disk is streamed with ``verify_checkpoint``.
+    """
+
+    def __init__(self, model, watermark_key=None, strength: float = WATERMARK_STRENGTH, layers: Optional[List[str]] = None):
+        self.model = model
+        self.watermark_key = watermark_key or os.urandom(16).hex()
+        self.strength = strength
+        self.layers = layers
+        self.watermarked = False
+
+    def target_layers(self) -> List[str]:
+        if self.layers is not None:
+            return self.layers
+        return model_layers(dict(self.model.named_parameters()))
+
+    def apply_watermark(self):
+        """Add the watermark to every target layer in place, one chunk at a time"""
+        if self.watermarked:
             return False
 
-def watermark_model(model_path, output_path=None, watermark_key=None):
-    """Utility function to watermark a saved model"""
+        parameters = dict(self.model.named_parameters())
+        self.layers = self.target_layers()
+        if not self.layers:
+            logger.warning("Could not find layers to watermark")
+            return False
+
+        elements, squared_change = 0, 0.0
+        with torch.no_grad():
+            for name in self.layers:
+                weight = parameters[name]
+                std = layer_std(weight)
+                scale = self.strength * std
+                for chunk, start, stop in iter_chunks(tuple(weight.shape)):
+                    rows = weight[start:stop]
+                    pattern = watermark_pattern(self.watermark_key, name, chunk, tuple(rows.shape))
+                    rows.copy_(rows.to(torch.float32).add_(pattern, alpha=scale))
+                elements += weight.numel()
+                squared_change += scale ** 2 * weight.numel()
+
+        self.watermarked = True
+        if self.expected_z(elements) <= Z_THRESHOLD:
+            logger.warning(
+                f"Watermark on {elements} weights at strength {self.strength} has expected z-score "
+                f"{self.expected_z(elements):.1f}, below the detection threshold {Z_THRESHOLD}; "
+                f"use at least strength {strength_for(elements, Z_THRESHOLD):.3g}"
+            )
+        logger.info(
+            f"Watermark applied to {len(self.layers)} layers ({elements} weights). "
+            f"L2 difference: {math.sqrt(squared_change):.4g}, expected z-score: {self.expected_z(elements):.1f}"
+        )
+        return True
+
+    def expected_z(self, elements: Optional[int] = None) -> float:
+        if elements is None:
+            parameters = dict(self.model.named_parameters())
+            elements = sum(parameters[name].numel() for name in self.target_layers())
+        return self.strength * math.sqrt(elements)
+
+    def verify_watermark(self, suspected_model, threshold=Z_THRESHOLD, workers: Optional[int] = None):
+        """Check whether a suspected model (or a safetensors checkpoint path) carries our watermark"""
+        if not self.watermarked:
+            logger.warning("Original model not watermarked")
+            return False
+
+        if isinstance(suspected_model, str):
+            result = verify_checkpoint(suspected_model, self.watermark_key, self.layers, threshold, workers)
+        else:
+            result = verify_model(suspected_model, self.watermark_key, self.layers, threshold, workers)
+        return result["detected"]
+
+def write_private(path: str, text: str, append: bool = False):
+    """Write a file holding watermark keys, readable by its owner only (0o600)"""
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC)
+    fd = os.open(path, flags, 0o600)
+    # The mode passed to open only applies to new files
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+
+def watermark_model(
+    model_path,
+    output_path=None,
+    watermark_key=None,
+    strength: float = WATERMARK_STRENGTH,
+    key_index: Optional[str] = None,
+):
+    """Utility function to watermark a saved model
+
+    As before, the key is saved to ``watermark_info.json`` in the output's
+    parent directory, now with the layers and strength and owner-only
+    permissions. With a ``key_index`` path, the key is also registered
+    there for ``fleet_verification.scan_checkpoints``.
+    """
     # Load the model
     model = AutoModelForSequenceClassification.from_pretrained(model_path)
 
     # Create watermarker
-    watermarker = ModelWatermarker(model, watermark_key)
+    watermarker = ModelWatermarker(model, watermark_key, strength)
 
     # Apply watermark
     success = watermarker.apply_watermark()
 
     if success and output_path:
-        # Save the watermarked model
-        model.save_pretrained(output_path)
-        print(f"Watermarked model saved to {output_path}")
+        # Save as safetensors so verification can stream the checkpoint
+        model.save_pretrained(output_path, safe_serialization=True)
+        logger.info(f"Watermarked model saved to {output_path}")
 
-        # Save watermark key for verification
+        # Save watermark key and layers for verification
         watermark_info = {
             "original_model": model_path,
             "watermarked_model": output_path,
             "watermark_key": watermarker.watermark_key,
+            "strength": watermarker.strength,
+            "layers": watermarker.layers,
+            "expected_z": watermarker.expected_z(),
             "timestamp": time.time()
         }
 
         watermark_dir = os.path.dirname(output_path)
-        with open(os.path.join(watermark_dir, "watermark_info.json"), "w") as f:
-            import json
-            json.dump(watermark_info, f)
+        write_private(os.path.join(watermark_dir, "watermark_info.json"), json.dumps(watermark_info))
+
+        if key_index:
+            from fleet_verification import WatermarkKeyIndex
+            WatermarkKeyIndex(key_index).register(
+                output_path, watermarker.watermark_key, watermarker.layers, watermarker.strength, model_path
+            )
 
     return watermarker.watermark_key if success else None
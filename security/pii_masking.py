@@ -0,0 +1,142 @@
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+# PII patterns by category. Numeric PII consists only of digits and "-"/"."
+# separators, starts with a digit and is at least 9 characters long, so
+# numeric patterns are only run on such runs (found by one cheap scan) rather
+# than tried at every position. Within the numeric alternation the longest
+# formats come first so a card number is not masked as a phone number plus
+# leftover digits.
+NUMERIC_PII_PATTERNS = {
+    "credit_card": (
+        r"(?:4[0-9]{12}(?:[0-9]{3})?|(?:5[1-5][0-9]{2}|222[1-9]|22[3-9][0-9]|2[3-6][0-9]{2}|27[01][0-9]|2720)[0-9]{12}"
+        r"|3[47][0-9]{13}|3(?:0[0-5]|[68][0-9])[0-9]{11}|6(?:011|5[0-9]{2})[0-9]{12}|(?:2131|1800|35\d{3})\d{11})"
+    ),
+    "phone": r"\d{3}[-.]?\d{3}[-.]?\d{4}",
+    "ssn": r"\d{3}[-.]?\d{2}[-.]?\d{4}",
+}
+NUMERIC_CANDIDATE_PATTERN = r"\d[\d.-]{8,}"
+
+# Emails are found from their "@": the domain is matched forwards from it and
+# the local part extended backwards, so texts without an "@" cost one find()
+EMAIL_PATTERN = r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}"
+EMAIL_DOMAIN_PATTERN = r"@[A-Za-z0-9.-]+\.[A-Za-z]{2,}"
+EMAIL_LOCAL_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789._%+-")
+PII_CATEGORIES = tuple(NUMERIC_PII_PATTERNS) + ("email",)
+
+# Below this many texts a process pool costs more than it saves
+MIN_PARALLEL_TEXTS = 256
+
+class PIIMatch(NamedTuple):
+    category: str
+    start: int
+    end: int
+
+class MaskedText(NamedTuple):
+    text: str
+    matches: List[PIIMatch]
+
+    @property
+    def categories(self) -> Dict[str, int]:
+        return dict(Counter(match.category for match in self.matches))
+
+class PIIMasker:
+    """Precompiled PII detector and masker
+
+    Matches are the same as applying each category's regex anywhere in the
+    text, but found in a single pass: candidate digit runs are matched
+    against one combined alternation whose named groups tell the categories
+    apart, and emails are only looked for around each "@". Matches are
+    reported as non-overlapping spans into the original text.
+    """
+
+    def __init__(self, mask_token: str = "[MASKED]", categories: Optional[Iterable[str]] = None):
+        categories = set(categories or PII_CATEGORIES)
+        unknown = categories - set(PII_CATEGORIES)
+        if unknown:
+            raise ValueError(f"Unknown PII categories: {sorted(unknown)}")
+
+        self.mask_token = mask_token
+        self.categories = tuple(category for category in PII_CATEGORIES if category in categories)
+        numeric = [f"(?P<{name}>{pattern})" for name, pattern in NUMERIC_PII_PATTERNS.items() if name in categories]
+        self._numeric = re.compile("|".join(numeric)) if numeric else None
+        self._numeric_candidates = re.compile(NUMERIC_CANDIDATE_PATTERN)
+        self._email_domain = re.compile(EMAIL_DOMAIN_PATTERN) if "email" in categories else None
+
+    def find(self, text: str) -> List[PIIMatch]:
+        """Non-overlapping PII spans in ``text``, in order"""
+        matches = self._find_numeric(text) if self._numeric is not None else []
+        if self._email_domain is None or "@" not in text:
+            return matches
+
+        emails = self._find_emails(text)
+        if not matches or not emails:
+            return matches or emails
+
+        # An email's local part may contain digits matched above; the email wins
+        resolved = []
+        for match in sorted(matches + emails, key=lambda m: (m.start, m.start - m.end)):
+            if resolved and match.start < resolved[-1].end:
+                continue
+            resolved.append(match)
+        return resolved
+
+    def _find_numeric(self, text: str) -> List[PIIMatch]:
+        matches = []
+        for candidate in self._numeric_candidates.finditer(text):
+            offset = candidate.start()
+            for m in self._numeric.finditer(candidate.group()):
+                matches.append(PIIMatch(m.lastgroup, offset + m.start(), offset + m.end()))
+        return matches
+
+    def _find_emails(self, text: str) -> List[PIIMatch]:
+        matches = []
+        last_end = 0
+        at = text.find("@")
+        while at != -1:
+            domain = self._email_domain.match(text, at)
+            if domain is None:
+                at = text.find("@", at + 1)
+                continue
+
+            start = at
+            while start > last_end and text[start - 1] in EMAIL_LOCAL_CHARS:
+                start -= 1
+            if start < at:
+                matches.append(PIIMatch("email", start, domain.end()))
+                last_end = domain.end()
+            at = text.find("@", domain.end() if start < at else at + 1)
+        return matches
+
+    def mask(self, text: str) -> MaskedText:
+        """Replace every PII span with the mask token"""
+        matches = self.find(text)
+        if not matches:
+            return MaskedText(text, matches)
+
+        parts = []
+        position = 0
+        for match in matches:
+            parts.append(text[position:match.start])
+            parts.append(self.mask_token)
+            position = match.end
+        parts.append(text[position:])
+        return MaskedText("".join(parts), matches)
+
+    def mask_batch(self, texts: List[str], processes: Optional[int] = None, chunksize: int = 64) -> List[MaskedText]:
+        """Mask a list of texts, on ``processes`` worker processes for large corpora
+
+        ``processes=None`` masks in this process; ``0`` uses every CPU.
+        """
+        if processes is not None and processes <= 0:
+            processes = os.cpu_count() or 1
+        if not processes or processes == 1 or len(texts) < MIN_PARALLEL_TEXTS:
+            return [self.mask(text) for text in texts]
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            return list(pool.map(self.mask, texts, chunksize=chunksize))
+
+DEFAULT_MASKER = PIIMasker()
@@ -1,85 +1,91 @@
-
 import numpy as np
 import torch
-from typing import List, Dict, Any, Union
+from typing import List, Dict, Any, Optional, Union
+
+from differential_privacy import NoiseMechanism
+from k_anonymity import MondrianAnonymizer
+from pii_masking import DEFAULT_MASKER, MaskedText, PIIMasker
 
 class PrivacyPreservation:
     """Methods for preserving privacy in model inputs and outputs"""
 
     @staticmethod
-    def apply_differential_privacy(data: List[str], epsilon: float = 1.0, delta: float = 1e-5):
-        """Apply differential privacy to text by adding calibrated noise"""
-        # This is a simplified implementation for demonstration purposes
-        # In a real implementation, you would use libraries like TensorFlow Privacy
-
-        # Create a copy of the data
-        private_data = data.copy()
-
-        # Calculate sensitivity - for text data, we use a simplified approach
-        sensitivity = 1.0
-
-        # Calculate noise scale based on epsilon and delta
-        noise_scale = sensitivity * np.sqrt(2 * np.log(1.25 / delta)) / epsilon
-
-        # Apply noise to each data point
-        # For text data, we need to perturb word vectors or embeddings
-        # This is a placeholder for demonstration purposes
-        return private_data
+    def apply_differential_privacy(
+        data: Union[torch.Tensor, np.ndarray, List[List[float]]],
+        epsilon: float = 1.0,
+        delta: float = 1e-5,
+        mechanism: str = "gaussian",
+        clip_norm: float = 1.0,
+    ) -> Union[torch.Tensor, np.ndarray]:
+        """Apply differential privacy to a batch of embeddings or logits by adding calibrated noise"""
+        # Each row is clipped to clip_norm and released with (epsilon, delta)-DP;
+        # text should be embedded first, as raw strings have no useful sensitivity
+        return NoiseMechanism(mechanism, epsilon, delta, clip_norm)(data)
 
     @staticmethod
     def tokenize_and_mask_pii(text: str, mask_token: str = "[MASKED]") -> str:
         """Tokenize text and mask personally identifiable information"""
         # In a real implementation, you would use NER models to identify PII
+        return PrivacyPreservation._masker(mask_token).mask(text).text
 
-        # Example PII patterns (simplified)
-        pii_patterns = [
-            r'\d{3}[-.]?\d{3}[-.]?\d{4}',  # US Phone numbers
-            r'\d{3}[-.]?\d{2}[-.]?\d{4}',  # SSN
-            r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}',  # Email
-            r'(?:4[0-9]{12}(?:[0-9]{3})?|(?:5[1-5][0-9]{2}|222[1-9]|22[3-9][0-9]|2[3-6][0-9]{2}|27[01][0-9]|2720)[0-9]{12}|3[47][0-9]{13}|3(?:0[0-5]|[68][0-9])[0-9]{11}|6(?:011|5[0-9]{2})[0-9]{12}|(?:2131|1800|35\d{3})\d{11})'  # Credit card
-        ]
-
-        # Import regex here to avoid top-level dependency
-        import re
-
-        # Apply masking
-        masked_text = text
-        for pattern in pii_patterns:
-            masked_text = re.sub(pattern, mask_token, masked_text)
+    @staticmethod
+    def mask_pii_batch(
+        texts: List[str], mask_token: str = "[MASKED]", processes: Optional[int] = None
+    ) -> List[MaskedText]:
+        """Mask PII in many texts, reporting the category and span of every match"""
+        return PrivacyPreservation._masker(mask_token).mask_batch(texts, processes=processes)
 
-        return masked_text
+    @staticmethod
+    def _masker(mask_token: str) -> PIIMasker:
+        return DEFAULT_MASKER if mask_token == DEFAULT_MASKER.mask_token else PIIMasker(mask_token)
 
     @staticmethod
     def perform_k_anonymization(dataset: List[Dict[str, Any]], k: int = 5, sensitive_keys: List[str] = None):
         """Perform k-anonymization on a dataset"""
-        # This is a simplified implementation for demonstration purposes
+        import pyarrow as pa
 
         if sensitive_keys is None:
             # Default sensitive keys
             sensitive_keys = ["name", "email", "phone", "address"]
 
-        # Group records by non-sensitive attributes
-        from collections import defaultdict
-        groups = defaultdict(list)
-
-        for record in dataset:
-            # Create a key from non-sensitive attributes
-            non_sensitive_values = tuple(
-                value for key, value in record.items() if key not in sensitive_keys
-            )
-            groups[non_sensitive_values].append(record)
-
-        # Check if groups satisfy k-anonymity
-        k_anonymized_dataset = []
-        suppressed_groups = []
+        if not dataset:
+            return [], []
+
+        # Every key seen in any record is a column; records lacking one hold None for it
+        keys = list(dict.fromkeys(key for record in dataset for key in record))
+        records = [{key: record.get(key) for key in keys} for record in dataset]
+
+        # Non-sensitive attributes are the quasi-identifiers; Mondrian partitioning
+        # generalizes them until every group has at least k records, so records
+        # are only suppressed when the whole dataset has fewer than k
+        quasi_identifiers = [key for key in keys if key not in sensitive_keys]
+        if not quasi_identifiers:
+            return records, []
+
+        # Only the quasi-identifiers go through Arrow; sensitive values are copied back unchanged
+        table = pa.table({
+            key: PrivacyPreservation._quasi_identifier_column([record[key] for record in records])
+            for key in quasi_identifiers
+        })
+        anonymized, report = MondrianAnonymizer(k, quasi_identifiers).anonymize_table(table)
+        if report["suppressed"]:
+            return [], records
+
+        generalized = anonymized.to_pydict()
+        for i, record in enumerate(records):
+            for key in quasi_identifiers:
+                record[key] = generalized[key][i]
+        return records, []
 
-        for group_key, group_records in groups.items():
-            if len(group_records) >= k:
-                k_anonymized_dataset.extend(group_records)
-            else:
-                suppressed_groups.extend(group_records)
-
-        # For demo purposes, suppress records that don't satisfy k-anonymity
-        # In a real implementation, you would generalize attributes to merge groups
-
-        return k_anonymized_dataset, suppressed_groups
+    @staticmethod
+    def _quasi_identifier_column(values: List[Any]):
+        """Arrow array of one quasi-identifier; mixed or nested values become strings, and so categorical"""
+        import pyarrow as pa
+
+        try:
+            column = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            column = None
+        if column is None or pa.types.is_nested(column.type):
+            column = pa.array([None if value is None else str(value) for value in values], pa.string())
+        return column
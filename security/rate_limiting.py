@@ -0,0 +1,170 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+# Rate limiter configuration
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", 100000))
+
+# Absorbs float error so an exactly refilled token is not rounded away. One microsecond, the
+# resolution of Redis TIME: wall-clock seconds are ~1.7e9, where float spacing is already ~2e-7
+_EPSILON = 1e-6
+
+class RateLimit:
+    """``rate`` requests per ``period`` seconds, of which up to ``burst`` may arrive at once
+
+    Enforced with GCRA, the generic cell rate algorithm: a token bucket that
+    refills one token every ``period / rate`` seconds and holds ``burst``
+    tokens, stored as a single theoretical arrival time per client.
+    """
+
+    def __init__(self, rate: int, period: float = 3600.0, burst: int = 1):
+        if rate <= 0 or period <= 0:
+            raise ValueError("Rate limit rate and period must be positive")
+        self.rate = rate
+        self.period = period
+        self.burst = max(1, burst)
+        self.emission_interval = period / rate
+        self.burst_offset = self.emission_interval * self.burst
+
+    @property
+    def policy(self) -> str:
+        return f"{self.rate};w={self.period:g};burst={self.burst}"
+
+class RateLimitDecision:
+    """Outcome of one rate limit check; times are in seconds from now"""
+
+    def __init__(self, limit: RateLimit, allowed: bool, remaining: int, reset_after: float, retry_after: float):
+        self.limit = limit
+        self.allowed = allowed
+        self.remaining = max(0, remaining)
+        self.reset_after = max(0.0, reset_after)
+        self.retry_after = max(0.0, retry_after)
+
+    def headers(self) -> Dict[str, str]:
+        """RateLimit-* headers (IETF httpapi draft), plus Retry-After when denied"""
+        headers = {
+            "RateLimit-Limit": str(self.limit.burst),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(math.ceil(self.reset_after)),
+            "RateLimit-Policy": self.limit.policy,
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+def gcra(tat: float, now: float, limit: RateLimit, cost: int = 1):
+    """Apply one request of ``cost`` tokens at ``now``; returns (new tat, decision)"""
+    tat = max(tat, now)
+    new_tat = tat + limit.emission_interval * cost
+    allow_at = new_tat - limit.burst_offset
+
+    if allow_at > now + _EPSILON:
+        remaining = math.floor((now - (tat - limit.burst_offset)) / limit.emission_interval + _EPSILON)
+        return tat, RateLimitDecision(limit, False, remaining, tat - now, allow_at - now)
+
+    remaining = math.floor((now - allow_at) / limit.emission_interval + _EPSILON)
+    return new_tat, RateLimitDecision(limit, True, remaining, new_tat - now, 0.0)
+
+class InMemoryStore:
+    """Per-process GCRA state: one float per active client
+
+    A client whose theoretical arrival time has passed has a full bucket,
+    which is the same as having no entry, so such idle clients are evicted
+    as later requests come in. At most ``max_clients`` entries are kept; past
+    that the least recently seen client is dropped (and starts over full).
+    """
+
+    def __init__(self, max_clients: int = RATE_LIMIT_MAX_CLIENTS, clock: Callable[[], float] = time.monotonic):
+        self.max_clients = max(1, max_clients)
+        self.clock = clock
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tats)
+
+    def hit(self, key: str, limit: RateLimit, cost: int = 1) -> RateLimitDecision:
+        with self._lock:
+            now = self.clock()
+            tat, decision = gcra(self._tats.pop(key, now), now, limit, cost)
+            self._tats[key] = tat
+            self._evict(now)
+        return decision
+
+    def _evict(self, now: float):
+        # Entries are ordered by last request, so idle ones collect at the front
+        while self._tats:
+            key, tat = next(iter(self._tats.items()))
+            if tat > now and len(self._tats) <= self.max_clients:
+                break
+            del self._tats[key]
+
+# Runs the same computation as gcra() inside Redis so that reading and
+# updating a client's state is atomic across replicas and costs one round
+# trip. Uses the server clock, so replicas need not agree on the time
+# (scripts calling TIME before writing need Redis 5+).
+GCRA_SCRIPT = """
+local emission_interval = tonumber(ARGV[1])
+local burst_offset = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local epsilon = 1e-6
+
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+
+local new_tat = tat + emission_interval * cost
+local allow_at = new_tat - burst_offset
+
+if allow_at > now + epsilon then
+    local remaining = math.floor((now - (tat - burst_offset)) / emission_interval + epsilon)
+    return {0, remaining, math.ceil((tat - now) * 1000), math.ceil((allow_at - now) * 1000)}
+end
+
+local reset_ms = math.ceil((new_tat - now) * 1000)
+redis.call('SET', KEYS[1], string.format('%.17g', new_tat), 'PX', reset_ms)
+local remaining = math.floor((now - allow_at) / emission_interval + epsilon)
+return {1, remaining, reset_ms, 0}
+"""
+
+class RedisStore:
+    """GCRA state shared by every replica through Redis (or anything speaking its protocol)
+
+    Each check is a single EVALSHA of ``GCRA_SCRIPT``. Keys expire when the
+    bucket would be full again, so idle clients cost nothing.
+    """
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        # register_script sends EVALSHA and only falls back to loading the script on NOSCRIPT
+        self._script = client.register_script(GCRA_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisStore":
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def hit(self, key: str, limit: RateLimit, cost: int = 1) -> RateLimitDecision:
+        allowed, remaining, reset_ms, retry_ms = self._script(
+            keys=[self.prefix + key],
+            args=[repr(limit.emission_interval), repr(limit.burst_offset), cost],
+        )
+        return RateLimitDecision(limit, bool(allowed), int(remaining), int(reset_ms) / 1000, int(retry_ms) / 1000)
+
+def create_store(backend: Optional[str] = None):
+    """Store selected by RATE_LIMIT_BACKEND: ``memory`` (per process) or ``redis`` (shared)"""
+    backend = backend or RATE_LIMIT_BACKEND
+    if backend == "memory":
+        return InMemoryStore()
+    if backend == "redis":
+        return RedisStore.from_url(RATE_LIMIT_REDIS_URL)
+    raise ValueError(f"Unknown rate limit backend: {backend}")